@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+'''Benchmark of the compression codecs of utils.compress_buf on real job
+files, e.g. fort.2, fort.6 and the crpoint_*.bin checkpoints.
+
+Usage: python benchmarks/bench_compression.py fort.2 fort.6 crpoint_pri.bin
+           [--levels 1 6 9]
+'''
+import os
+import sys
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parents[1].absolute()))
+from pysixdesk.lib import utils
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 6, 9])
+    args = parser.parse_args()
+    print(f"{'file':>20} {'codec':>6} {'level':>5} {'ratio':>7} "
+          f"{'comp [MB/s]':>12} {'decomp [MB/s]':>14}")
+    with tempfile.TemporaryDirectory() as tmp:
+        out = os.path.join(tmp, 'out')
+        for name in args.files:
+            size = os.path.getsize(name) / 1e6
+            for codec in utils.CODECS:
+                for level in args.levels:
+                    start = time.time()
+                    buf = utils.compress_buf(name, codec=codec, level=level)
+                    t_comp = time.time() - start
+                    start = time.time()
+                    utils.decompress_buf(buf, out)
+                    t_decomp = time.time() - start
+                    ratio = size / (len(buf) / 1e6)
+                    print(f'{os.path.basename(name):>20} {codec:>6} '
+                          f'{level:>5} {ratio:>7.2f} {size / t_comp:>12.1f} '
+                          f'{size / t_decomp:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+'''Benchmark of gather.gather_results on synthetic trees of fort.10 results,
+with one worker process and with a pool of worker processes.
+
+Usage: python benchmarks/bench_gather.py [--tasks 1000 10000 100000]
+           [--workers 8] [--rows 30]
+'''
+import os
+import sys
+import gzip
+import time
+import random
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parents[1].absolute()))
+from pysixdesk.lib import gather
+from pysixdesk.lib.pysixdb import SixDB
+from pysixdesk.lib.dbtable import Table
+
+
+class FakeCluster(object):
+    '''The cluster of the gathering, all the jobs are done'''
+
+    def check_running(self, *args, **kwargs):
+        return []
+
+    def download_from_spool(self, *args, **kwargs):
+        pass
+
+    def remove(self, *args, **kwargs):
+        pass
+
+
+def make_tree(path, ntasks, nrows):
+    '''Writes the fort.10.gz of ntasks tasks of nrows particle pairs'''
+    for task_id in range(1, ntasks + 1):
+        res = os.path.join(path, str(task_id), 'results', str(task_id))
+        os.makedirs(res)
+        lines = [' '.join(f'{random.random():.15e}' for _ in range(60))
+                 for _ in range(nrows)]
+        with gzip.open(os.path.join(res, 'fort.10.gz'), 'wt') as f_out:
+            f_out.write('\n'.join(lines) + '\n')
+
+
+def make_db(db_name, ntasks):
+    '''Creates the study tables with ntasks submitted jobs'''
+    table = Table({}, {}, 'sql')
+    table.customize_tables('sixtrack_task', ['fort.10'], 'MEDIUMBLOB')
+    tables = {k: table.tables[k] for k in
+              ['sixtrack_wu', 'sixtrack_task', 'six_results']}
+    db = SixDB({'db_type': 'sql', 'db_name': db_name}, create=True)
+    db.create_tables(tables, tables_indexes=table.table_indexes)
+    ids = list(range(1, ntasks + 1))
+    db.insertm('sixtrack_wu', {'wu_id': ids, 'last_turn': [100] * ntasks,
+                               'task_id': ids, 'unique_id': ids,
+                               'status': ['submitted'] * ntasks})
+    db.insertm('sixtrack_task', {'task_id': ids, 'wu_id': ids,
+                                 'last_turn': [100] * ntasks})
+    db.close()
+    return table.tables['six_results']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tasks', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--rows', type=int, default=30)
+    args = parser.parse_args()
+    print(f"{'tasks':>8} {'workers':>8} {'time [s]':>10} {'tasks/s':>10}")
+    for ntasks in args.tasks:
+        for workers in sorted({1, args.workers}):
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'sixtrack_output')
+                db_name = os.path.join(tmp, 'data.db')
+                make_tree(path, ntasks, args.rows)
+                six_results = make_db(db_name, ntasks)
+                cf = {'info': {'path': path, 'commit_every': 500,
+                               'workers': workers,
+                               'outs': Table.result_table(['fort.10'])},
+                      'db_setting': {'journal_mode': 'memory'},
+                      'db_info': {'db_type': 'sql', 'db_name': db_name},
+                      'six_results': six_results}
+                start = time.time()
+                gather.gather_results('sixtrack', cf, FakeCluster())
+                elapsed = time.time() - start
+                db = SixDB({'db_type': 'sql', 'db_name': db_name})
+                count = db.select('six_results', 'count(*)')[0][0]
+                db.close()
+                assert count == ntasks * args.rows, count
+                print(f'{ntasks:>8} {workers:>8} {elapsed:>10.2f} '
+                      f'{ntasks / elapsed:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
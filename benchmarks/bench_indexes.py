@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+'''Benchmark of the typical queries on sixtrack_wu without and with the
+secondary indexes declared in Table.table_indexes.
+
+Usage: python benchmarks/bench_indexes.py [--rows 1000000]
+'''
+import sys
+import time
+import random
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parents[1].absolute()))
+from pysixdesk.lib.pysixdb import SixDB
+from pysixdesk.lib.dbtable import Table
+
+
+def queries(db, nrows):
+    '''The queries done by Study and the workers on sixtrack_wu'''
+    task_ids = random.sample(range(nrows), 1000)
+    return {
+        'status count': lambda: db.select('sixtrack_wu', 'status, count(*)',
+                                          groupby=['status']),
+        'status=submitted': lambda: db.select('sixtrack_wu', ['wu_id'],
+                                              "status='submitted'"),
+        'batch_name like': lambda: db.select(
+            'sixtrack_wu', 'batch_name', "batch_name like '/study/six_%'",
+            DISTINCT=True),
+        '1000 task_id lookups': lambda: [
+            db.select('sixtrack_wu', ['wu_id'], f'task_id={i}')
+            for i in task_ids],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    args = parser.parse_args()
+    nrows = args.rows
+    table = Table({}, {}, 'sql')
+    tables = {'sixtrack_wu': table.tables['sixtrack_wu']}
+    with tempfile.TemporaryDirectory() as tmp:
+        db = SixDB({'db_type': 'sql', 'db_name': str(Path(tmp) / 'b.db')},
+                   create=True)
+        db.create_tables(tables, table.table_keys)
+        status = ['incomplete', 'submitted', 'complete']
+        db.insertm('sixtrack_wu', {
+            'wu_id': range(nrows),
+            'last_turn': [100] * nrows,
+            'task_id': range(nrows),
+            'batch_name': [f'/study/six_{i // 10000}' for i in range(nrows)],
+            'status': [status[i % 3] for i in range(nrows)]})
+        timings = {}
+        for label in ['without', 'with']:
+            if label == 'with':
+                start = time.time()
+                db.create_indexes(tables, table.table_indexes)
+                print(f'index creation: {time.time() - start:.2f} s')
+            for name, fun in queries(db, nrows).items():
+                start = time.time()
+                fun()
+                timings.setdefault(name, []).append(time.time() - start)
+        db.close()
+    print(f"{'query':>22} {'without [s]':>12} {'with [s]':>10}")
+    for name, (t0, t1) in timings.items():
+        print(f'{name:>22} {t0:>12.3f} {t1:>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+'''Benchmark of DatabaseAdaptor.updatem against the former row by row update.
+
+Usage: python benchmarks/bench_updatem.py [--rows 10000 100000 1000000]
+'''
+import sys
+import time
+import argparse
+import tempfile
+from pathlib import Path
+from contextlib import closing
+
+sys.path.insert(0, str(Path(__file__).parents[1].absolute()))
+from pysixdesk.lib import dbadaptor
+
+
+def prepare(adaptor, db_name, nrows):
+    conn = adaptor.new_connection(db_name)
+    columns = {'wu_id': 'INT', 'last_turn': 'INT', 'task_id': 'INT',
+               'mtime': 'BIGINT'}
+    keys = {'primary': ['wu_id', 'last_turn']}
+    adaptor.create_table(conn, 'sixtrack_wu', columns, keys, recreate=True)
+    adaptor.insertm(conn, 'sixtrack_wu',
+                    {'wu_id': range(nrows), 'last_turn': [100] * nrows,
+                     'task_id': [None] * nrows, 'mtime': [0] * nrows})
+    return conn
+
+
+def row_by_row(conn, values, where):
+    '''The update loop used before updatem was batched.'''
+    keys = list(values.keys())
+    keys_where = list(where.keys())
+    sets = ','.join([f'{k}=?' for k in keys])
+    for val, val_where in zip(zip(*values.values()), zip(*where.values())):
+        cond = ' and '.join(['='.join(map(str, it))
+                             for it in zip(keys_where, val_where)])
+        with closing(conn.cursor()) as c:
+            c.execute('UPDATE sixtrack_wu SET %s where %s' % (sets, cond), val)
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+    adaptor = dbadaptor.SQLDatabaseAdaptor()
+    print(f"{'rows':>10} {'row by row [rows/s]':>22} {'updatem [rows/s]':>18}")
+    for nrows in args.rows:
+        values = {'task_id': list(range(nrows)), 'mtime': [1] * nrows}
+        where = {'wu_id': list(range(nrows)), 'last_turn': [100] * nrows}
+        rates = []
+        for fun in [row_by_row, adaptor.updatem]:
+            with tempfile.TemporaryDirectory() as tmp:
+                conn = prepare(adaptor, str(Path(tmp) / 'bench.db'), nrows)
+                start = time.time()
+                if fun is row_by_row:
+                    fun(conn, values, where)
+                else:
+                    fun(conn, 'sixtrack_wu', values, where)
+                rates.append(nrows / (time.time() - start))
+                conn.close()
+        print(f'{nrows:>10} {rates[0]:>22.0f} {rates[1]:>18.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+import os
+import hashlib
+import tempfile
+
+
+class BlobStore(object):
+    """
+    Content-addressed store of the large task files, outside of the database.
+
+    A buffer is saved in a file named by its sha1 digest, in sharded
+    sub folders (ab/cd/abcd...), and the database only keeps a short
+    reference to it. Identical buffers are stored once. The store must be
+    reachable from the jobs, e.g. on a shared file system.
+    """
+
+    # the references start with this prefix, which can't be the start of a
+    # gzip buffer, so they are told apart from the buffers kept in the db
+    prefix = b'blob:sha1:'
+
+    def __init__(self, path, min_size=4096):
+        """
+        Args:
+            path (str): the root folder of the store.
+            min_size (int, optional): the smaller buffers are kept in the
+                database.
+        """
+        self.path = path
+        self.min_size = int(min_size)
+
+    def is_ref(self, value):
+        """
+        Checks if a database value is a reference to the store.
+
+        Args:
+            value: the value of a blob column.
+
+        Returns:
+            bool: True if value is a reference.
+        """
+        return isinstance(value, bytes) and value.startswith(self.prefix)
+
+    def file_path(self, digest):
+        """
+        Gets the path of the file holding a buffer.
+
+        Args:
+            digest (str): the sha1 hex digest of the buffer.
+
+        Returns:
+            str: the path of the file.
+        """
+        return os.path.join(self.path, digest[:2], digest[2:4], digest)
+
+    def put(self, buf):
+        """
+        Stores a buffer, unless it is smaller than min_size or already in the
+        store.
+
+        Args:
+            buf (bytes): the buffer.
+
+        Returns:
+            bytes: the value to be stored in the database, the reference or
+                the buffer itself.
+        """
+        if not isinstance(buf, bytes) or len(buf) < self.min_size:
+            return buf
+        digest = hashlib.sha1(buf).hexdigest()
+        name = self.file_path(digest)
+        if not os.path.exists(name):
+            folder = os.path.dirname(name)
+            os.makedirs(folder, exist_ok=True)
+            # write to a temporary file first, concurrent writers of the
+            # same content then never leave a truncated file behind
+            fd, tmp = tempfile.mkstemp(dir=folder)
+            try:
+                with os.fdopen(fd, 'wb') as f_out:
+                    f_out.write(buf)
+                os.replace(tmp, name)
+            except BaseException:
+                os.remove(tmp)
+                raise
+        return self.prefix + digest.encode()
+
+    def get(self, value):
+        """
+        Resolves a database value.
+
+        Args:
+            value: the value of a blob column.
+
+        Returns:
+            bytes: the stored buffer if value is a reference, value otherwise.
+
+        Raises:
+            FileNotFoundError: If the referenced buffer isn't in the store.
+        """
+        if not self.is_ref(value):
+            return value
+        digest = value[len(self.prefix):].decode()
+        name = self.file_path(digest)
+        if not os.path.isfile(name):
+            raise FileNotFoundError(f"The blob {digest} isn't in the store "
+                                    f"{self.path}!")
+        with open(name, 'rb') as f_in:
+            return f_in.read()
@@ -10,11 +10,61 @@ class DatabaseAdaptor(ABC):
 
     def __init__(self):
         self._logger = logging.getLogger(__name__)
+        # state of the open transaction, see begin/end
+        self._depth = 0
+        self._pending = 0
+        self._commit_every = None
 
     @abstractmethod
     def new_connection(self, name):
         pass
 
+    def begin(self, conn, commit_every=None):
+        '''Open a transaction, the commits are deferred until the matching
+        call of end. Nested transactions are savepoints of the outermost one.
+        @commit_every(int) Commit every N statements instead of only at the
+        end of the transaction, the commits wait for the nested ones to end
+        '''
+        if self._depth == 0:
+            self._pending = 0
+            self._commit_every = commit_every
+        else:
+            with closing(conn.cursor()) as c:
+                # sqlite3 only opens the transaction before a data change
+                if not getattr(conn, 'in_transaction', True):
+                    c.execute('BEGIN')
+                c.execute('SAVEPOINT sp%d' % self._depth)
+        self._depth += 1
+
+    def end(self, conn, rollback=False):
+        '''Close a transaction opened with begin. The outermost one commits
+        the pending statements or rolls them back, a nested one only rolls
+        back its own statements.'''
+        self._depth -= 1
+        if self._depth:
+            with closing(conn.cursor()) as c:
+                if rollback:
+                    c.execute('ROLLBACK TO SAVEPOINT sp%d' % self._depth)
+                c.execute('RELEASE SAVEPOINT sp%d' % self._depth)
+            return
+        if rollback:
+            conn.rollback()
+        else:
+            conn.commit()
+        self._pending = 0
+        self._commit_every = None
+
+    def commit(self, conn):
+        '''Commit the last statement, unless a transaction is open'''
+        if self._depth == 0:
+            conn.commit()
+            return
+        self._pending += 1
+        if (self._commit_every and self._pending >= self._commit_every and
+                self._depth == 1):
+            conn.commit()
+            self._pending = 0
+
     @abstractmethod
     def setting(self, conn, settings):
         pass
@@ -51,14 +101,44 @@ class DatabaseAdaptor(ABC):
         sql_cmd = sql % (name, fill)
         c.execute(sql_cmd)
         c.close()
-        conn.commit()
+        self.commit(conn)
+
+    def create_index(self, conn, table_name, index_name, index_cols,
+                     columns={}, unique=False):
+        '''Create a secondary index if it doesn't exist yet
+        @conn A connection of database
+        @table_name(str) The table name
+        @index_name(str) The index name
+        @index_cols(list) The indexed columns
+        @columns(dict) The column types of the table
+        @unique(bool) Whether the indexed values must be unique
+        '''
+        cols = ','.join([f"`{i.replace('.', '_')}`" for i in index_cols])
+        sql = 'CREATE %sINDEX IF NOT EXISTS %s ON %s (%s)' % (
+                'UNIQUE ' if unique else '', index_name, table_name, cols)
+        with closing(conn.cursor()) as c:
+            c.execute(sql)
+        self.commit(conn)
+
+    def add_column(self, conn, table_name, name, dtype):
+        '''Add a column to an existing table
+        @conn A connection of database
+        @table_name(str) The table name
+        @name(str) The column name
+        @dtype(str) The column type
+        '''
+        sql = 'ALTER TABLE %s ADD COLUMN `%s` %s' % (
+                table_name, name.replace('.', '_'), dtype)
+        with closing(conn.cursor()) as c:
+            c.execute(sql)
+        self.commit(conn)
 
     def drop_table(self, conn, table_name):
         '''Drop an exist table'''
         with closing(conn.cursor()) as c:
             sql = 'DROP TABLE IF EXISTS %s' % table_name
             c.execute(sql)
-        conn.commit()
+        self.commit(conn)
 
     def insert(self, conn, table_name, values, ph):
         '''Insert a row of values
@@ -78,18 +158,23 @@ class DatabaseAdaptor(ABC):
         sql_cmd = sql % (table_name, cols, ques)
         with closing(conn.cursor()) as c:
             c.execute(sql_cmd, vals)
-        conn.commit()
+        self.commit(conn)
 
-    def insertm(self, conn, table_name, values, ph):
+    def insertm(self, conn, table_name, values, ph, ignore=False):
         '''Insert multiple rows once
         @conn A connection of database
         @table_name(str) The table name
         @values(dict) The values required to insert into database
         @ph The placeholder for the selected database, e.g. ?, %s
+        @ignore(bool) Skip the rows violating a unique index instead of
+        raising an error
+        @return(int) The number of inserted rows
         '''
         if len(values) == 0:
-            return
+            return 0
         sql = 'INSERT INTO %s (%s) VALUES (%s)'
+        if ignore:
+            sql = self.insert_ignore + ' INTO %s (%s) VALUES (%s)'
         keys = list(values.keys())
         vals = [values[key] for key in keys]
         keys = [f"`{i.replace('.', '_')}`" for i in keys]
@@ -99,7 +184,9 @@ class DatabaseAdaptor(ABC):
         vals = list(zip(*vals))
         with closing(conn.cursor()) as c:
             c.executemany(sql_cmd, vals)
-        conn.commit()
+            count = c.rowcount
+        self.commit(conn)
+        return count
 
     def select(self, conn, table_name, cols='*', where=None, orderby=None,
                **kwargs):
@@ -113,6 +200,50 @@ class DatabaseAdaptor(ABC):
         '''
         if len(cols) == 0:
             return []
+        sql = self._select_sql(table_name, cols, where, orderby, **kwargs)
+        with closing(conn.cursor()) as c:
+            c.execute(sql)
+            data = c.fetchall()
+        return data
+
+    def iter_select(self, conn, table_name, cols='*', where=None,
+                    orderby=None, size=10000, **kwargs):
+        '''Select values with conditions and yield the rows one by one,
+        fetching them from the database in batches
+        @conn A connection of database
+        @table_name(str) The table name
+        @cols(list) The column names
+        @where(str) Selection condition
+        @orderby(list) Order condition
+        @size(int) The number of rows fetched at once
+        @**kwargs Some other conditions
+        '''
+        for data in self.select_batches(conn, table_name, cols, where,
+                                        orderby, size, **kwargs):
+            yield from data
+
+    def select_batches(self, conn, table_name, cols='*', where=None,
+                       orderby=None, size=10000, **kwargs):
+        '''Select values with conditions and yield them in lists of at
+        most size rows, see iter_select'''
+        if len(cols) == 0:
+            return
+        sql = self._select_sql(table_name, cols, where, orderby, **kwargs)
+        with closing(self.stream_cursor(conn)) as c:
+            c.execute(sql)
+            while True:
+                data = c.fetchmany(size)
+                if not data:
+                    break
+                yield data
+
+    def stream_cursor(self, conn):
+        '''Return a cursor which doesn't buffer the whole result set'''
+        return conn.cursor()
+
+    @staticmethod
+    def _select_sql(table_name, cols='*', where=None, orderby=None, **kwargs):
+        '''Build the sql command of a selection'''
         if (isinstance(cols, Iterable) and not isinstance(cols, str)):
             cols = [f"`{i.replace('.', '_')}`" for i in cols]
             cols = ','.join(cols)
@@ -127,10 +258,7 @@ class DatabaseAdaptor(ABC):
             sql += ' ORDER BY %s' % (','.join(orderby))
         if 'limit' in kwargs.keys() and kwargs['limit']:
             sql += ' limit %s' % kwargs['limit']
-        with closing(conn.cursor()) as c:
-            c.execute(sql)
-            data = c.fetchall()
-        return data
+        return sql
 
     def update(self, conn, table_name, values, where, ph):
         '''Update data in a table
@@ -155,7 +283,7 @@ class DatabaseAdaptor(ABC):
         sql_cmd = sql % (table_name, sets)
         with closing(conn.cursor()) as c:
             c.execute(sql_cmd, vals)
-        conn.commit()
+        self.commit(conn)
 
     def updatem(self, conn, table_name, values, where, ph):
         '''Update multi data in a table
@@ -169,25 +297,26 @@ class DatabaseAdaptor(ABC):
 
         if len(values) == 0:
             return
-        sql = 'UPDATE %s SET %s where %s'
-        keys = values.keys()
-        keys = [i.replace('.', '_') for i in keys]
-        vals = [values[key] for key in keys]
-        valsn = zip(*vals)
-        keys_where = where.keys()
-        keys_where = [i.replace('.', '_') for i in keys_where]
-        vals_where = [where[key] for key in keys_where]
-        vals_wheren = zip(*vals_where)
-        for val, val_where in zip(valsn, vals_wheren):
-            ques = (ph,) * len(keys)
-            sets = ['='.join(it) for it in zip(keys, ques)]
-            sets = ','.join(sets)
-            sets_where = ['='.join(map(str, it)) for it in zip(keys_where, val_where)]
-            sets_where = ' and '.join(sets_where)
-            sql_cmd = sql % (table_name, sets, sets_where)
-            with closing(conn.cursor()) as c:
-                c.execute(sql_cmd, val)
-        conn.commit()
+        sql_cmd, vals = self._updatem_sql(table_name, values, where, ph)
+        with closing(conn.cursor()) as c:
+            c.executemany(sql_cmd, vals)
+        self.commit(conn)
+
+    @staticmethod
+    def _updatem_sql(table_name, values, where, ph):
+        '''Prepare the parameterized statement and the rows for updatem.
+        The statement is built only once, both the new values and the where
+        values are bound through placeholders.
+        '''
+        keys = list(values.keys())
+        keys_where = list(where.keys())
+        sets = ','.join([f"`{i.replace('.', '_')}`={ph}" for i in keys])
+        sets_where = ' and '.join([f"`{i.replace('.', '_')}`={ph}"
+                                   for i in keys_where])
+        sql_cmd = 'UPDATE %s SET %s WHERE %s' % (table_name, sets, sets_where)
+        cols = [values[key] for key in keys] + [where[key] for key in keys_where]
+        vals = list(zip(*cols))
+        return sql_cmd, vals
 
     def delete(self, conn, table_name, where):
         '''Remove rows based on specified conditions
@@ -198,11 +327,47 @@ class DatabaseAdaptor(ABC):
         sql = 'DELETE FROM %s WHERE %s' % (table_name, where)
         with closing(conn.cursor()) as c:
             c.execute(sql)
-        conn.commit()
+        self.commit(conn)
+
+    def deletem(self, conn, table_name, where, ph):
+        '''Remove multi rows, the where values are bound to placeholders
+        @conn A connection of database
+        @table_name(str) The table name
+        @where(dict) The column names with the values of the removed rows
+        @ph The placeholder for the selected database, e.g. ?, %s
+        '''
+        if len(where) == 0:
+            return
+        keys = list(where.keys())
+        sets_where = ' and '.join([f"`{i.replace('.', '_')}`={ph}"
+                                   for i in keys])
+        sql_cmd = 'DELETE FROM %s WHERE %s' % (table_name, sets_where)
+        vals = list(zip(*[where[key] for key in keys]))
+        with closing(conn.cursor()) as c:
+            c.executemany(sql_cmd, vals)
+        self.commit(conn)
+
+    def execute(self, conn, sql, args=None):
+        '''Execute a modifying sql statement, e.g. INSERT ... SELECT
+        @conn A connection of database
+        @sql(str) The sql statement
+        @args(list) The values bound to the placeholders of the statement
+        @return(int) The number of affected rows
+        '''
+        with closing(conn.cursor()) as c:
+            if args is None:
+                c.execute(sql)
+            else:
+                c.execute(sql, args)
+            count = c.rowcount
+        self.commit(conn)
+        return count
 
 
 class SQLDatabaseAdaptor(DatabaseAdaptor):
 
+    insert_ignore = 'INSERT OR IGNORE'
+
     def __init__(self):
         super().__init__()
 
@@ -233,6 +398,24 @@ class SQLDatabaseAdaptor(DatabaseAdaptor):
         super(SQLDatabaseAdaptor, self).create_table(conn, name, columns, keys,
                                                      recreate)
 
+    def attach(self, conn, db_name, alias):
+        '''Attach another database file to the connection under alias, not
+        allowed within a transaction'''
+        if self._depth:
+            raise RuntimeError("Can't attach a database within a transaction!")
+        conn.commit()
+        with closing(conn.cursor()) as c:
+            c.execute('ATTACH DATABASE ? AS %s' % alias, (db_name,))
+
+    def detach(self, conn, alias):
+        '''Detach a database attached to the connection, not allowed within
+        a transaction'''
+        if self._depth:
+            raise RuntimeError("Can't detach a database within a transaction!")
+        conn.commit()
+        with closing(conn.cursor()) as c:
+            c.execute('DETACH DATABASE %s' % alias)
+
     def fetch_tables(self, conn):
         '''Fetch all the table names in the database'''
         with closing(conn.cursor()) as c:
@@ -240,13 +423,21 @@ class SQLDatabaseAdaptor(DatabaseAdaptor):
             out = c.fetchall()
         return list(out)
 
+    def fetch_columns(self, conn, table_name):
+        '''Fetch the column names of a table'''
+        with closing(conn.cursor()) as c:
+            c.execute('PRAGMA table_info(%s)' % table_name)
+            out = c.fetchall()
+        return [i[1] for i in out]
+
     def insert(self, conn, table_name, values):
         '''Insert a row of values'''
         super(SQLDatabaseAdaptor, self).insert(conn, table_name, values, '?')
 
-    def insertm(self, conn, table_name, values):
+    def insertm(self, conn, table_name, values, ignore=False):
         '''Insert multi rows of values'''
-        super(SQLDatabaseAdaptor, self).insertm(conn, table_name, values, '?')
+        return super(SQLDatabaseAdaptor, self).insertm(conn, table_name,
+                                                       values, '?', ignore)
 
     def update(self, conn, table_name, values, where):
         '''update values'''
@@ -258,9 +449,17 @@ class SQLDatabaseAdaptor(DatabaseAdaptor):
         super(SQLDatabaseAdaptor, self).updatem(conn, table_name, values,
                                                 where, '?')
 
+    def deletem(self, conn, table_name, where):
+        '''remove rows'''
+        super(SQLDatabaseAdaptor, self).deletem(conn, table_name, where, '?')
+
 
 class MySQLDatabaseAdaptor(DatabaseAdaptor):
 
+    insert_ignore = 'INSERT IGNORE'
+    # number of rows from which updatem goes through a temporary table
+    tmp_table_threshold = 1000
+
     def __init__(self):
         super().__init__()
 
@@ -361,6 +560,33 @@ class MySQLDatabaseAdaptor(DatabaseAdaptor):
         super(MySQLDatabaseAdaptor, self).create_table(conn, name, columns,
                                                        keys, recreate)
 
+    def create_index(self, conn, table_name, index_name, index_cols,
+                     columns={}, unique=False):
+        '''Create a secondary index if it doesn't exist yet. MySQL can only
+        index a prefix of the text and blob columns.'''
+        with closing(conn.cursor()) as c:
+            c.execute("SHOW INDEX FROM %s WHERE Key_name='%s'" % (
+                      table_name, index_name))
+            if c.fetchall():
+                return
+            cols = []
+            for col in index_cols:
+                typ = columns.get(col, '').lower()
+                col = f"`{col.replace('.', '_')}`"
+                if 'text' in typ or 'blob' in typ:
+                    col += '(255)'
+                cols.append(col)
+            sql = 'CREATE %sINDEX %s ON %s (%s)' % (
+                    'UNIQUE ' if unique else '', index_name, table_name,
+                    ','.join(cols))
+            c.execute(sql)
+        self.commit(conn)
+
+    def stream_cursor(self, conn):
+        '''Return an unbuffered cursor, the rows stay on the server until
+        they are fetched'''
+        return conn.cursor(pymysql.cursors.SSCursor)
+
     def fetch_tables(self, conn):
         '''Fetch all the table names in the database'''
         with conn.cursor() as c:
@@ -368,22 +594,62 @@ class MySQLDatabaseAdaptor(DatabaseAdaptor):
             a = list(c)
         return a
 
+    def fetch_columns(self, conn, table_name):
+        '''Fetch the column names of a table'''
+        with conn.cursor() as c:
+            c.execute("show columns from %s" % table_name)
+            a = [i[0] for i in c]
+        return a
+
     def insert(self, conn, table_name, values):
         '''Insert a row of values'''
         super(MySQLDatabaseAdaptor, self).insert(conn, table_name, values,
                                                  '%s')
 
-    def insertm(self, conn, table_name, values):
+    def insertm(self, conn, table_name, values, ignore=False):
         '''Insert multi rows of values'''
-        super(MySQLDatabaseAdaptor, self).insertm(conn, table_name, values,
-                                                  '%s')
+        return super(MySQLDatabaseAdaptor, self).insertm(conn, table_name,
+                                                         values, '%s', ignore)
 
     def update(self, conn, table_name, values, where):
         '''update values'''
         super(MySQLDatabaseAdaptor, self).update(conn, table_name, values,
                                                  where, '%s')
 
+    def deletem(self, conn, table_name, where):
+        '''remove rows'''
+        super(MySQLDatabaseAdaptor, self).deletem(conn, table_name, where,
+                                                  '%s')
+
     def updatem(self, conn, table_name, values, where):
-        '''update values'''
-        super(MySQLDatabaseAdaptor, self).updatem(conn, table_name, values,
-                                                 where, '%s')
+        '''update values
+        pymysql only batches INSERT statements in executemany, an UPDATE is
+        still sent row by row. Large batches are therefore loaded into a
+        temporary table first and applied with a single UPDATE ... JOIN.
+        '''
+        if len(values) == 0:
+            return
+        nrows = len(next(iter(values.values())))
+        if nrows < self.tmp_table_threshold:
+            super(MySQLDatabaseAdaptor, self).updatem(conn, table_name, values,
+                                                     where, '%s')
+            return
+        keys = [f"`{i.replace('.', '_')}`" for i in values.keys()]
+        keys_where = [f"`{i.replace('.', '_')}`" for i in where.keys()]
+        tmp_name = '%s_updatem_tmp' % table_name
+        cols = ','.join(keys_where + keys)
+        ques = ','.join(('%s',) * (len(keys_where) + len(keys)))
+        data = [where[key] for key in where.keys()]
+        data += [values[key] for key in values.keys()]
+        ons = ' and '.join([f't.{k}=tmp.{k}' for k in keys_where])
+        sets = ','.join([f't.{k}=tmp.{k}' for k in keys])
+        with closing(conn.cursor()) as c:
+            c.execute('DROP TEMPORARY TABLE IF EXISTS %s' % tmp_name)
+            c.execute('CREATE TEMPORARY TABLE %s SELECT %s FROM %s LIMIT 0' %
+                      (tmp_name, cols, table_name))
+            c.executemany('INSERT INTO %s (%s) VALUES (%s)' %
+                          (tmp_name, cols, ques), list(zip(*data)))
+            c.execute('UPDATE %s t JOIN %s tmp ON %s SET %s' %
+                      (table_name, tmp_name, ons, sets))
+            c.execute('DROP TEMPORARY TABLE %s' % tmp_name)
+        self.commit(conn)
@@ -6,9 +6,13 @@ from . import dbtypedict
 class Table(object):
     '''This class aims to initialize and customize the database tables'''
 
-    def __init__(self, tables, table_keys, db_type):
+    def __init__(self, tables, table_keys, db_type, table_indexes=None):
         self.tables = tables
         self.table_keys = table_keys
+        # secondary indexes, {table: {index name: [columns]}}
+        if table_indexes is None:
+            table_indexes = {}
+        self.table_indexes = table_indexes
         self.db_type = db_type
         if db_type.lower() == 'sql':
             self.type_dict = dbtypedict.SQLiteDict()
@@ -19,6 +23,7 @@ class Table(object):
         self.tables['boinc_vars'] = OrderedDict()
         self.init_preprocess_tables()
         self.init_sixtrack_tables()
+        self.init_gather_tables()
 
     @staticmethod
     def result_table(filelist):
@@ -61,12 +66,19 @@ class Table(object):
             ('unique_id', 'text'),
             ('status', 'text'),
             ('task_id', 'int'),
+            ('param_hash', 'varchar(40)'),
             ('mtime', 'bigint')])
         self.table_keys['preprocess_wu'] = {
             'primary': ['wu_id'],
             'autoincrement': ['wu_id'],
             'foreign': {},
         }
+        self.table_indexes['preprocess_wu'] = {
+            'status': ['status'],
+            'task_id': ['task_id'],
+            'batch_name': ['batch_name', 'status'],
+            'param_hash': {'columns': ['param_hash'], 'unique': True},
+        }
         self.tables['preprocess_task'] = OrderedDict([
             ('task_id', 'INTEGER'),
             ('wu_id', 'int'),
@@ -82,6 +94,10 @@ class Table(object):
             'autoincrement': ['task_id'],
             'foreign': {'preprocess_wu': [['wu_id'], ['wu_id']]},
         }
+        self.table_indexes['preprocess_task'] = {
+            'wu_id': ['wu_id', 'status'],
+            'mtime': ['mtime'],
+        }
 
     def init_sixtrack_tables(self):
         self.tables['sixtrack_wu'] = OrderedDict([
@@ -95,11 +111,19 @@ class Table(object):
             ('status', 'text'),
             ('task_id', 'int'),
             ('boinc', 'text'),
+            ('param_hash', 'varchar(40)'),
             ('mtime', 'bigint')])
         self.table_keys['sixtrack_wu'] = {
             'primary': ['wu_id', 'last_turn'],
             'foreign': {'preprocess_wu': [['preprocess_id'], ['wu_id']]},
         }
+        self.table_indexes['sixtrack_wu'] = {
+            'status': ['status'],
+            'task_id': ['task_id'],
+            'batch_name': ['batch_name', 'status'],
+            'preprocess_id': ['preprocess_id'],
+            'param_hash': {'columns': ['param_hash'], 'unique': True},
+        }
         self.tables['sixtrack_task'] = OrderedDict([
             ('task_id', 'INTEGER'),
             ('wu_id', 'int'),
@@ -123,6 +147,10 @@ class Table(object):
             'foreign': {'sixtrack_wu': [['wu_id', 'last_turn'],
                                         ['wu_id', 'last_turn']]},
         }
+        self.table_indexes['sixtrack_task'] = {
+            'wu_id': ['wu_id', 'last_turn', 'status'],
+            'mtime': ['mtime'],
+        }
         self.tables['six_results'] = OrderedDict([
             ('task_id', 'int'),
             ('row_num', 'int'),
@@ -219,6 +247,9 @@ class Table(object):
             ('tunex2', 'float'),
             ('tuney2', 'float'),
             ('mtime', 'bigint')])
+        self.table_indexes['oneturn_sixtrack_results'] = {
+            'task_id': ['task_id'],
+        }
 
     def init_collimation_tables(self):
         self.tables['aperture_losses'] = OrderedDict([
@@ -299,3 +330,15 @@ class Table(object):
             'primary': ['task_id', 'row_num'],
             'foreign': {'sixtrack_task': [['task_id'], ['task_id']]},
         }
+
+    def init_gather_tables(self):
+        # the gathered group directories with their modification times, for
+        # the incremental gathering
+        self.tables['gather_manifest'] = OrderedDict([
+            ('jobtype', 'varchar(20)'),
+            ('path', 'varchar(255)'),
+            ('mtime', 'bigint')])
+        self.table_keys['gather_manifest'] = {
+            'primary': ['jobtype', 'path'],
+            'foreign': {},
+        }
@@ -1,3 +1,22 @@
+def numpy_dtype(sql_type):
+    """
+    Gets the NumPy dtype matching a column type of the database tables.
+
+    Args:
+        sql_type (str): column type, e.g. 'int', 'BIGINT', 'float', 'text'.
+
+    Returns:
+        str: 'i8' for integer types, 'f8' for floating point types and 'O'
+            for anything else (text and blob columns).
+    """
+    sql_type = sql_type.split()[0].split('(')[0].lower()
+    if sql_type in ['int', 'integer', 'bigint', 'smallint', 'tinyint']:
+        return 'i8'
+    if sql_type in ['float', 'double', 'real']:
+        return 'f8'
+    return 'O'
+
+
 def bigint_check(val):
     """
     Checks to see if `val` is or contains BIGINTs.
@@ -8,9 +8,13 @@ import shutil
 import getpass
 import zipfile
 import logging
+import itertools
+import collections
+
+from concurrent.futures import ProcessPoolExecutor
 
 from .pysixdb import SixDB
-from .resultparser import parse_results
+from .resultparser import parse_results, index_outputs, StreamedResult
 
 logger = logging.getLogger(__name__)
 
@@ -51,6 +55,19 @@ def gather_results(jobtype, cf, cluster):
     db_info = cf['db_info']
     db = SixDB(db_info, settings=set_sec, create=False)
     file_list = info_sec['outs']
+    boinc = ('boinc' in cf['info'].keys()) and cf['info']['boinc']
+    # only the group directories which changed since the last gathering are
+    # visited, the boinc results don't come through them
+    incremental = info_sec.get('incremental', False) and not boinc
+    if incremental:
+        item_groups = changed_groups(db, jobtype, type_path)
+        if not item_groups:
+            content = f"There isn't new {jobtype} result in path {type_path}!"
+            logger.info(content)
+            db.close()
+            return
+    else:
+        item_groups = dict.fromkeys(os.listdir(type_path))
     where = "status='submitted'"
     job_ids = db.select(f'{jobtype}_wu', ['task_id', 'unique_id'], where)
     job_ids = [(str(i), str(j)) for i, j in job_ids]
@@ -58,7 +75,7 @@ def gather_results(jobtype, cf, cluster):
     studypath = os.path.dirname(type_path)
     unfin = cluster.check_running(studypath)#clusterId.processId
     jbin = dict(job_index)
-    running_jobs = [taid for taid, unid in jbin.items() if unid in unfin]
+    running_jobs = {taid for taid, unid in jbin.items() if unid in unfin}
     [job_index.pop(taid) for taid in running_jobs]
     if running_jobs:
         content = f"{len(running_jobs)} {jobtype} tasks aren't completed yet!"
@@ -66,7 +83,7 @@ def gather_results(jobtype, cf, cluster):
     valid_task_ids = list(job_index.keys())
     cluster.download_from_spool(studypath)
 
-    if ('boinc' in cf['info'].keys()) and cf['info']['boinc']:
+    if boinc:
         content = "Downloading results from boinc spool!"
         logger.info(content)
         task_ids = download_from_boinc(info_sec)
@@ -78,59 +95,218 @@ def gather_results(jobtype, cf, cluster):
             logger.warning(content)
         valid_task_ids = task_ids
 
-    parent_cf = {}
-    for sec in cf:
-        parent_cf[sec] = cf[sec]
-    coll_action = False
-    for item_group in os.listdir(type_path):
-        item_list = item_group.split('-')
+    # the workers only need the result table sections
+    result_cf = {sec: cf[sec] for sec in file_list.values() if sec in cf}
+    valid_task_ids = set(valid_task_ids)
+    groups = []
+    for item_group in item_groups:
         job_path = os.path.join(type_path, item_group)
-        for item in item_list:
-            if item not in valid_task_ids:
-                continue
-            result_cf = copy.deepcopy(parent_cf)
-            job_table = {}
-            task_table = {}
-            task_table['status'] = 'Success'
-            if os.path.isdir(job_path) and os.listdir(job_path):
-                # parse the results
-                parse_results(jobtype, item, job_path, file_list, task_table,
-                              result_cf)
+        items = [i for i in item_group.split('-') if i in valid_task_ids]
+        groups.append((job_path, items))
+    workers = int(info_sec.get('workers') or os.cpu_count() or 1)
+    # the results of `commit_every` group directories are written in one
+    # transaction, the directories are only removed once it is committed
+    step = max(int(info_sec.get('commit_every', 0)) or len(groups), 1)
+    coll_action = False
+    compression = info_sec.get('compression', {})
+    parsed = parse_groups(jobtype, groups, file_list, result_cf, workers,
+                          compression)
+    while True:
+        done_groups = list(itertools.islice(parsed, step))
+        if not done_groups:
+            break
+        with db.transaction():
+            tasks = [task for _, group in done_groups for task in group]
+            if store_tasks(db, jobtype, tasks):
                 coll_action = True
-                where = 'task_id=%s' % item
-                db.update(f'{jobtype}_task', task_table, where)
-                for sec, vals in result_cf.items():
-                    vals['task_id'] = [item]*len(vals['mtime'])
-                    db.insertm(sec, vals)
-                if task_table['status'] == 'Success':
-                    job_table['status'] = 'complete'
-                    job_table['mtime'] = int(time.time() * 1E7)
-                    where = "task_id=%s" % item
-                    db.update(f'{jobtype}_wu', job_table, where)
-                    content = f"{jobtype} task {item} has completed normally!"
-                    logger.info(content)
-                else:
-                    where = "task_id=%s" % item
-                    job_table['status'] = 'incomplete'
-                    db.update(f'{jobtype}_wu', job_table, where)
-            else:
-                where = 'task_id=%s' % item
-                task_table['status'] = 'Failed'
-                db.update(f'{jobtype}_task', task_table, where)
-                content = "This is a failed job!"
-                logger.warning(content)
-            item_path = os.path.join(job_path, 'results', item)
-            if os.path.exists(item_path):
-                shutil.rmtree(item_path)
-        res_path = os.path.join(job_path, 'results')
-        if os.path.isdir(res_path) and (not os.listdir(res_path)):
-            shutil.rmtree(job_path)
+            if incremental:
+                # the groups are skipped until their signature changes, the
+                # ones with outputs of tasks still in the queue are visited
+                # again as nothing may change once the tasks leave it
+                done = {}
+                for job_path, _ in done_groups:
+                    name = os.path.basename(job_path)
+                    res_path = os.path.join(job_path, 'results')
+                    if not any(os.path.isdir(os.path.join(res_path, i))
+                               for i in name.split('-') if i in running_jobs):
+                        done[name] = item_groups[name]
+                update_manifest(db, jobtype, done)
+        for job_path, group in done_groups:
+            for item, _ in group:
+                item_path = os.path.join(job_path, 'results', item)
+                if os.path.exists(item_path):
+                    shutil.rmtree(item_path)
+            res_path = os.path.join(job_path, 'results')
+            if os.path.isdir(res_path) and (not os.listdir(res_path)):
+                shutil.rmtree(job_path)
     if coll_action:
         # remove the completed condor jobs (when using spool option)
         cluster.remove(studypath, 4)
     db.close()
 
 
+def scan_groups(type_path):
+    '''Scan the group directories of type_path, return a dict group name -->
+    signature. The signature is the latest modification time (ns) of the
+    directory and of its results folder, it changes when job outputs arrive.
+    '''
+    groups = {}
+    with os.scandir(type_path) as entries:
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            mtime = entry.stat().st_mtime_ns
+            res_path = os.path.join(entry.path, 'results')
+            if os.path.isdir(res_path):
+                mtime = max(mtime, os.stat(res_path).st_mtime_ns)
+            groups[entry.name] = mtime
+    return groups
+
+
+def changed_groups(db, jobtype, type_path):
+    '''Compare the group directories of type_path with the gather_manifest
+    table, return the new or changed ones as a dict group name -->
+    signature. The rows of the removed directories are dropped.'''
+    where = f"jobtype='{jobtype}'"
+    manifest = dict(db.select('gather_manifest', ['path', 'mtime'], where))
+    groups = scan_groups(type_path)
+    removed = [i for i in manifest if i not in groups]
+    if removed:
+        db.removem('gather_manifest', {'jobtype': [jobtype] * len(removed),
+                                       'path': removed})
+    changed = {k: v for k, v in groups.items() if manifest.get(k) != v}
+    content = (f"{len(changed)} of {len(groups)} {jobtype} group directories "
+               "changed since the last gathering")
+    logger.info(content)
+    return changed
+
+
+def update_manifest(db, jobtype, groups):
+    '''Record the signatures of the scanned group directories in the
+    gather_manifest table'''
+    if not groups:
+        return
+    paths = list(groups)
+    jobtypes = [jobtype] * len(paths)
+    mtimes = [groups[i] for i in paths]
+    # the rows already in the table are updated, the insertion then only
+    # skips them
+    with db.transaction():
+        db.updatem('gather_manifest', {'mtime': mtimes},
+                   {'jobtype': jobtypes, 'path': paths})
+        db.insertm('gather_manifest', {'jobtype': jobtypes, 'path': paths,
+                                       'mtime': mtimes}, ignore=True)
+
+
+def parse_groups(jobtype, groups, file_list, result_cf, workers=1,
+                 compression=None):
+    '''Parse the group directories with a pool of worker processes.
+    The parsed groups are yielded in order, as (job_path, [(item, parsed)]),
+    at most 2*workers groups are parsed ahead of the consumer, which writes
+    them to the database. compression gives the codec and level keywords of
+    parse_results. The files of STREAMED_TABLES aren't parsed by the workers,
+    they are parsed chunk by chunk by store_tasks in the calling process'''
+    if workers <= 1:
+        for job_path, items in groups:
+            yield job_path, parse_group(jobtype, job_path, items, file_list,
+                                        result_cf, compression)
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        pending = collections.deque()
+        for job_path, items in groups:
+            pending.append((job_path, pool.submit(
+                parse_group, jobtype, job_path, items, file_list, result_cf,
+                compression)))
+            if len(pending) >= 2 * workers:
+                job_path, future = pending.popleft()
+                yield job_path, future.result()
+        while pending:
+            job_path, future = pending.popleft()
+            yield job_path, future.result()
+
+
+def parse_group(jobtype, job_path, items, file_list, result_cf,
+                compression=None):
+    '''Parse the results of the tasks of a group directory, without
+    touching the database. The directory is walked once for all its tasks.'''
+    if not items:
+        return []
+    index = index_outputs(job_path)
+    return [(item, parse_task(jobtype, item, job_path, file_list, result_cf,
+                              index, compression)) for item in items]
+
+
+def parse_task(jobtype, item, job_path, file_list, parent_cf, index=None,
+               compression=None):
+    '''Parse the results of one task, index is the index_outputs of
+    job_path. Return None if there were no results, (task_table, result_cf)
+    otherwise'''
+    if index is None:
+        index = index_outputs(job_path)
+    if not index:
+        return None
+    task_table = {}
+    task_table['status'] = 'Success'
+    result_cf = copy.deepcopy(parent_cf)
+    parse_results(jobtype, item, job_path, file_list, task_table, result_cf,
+                  index=index, **(compression or {}))
+    return task_table, result_cf
+
+
+def store_tasks(db, jobtype, tasks):
+    '''Store the parsed results of tasks in the database, the result rows of
+    all the tasks are inserted at once per table, the StreamedResult files
+    are parsed here while inserted, one after the other. Return True if there
+    were results to store.'''
+    rows = {}
+    job_status = {'complete': [], 'incomplete': []}
+    for item, parsed in tasks:
+        where = 'task_id=%s' % item
+        if parsed is None:
+            db.update(f'{jobtype}_task', {'status': 'Failed'}, where)
+            content = "This is a failed job!"
+            logger.warning(content)
+            continue
+        task_table, result_cf = parsed
+        for sec, vals in result_cf.items():
+            if isinstance(vals, StreamedResult):
+                # the big files are read chunk by chunk while inserted
+                if not vals.insert(db, item):
+                    task_table['status'] = 'Failed'
+                continue
+            if isinstance(vals['mtime'], str):
+                # no rows were parsed, only the column types are left
+                continue
+            vals['task_id'] = [item]*len(vals['mtime'])
+            sec_rows = rows.setdefault(sec, {})
+            for key, val in vals.items():
+                sec_rows.setdefault(key, []).extend(val)
+        # the file buffers go to the blob store, if any
+        task_table = {k: db.put_blob(v) if isinstance(v, bytes) else v
+                      for k, v in task_table.items()}
+        db.update(f'{jobtype}_task', task_table, where)
+        if task_table['status'] == 'Success':
+            job_status['complete'].append(item)
+        else:
+            job_status['incomplete'].append(item)
+    for sec, vals in rows.items():
+        db.insertm(sec, vals)
+    mtime = int(time.time() * 1E7)
+    for status, items in job_status.items():
+        if not items:
+            continue
+        job_table = {'status': status}
+        if status == 'complete':
+            job_table['mtime'] = mtime
+        where = 'task_id in (%s)' % ','.join(map(str, items))
+        db.update(f'{jobtype}_wu', job_table, where)
+    if job_status['complete']:
+        content = (f"{len(job_status['complete'])} {jobtype} tasks have "
+                   "completed normally!")
+        logger.info(content)
+    return len(job_status['complete']) + len(job_status['incomplete']) > 0
+
+
 def download_from_boinc(info_sec):
     '''Download results from boinc'''
     task_ids = []
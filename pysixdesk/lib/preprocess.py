@@ -87,7 +87,7 @@ class PreprocessJob:
                 if not temp:
                     raise FileNotFoundError(f'{temp_name} not found in DB.')
                 else:
-                    utils.decompress_buf(temp, temp_name)
+                    utils.decompress_buf(self.db.get_blob(temp), temp_name)
 
     @contextmanager
     def sixtrack_temp_folder(self, folder='temp', symlink_parent=True,
@@ -253,28 +253,30 @@ class PreprocessJob:
         for sec in self.cf:
             result_cf[sec] = dict(self.cf[sec])
         filelist = Table.result_table(self.madx_out.values())
+        compression = json.loads(self.cf['madx'].get('compression', '{}'))
         parse_results('preprocess', self.task_id, self._dest_path, filelist,
-                      task_table, result_cf)
-
-        self.db.update(f'preprocess_task', task_table,
-                       f'task_id={self.task_id}')
-
-        for sec, val in result_cf.items():
-            val['task_id'] = [self.task_id] * len(val['mtime'])
-            self.db.insertm(sec, val)
-
-        job_table = {}
-        if task_table['status'] == 'Success':
-            job_table['status'] = 'complete'
-            job_table['mtime'] = int(time.time() * 1E7)
-            content = f"preprocess task {self.task_id} has completed normally!"
-            self._logger.info(content)
-        else:
-            job_table['status'] = 'incomplete'
-            job_table['mtime'] = int(time.time() * 1E7)
-            self._logger.warning("This is a failed job!")
+                      task_table, result_cf, self.db, **compression)
+
+        with self.db.transaction():
+            self.db.update(f'preprocess_task', task_table,
+                           f'task_id={self.task_id}')
+
+            for sec, val in result_cf.items():
+                val['task_id'] = [self.task_id] * len(val['mtime'])
+                self.db.insertm(sec, val)
+
+            job_table = {}
+            if task_table['status'] == 'Success':
+                job_table['status'] = 'complete'
+                job_table['mtime'] = int(time.time() * 1E7)
+                content = f"preprocess task {self.task_id} has completed normally!"
+                self._logger.info(content)
+            else:
+                job_table['status'] = 'incomplete'
+                job_table['mtime'] = int(time.time() * 1E7)
+                self._logger.warning("This is a failed job!")
 
-        self.db.update(f'preprocess_wu', job_table, f'task_id={self.task_id}')
+            self.db.update(f'preprocess_wu', job_table, f'task_id={self.task_id}')
         shutil.rmtree(self._dest_path)
 
     def run(self):
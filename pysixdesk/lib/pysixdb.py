@@ -1,6 +1,9 @@
 import os
 import logging
+import numpy as np
+from contextlib import contextmanager
 from . import dbadaptor
+from .blobstore import BlobStore
 
 
 class SixDB(object):
@@ -12,6 +15,9 @@ class SixDB(object):
         For sqlite db only db_name is needed which should be an absolute path,
         For MySQL db db_info should contain db_name(just name), user,
         password, host, port and other optional arguments.
+        The optional blob_store (and blob_min_size) of db_info is the folder
+        of a content-addressed store for the large file buffers, see
+        put_blob.
         '''
         self._logger = logging.getLogger(__name__)
         self.settings = settings
@@ -24,6 +30,11 @@ class SixDB(object):
         # if db_type in info's keys pop it's value, if not sql
         db_type = self.info.pop('db_type', 'sql')
         self.db_type = db_type.lower()
+        blob_store = self.info.pop('blob_store', None)
+        blob_min_size = self.info.pop('blob_min_size', 4096)
+        self.blob_store = None
+        if blob_store:
+            self.blob_store = BlobStore(blob_store, blob_min_size)
         self.open(create=create)
 
     def open(self, create=False):
@@ -83,23 +94,73 @@ class SixDB(object):
             else:
                 return False
 
+    @contextmanager
+    def attach(self, db_name, alias):
+        '''Attach another SQLite database file within the block, its tables
+        are then available as alias.table_name'''
+        if self.db_type != 'sql':
+            raise ValueError("Only SQLite databases can be attached!")
+        self.adaptor.attach(self.conn, db_name, alias)
+        try:
+            yield self
+        except BaseException:
+            self.conn.rollback()
+            raise
+        finally:
+            self.adaptor.detach(self.conn, alias)
+
     def fetch_tables(self):
         '''Get all the table names in the database'''
         r = self.adaptor.fetch_tables(self.conn)
         return r
 
+    def fetch_columns(self, table_name):
+        '''Get the column names of a table'''
+        r = self.adaptor.fetch_columns(self.conn, table_name)
+        return r
+
+    def add_columns(self, table_name, table_info):
+        '''Add the columns of table_info missing in an existing table'''
+        exist_cols = self.fetch_columns(table_name)
+        for name, dtype in table_info.items():
+            if name.replace('.', '_') not in exist_cols:
+                self.adaptor.add_column(self.conn, table_name, name, dtype)
+
     def create_table(self, table_name, table_info, key_info={}, recreate=False):
         '''Create a new table or recreate an existing table'''
         self.adaptor.create_table(self.conn, table_name, table_info, key_info,
                                   recreate)
 
-    def create_tables(self, tables, tables_keys={}, recreate=False):
-        '''Create multiple tables'''
+    def create_tables(self, tables, tables_keys={}, recreate=False,
+                      tables_indexes={}):
+        '''Create multiple tables and their secondary indexes'''
         for key, value in tables.items():
             key_info = {}
             if key in tables_keys.keys():
                 key_info = tables_keys[key]
             self.create_table(key, value, key_info, recreate)
+        self.create_indexes(tables, tables_indexes)
+
+    def create_index(self, table_name, index_name, index_cols, table_info={},
+                     unique=False):
+        '''Create a secondary index on a table, if it doesn't exist'''
+        name = 'idx_%s_%s' % (table_name, index_name)
+        self.adaptor.create_index(self.conn, table_name, name, index_cols,
+                                  table_info, unique)
+
+    def create_indexes(self, tables, tables_indexes):
+        '''Create the missing secondary indexes of the given tables. An
+        index is declared by its list of columns or by a dict with the
+        'columns' and 'unique' keys'''
+        for key, indexes in tables_indexes.items():
+            if key not in tables.keys():
+                continue
+            for name, cols in indexes.items():
+                unique = False
+                if isinstance(cols, dict):
+                    unique = cols.get('unique', False)
+                    cols = cols['columns']
+                self.create_index(key, name, cols, tables[key], unique)
 
     def drop_table(self, table_name):
         '''Drop a table'''
@@ -109,9 +170,10 @@ class SixDB(object):
         '''Insert a row of values'''
         self.adaptor.insert(self.conn, table_name, values)
 
-    def insertm(self, table_name, values):
-        '''Insert multiple rows'''
-        self.adaptor.insertm(self.conn, table_name, values)
+    def insertm(self, table_name, values, ignore=False):
+        '''Insert multiple rows, return the number of inserted rows. With
+        ignore=True the rows violating a unique index are skipped.'''
+        return self.adaptor.insertm(self.conn, table_name, values, ignore)
 
     def select(self, table_name, columns='*', where=None, orderby=None, **kwargs):
         '''Select values with specified conditions'''
@@ -119,6 +181,85 @@ class SixDB(object):
                                 **kwargs)
         return r
 
+    def iter_select(self, table_name, columns='*', where=None, orderby=None,
+                    size=10000, **kwargs):
+        '''Iterate over the selected rows, fetching "size" rows at once'''
+        return self.adaptor.iter_select(self.conn, table_name, columns, where,
+                                        orderby, size, **kwargs)
+
+    def select_columns(self, table_name, columns, dtypes, where=None,
+                       orderby=None, size=100000, **kwargs):
+        '''Select columns into typed NumPy arrays.
+
+        The rows are fetched in batches of "size" rows which are converted
+        to arrays at once. Numeric columns containing NULLs or unparsable
+        entries are returned as float arrays with NaNs.
+
+        Args:
+            table_name (str): the table name.
+            columns (list): the column names.
+            dtypes (list): the NumPy dtype of each column.
+            where (str, optional): selection condition.
+            orderby (list, optional): order condition.
+            size (int, optional): number of rows fetched at once.
+
+        Returns:
+            dict: column name --> numpy.ndarray.
+        '''
+        dtype = np.dtype(list(zip(columns, dtypes)))
+        chunks = {k: [] for k in columns}
+        for data in self.adaptor.select_batches(self.conn, table_name,
+                                                columns, where, orderby,
+                                                size, **kwargs):
+            try:
+                arr = np.array(data, dtype=dtype)
+                for k in columns:
+                    chunks[k].append(arr[k])
+            except (TypeError, ValueError):
+                for k, dt, vals in zip(columns, dtypes, zip(*data)):
+                    chunks[k].append(self._column_array(vals, dt))
+        out = {}
+        for k, dt in zip(columns, dtypes):
+            if chunks[k]:
+                out[k] = np.concatenate(chunks[k])
+            else:
+                out[k] = np.empty(0, dtype=dt)
+        return out
+
+    @staticmethod
+    def _column_array(vals, dtype):
+        '''Convert the values of one column, the numeric columns which
+        can't be converted directly fall back to floats with NaNs.'''
+        try:
+            return np.array(vals, dtype=dtype)
+        except (TypeError, ValueError):
+            pass
+        out = np.empty(len(vals), dtype='f8')
+        for i, v in enumerate(vals):
+            try:
+                out[i] = float(v)
+            except (TypeError, ValueError):
+                out[i] = np.nan
+        return out
+
+    def put_blob(self, buf):
+        '''Get the value to store in a blob column for a file buffer. With a
+        blob store the large buffers are saved in it and only their reference
+        is returned, otherwise the buffer itself.'''
+        if self.blob_store is None:
+            return buf
+        return self.blob_store.put(buf)
+
+    def get_blob(self, value):
+        '''Get the file buffer of a value of a blob column, the references are
+        read from the blob store'''
+        if self.blob_store is not None:
+            return self.blob_store.get(value)
+        if isinstance(value, bytes) and value.startswith(BlobStore.prefix):
+            raise ValueError("The database refers to a blob store, but no "
+                             "blob_store is given in db_info!")
+        return value
+
     def update(self, table_name, values, where=None):
         '''Update data in a table'''
         self.adaptor.update(self.conn, table_name, values, where)
@@ -131,6 +272,37 @@ class SixDB(object):
         '''Reomve rows based on specified conditions'''
         self.adaptor.delete(self.conn, table_name, where)
 
+    def removem(self, table_name, where):
+        '''Remove multiple rows, where maps the column names to the values
+        of the removed rows, like in updatem'''
+        self.adaptor.deletem(self.conn, table_name, where)
+
+    def execute(self, sql, args=None):
+        '''Execute a modifying sql statement, return the affected row count'''
+        return self.adaptor.execute(self.conn, sql, args)
+
+    @contextmanager
+    def transaction(self, commit_every=None):
+        '''Group the statements executed in the block in one transaction.
+        The commit is deferred until the block exits and the transaction is
+        rolled back if an exception is raised. Nested blocks are savepoints
+        of the outermost transaction, an exception raised in one only rolls
+        back its own statements. The schema changes join it with SQLite,
+        MySQL commits implicitly before them. No database can be attached
+        within the block.
+
+        Args:
+            commit_every (int, optional): commit every N statements instead
+                of only at the end of the block, useful for very long loops.
+        '''
+        self.adaptor.begin(self.conn, commit_every)
+        try:
+            yield self
+        except BaseException:
+            self.adaptor.end(self.conn, rollback=True)
+            raise
+        self.adaptor.end(self.conn)
+
     def close(self):
         '''Disconnect the database'''
         self.conn.commit()
@@ -1,30 +1,92 @@
 import os
+import io
 import re
 import time
 import gzip
+import zlib
 import logging
+import itertools
+import warnings
+import numpy as np
 
 from pysixdesk.lib.utils import compress_buf
+from pysixdesk.lib.dbtypedict import numpy_dtype
 
 '''Parse the results of preprocess jobs and sixtrack jobs'''
 
 logger = logging.getLogger(__name__)
 
 
-def parse_results(jobtype, item, job_path, file_list, task_table, result_cf):
-    '''parse the results'''
+# the job logs, the htcondor ones are at the top of the group directory
+JOB_LOGS = [('job_stdout', re.compile(r'htcondor\..+\.out|_condor_stdout')),
+            ('job_stderr', re.compile(r'htcondor\..+\.err|_condor_stderr')),
+            ('job_stdlog', re.compile(r'htcondor\..+\.log'))]
+
+
+def index_outputs(job_path):
+    '''Index the output files of a job directory in one os.walk, to be
+    shared by all the tasks of the directory.
+
+    A file is indexed by its name without the .gz suffix, by the part of that
+    name before the first dot (e.g. crpoint_pri for crpoint_pri.bin.gz) and
+    by job_stdout, job_stderr or job_stdlog for the job logs. The full names
+    take precedence, then the first file found for a name is kept.
+
+    Args:
+        job_path (str): the job directory.
+
+    Returns:
+        dict: directory name --> (name --> file path), the files at the top
+            of job_path are under None. Empty if job_path is empty or
+            doesn't exist.
+    '''
+    job_path = str(job_path)
+    index = {}
+    for root, dirs, files in os.walk(job_path):
+        if root == job_path:
+            if not (dirs or files):
+                return {}
+            key = None
+        else:
+            key = os.path.basename(root)
+        names = index.setdefault(key, {})
+        stems = {}
+        for f in files:
+            path = os.path.join(root, f)
+            name = f[:-3] if f.endswith('.gz') else f
+            names.setdefault(name, path)
+            stems.setdefault(name.split('.')[0], path)
+            for log, pattern in JOB_LOGS:
+                if pattern.match(f):
+                    stems.setdefault(log, path)
+        # the full names take precedence
+        for name, path in stems.items():
+            names.setdefault(name, path)
+    return index
+
+
+def parse_results(jobtype, item, job_path, file_list, task_table, result_cf,
+                  db=None, index=None, codec='gzip', level=None):
+    '''parse the results, the file buffers go through the blob API of db if
+    given. The output files are looked up in index, the index_outputs of
+    job_path, which is built if not given. The files are stored compressed
+    with codec at level, see utils.compress_buf'''
     task_table['mtime'] = int(time.time() * 1E7)
-    contents = []
-    for a in os.walk(job_path):
-        if a[0] == job_path or str(item) == a[0].split('/')[-1]:
-            for b in a[2]:
-                contents.append(os.path.join(a[0], b))
+    store = db.put_blob if db is not None else (lambda buf: buf)
+
+    def compress(path, source='file'):
+        return store(compress_buf(path, source, codec, level))
+
+    if index is None:
+        index = index_outputs(job_path)
+    # the files at the top of the job directory come first
+    contents = dict(index.get(None, {}))
+    for name, path in index.get(str(item), {}).items():
+        contents.setdefault(name, path)
 
     def search_store(key, name):
-        search_re = [s for s in contents if name in os.path.basename(s)]
-        if search_re:
-            search_re = search_re[0]
-            task_table[key] = compress_buf(search_re, 'gzip')
+        if name in contents:
+            task_table[key] = compress(contents[name], 'gzip')
 
     if jobtype == 'preprocess':
         search_store('madx_in', 'madx_in')
@@ -41,32 +103,21 @@ def parse_results(jobtype, item, job_path, file_list, task_table, result_cf):
         search_store('singletrackfile_dat', 'singletrackfile')
         search_store('fort_6', 'fort.6')
 
-    job_stdout = [s for s in contents if (re.match(r'htcondor\..+\.out',
-        os.path.basename(s)) or re.match(r'_condor_stdout', os.path.basename(s)))]
-    if job_stdout:
-        job_stdout = job_stdout[0]
-        task_table['job_stdout'] = compress_buf(job_stdout)
-
-    job_stderr = [s for s in contents if (re.match(r'htcondor\..+\.err',
-        os.path.basename(s)) or re.match(r'_condor_stderr', os.path.basename(s)))]
-    if job_stderr:
-        job_stderr = job_stderr[0]
-        task_table['job_stderr'] = compress_buf(job_stderr)
-
-    job_stdlog = [s for s in contents if re.match(r'htcondor\..+\.log',
-        os.path.basename(s))]
-    if job_stdlog:
-        job_stdlog = job_stdlog[0]
-        task_table['job_stdlog'] = compress_buf(job_stdlog)
+    for log, _ in JOB_LOGS:
+        if log in contents:
+            task_table[log] = compress(contents[log])
 
     valid_tname = []
     for out, tname in file_list.items():
-        out_f = [s for s in contents if out in os.path.basename(s)]
+        out_f = contents.get(out)
         if out_f:
-            out_f = out_f[0]
             if tname is not None:
                 try:
-                    parse_file(out_f, task_table, result_cf[tname], tname)
+                    if tname in STREAMED_TABLES:
+                        result_cf[tname] = StreamedResult(
+                            out_f, result_cf[tname], tname)
+                    else:
+                        parse_file(out_f, task_table, result_cf[tname], tname)
                     valid_tname.append(tname)
                 except Exception as e:
                     task_table['status'] = 'Failed'
@@ -74,7 +125,7 @@ def parse_results(jobtype, item, job_path, file_list, task_table, result_cf):
                         "file %s for task %s!" % (out, item)
                     logger.error(content)
                     logger.error(e, exc_info=True)
-            task_table[out] = compress_buf(out_f, 'gzip')
+            task_table[out] = compress(out_f, 'gzip')
         else:
             task_table['status'] = 'Failed'
             content = f"The {jobtype} output file {out} for task {item} "\
@@ -88,106 +139,197 @@ def parse_results(jobtype, item, job_path, file_list, task_table, result_cf):
 
 
 def parse_file(out_f, task_table, result_table, tname):
-    '''parse the files'''
-    countl = 0
+    '''parse the files, the rows are stored in result_table as lists of
+    typed values, one list per column'''
     mtime = int(os.path.getmtime(out_f) * 1E7)
-    with gzip.open(out_f, 'rt') as f_in:
-        raw_lines = f_in.readlines()
-    lines = []
-    postlines = []
-    for lin in raw_lines:
-        if lin.lstrip()[0] == '#':
-            continue
-        lines.append(lin)
-    status = globals()[tname](lines, postlines)
+    with gzip.open(out_f, 'rb') as f_in:
+        data = f_in.read()
+    keys = list(result_table.keys())
+    # task_id, row_num, the values of the file..., mtime
+    cols = keys[2:-1]
+    columns, status = parse_rows(data, ROW_LENGTHS[tname],
+                                 [result_table[k] for k in cols])
     if not status:
         task_table['status'] = 'Failed'
         content = 'Error in %s' % out_f
         logger.warning(content)
-    post_data = []
-    for line in postlines:
-        countl += 1
-        line = [countl] + line + [mtime]
-        post_data.append(line)
-    keys = list(result_table.keys())
-    result_table.update(dict(zip(keys[1:], zip(*post_data))))
+    nrows = len(columns[0]) if columns else 0
+    if not nrows:
+        return
+    result_table['row_num'] = list(range(1, nrows + 1))
+    result_table.update(zip(cols, columns))
+    result_table['mtime'] = [mtime] * nrows
 
 
-# The following methods to parse specific files should have the same name with
-# the table which they will be stored in
-def oneturn_sixtrack_results(lines, postlines):
-    '''process the lines of oneturnresult'''
-    status = True
-    for perline in lines:
-        line = perline.split()
-        if len(line) != 21:
-            logger.info(perline)
-            line = 21*['None']
-            status = False
-        postlines.append(line)
-    return status
+# The number of values of the lines of the result files, per table in which
+# they are stored. The values beyond the columns of the table are ignored.
+ROW_LENGTHS = {
+    'oneturn_sixtrack_results': 21,
+    'six_results': 60,
+    'init_state': 12,
+    'final_state': 12,
+    'aperture_losses': 15,
+    'collimation_losses': 7,
+}
 
 
-def six_results(lines, postlines):
-    '''process the lines of fort.10'''
-    status = True
-    for perline in lines:
-        line = perline.split()
-        if len(line) != 60:
-            logger.info(perline)
-            line = 60*['None']
-            status = False
-        postlines.append(line)
-    return status
+# The result files of these tables can have millions of lines, they are read
+# in chunks of CHUNK_LINES lines while they are stored in the database
+STREAMED_TABLES = ['aperture_losses', 'collimation_losses', 'init_state',
+                   'final_state']
+CHUNK_LINES = 100000
+# the size of the text values read by np.loadtxt in parse_rows, the longer
+# ones are parsed line by line
+TEXT_SIZE = 64
 
 
-def init_state(lines, postlines):
-    '''process the lines of initial_state.dat'''
-    status = True
-    for perline in lines:
-        line = perline.split()
-        if len(line) != 12:
-            logger.info(perline)
-            line = 12*['None']
-            status = False
-        postlines.append(line)
-    return status
+class StreamedResult(object):
+    '''The rows of a result file, parsed in chunks while they are inserted in
+    the database so the memory use doesn't depend on the size of the file.
+    Only the file path is kept, the object can be sent to another process.
+    The file is only read by insert, so when gathering it is parsed serially
+    in the process writing to the database and not in the parsing workers.'''
 
+    def __init__(self, out_f, result_table, tname, chunk_lines=CHUNK_LINES):
+        self.out_f = out_f
+        self.result_table = result_table
+        self.tname = tname
+        self.chunk_lines = chunk_lines
+        # False if there were malformed lines
+        self.status = True
 
-def final_sate(lines, postlines):
-    '''process the lines of final_state.dat'''
-    status = True
-    for perline in lines:
-        line = perline.split()
-        if len(line) != 12:
-            # logger.info(perline)
-            line = 12*['None']
-            status = False
-        postlines.append(line)
-    return status
+    def __iter__(self):
+        '''Yield the rows in chunks, as dicts column --> list of values, like
+        the result_table of parse_file. The row_num numbering continues
+        across the chunks.'''
+        self.status = True
+        mtime = int(os.path.getmtime(self.out_f) * 1E7)
+        keys = list(self.result_table.keys())
+        cols = keys[2:-1]
+        types = [self.result_table[k] for k in cols]
+        row_num = 0
+        with gzip.open(self.out_f, 'rb') as f_in:
+            while True:
+                lines = list(itertools.islice(f_in, self.chunk_lines))
+                if not lines:
+                    break
+                columns, status = parse_rows(b''.join(lines),
+                                             ROW_LENGTHS[self.tname], types)
+                if not status:
+                    self.status = False
+                nrows = len(columns[0]) if columns else 0
+                if not nrows:
+                    continue
+                chunk = {'row_num': list(range(row_num + 1,
+                                               row_num + nrows + 1))}
+                chunk.update(zip(cols, columns))
+                chunk['mtime'] = [mtime] * nrows
+                row_num += nrows
+                yield chunk
+        if not self.status:
+            content = 'Error in %s' % self.out_f
+            logger.warning(content)
 
+    def insert(self, db, task_id):
+        '''Insert the rows in the table of the file, chunk by chunk, in one
+        transaction (a savepoint within an open one). If the file can't be
+        read, the rows of the file are rolled back. Return False if the file
+        had malformed lines or couldn't be read, the database errors are
+        raised.'''
+        try:
+            with db.transaction():
+                for chunk in self:
+                    chunk['task_id'] = [task_id] * len(chunk['mtime'])
+                    db.insertm(self.tname, chunk)
+        except (OSError, EOFError, ValueError, zlib.error) as e:
+            content = "There is something wrong with the output file %s!" % (
+                self.out_f)
+            logger.error(content)
+            logger.error(e, exc_info=True)
+            return False
+        return self.status
 
-def aperture_losses(lines, postlines):
-    '''process the lines of aperture_losses.dat'''
-    status = True
-    for perline in lines:
-        line = perline.split()
-        if len(line) != 15:
-            logger.info(perline)
-            line = 15*['None']
-            status = False
-        postlines.append(line)
-    return status
 
+def parse_rows(data, ncols, types):
+    '''Parse the lines of a result file into typed columns.
+
+    The file is parsed in one pass by np.loadtxt, with a structured dtype built
+    from the column types. The files with malformed lines, or with text
+    values too long for that dtype, fall back to a parsing line by line: the
+    blank lines and the comment lines (starting with '#') are skipped, a line
+    which hasn't ncols values is logged and gives a row of 'None'.
+
+    Args:
+        data (bytes): the content of the file.
+        ncols (int): the number of values of a line.
+        types (list): the column types of the table, e.g. 'int', 'float',
+            'text', for the first values of the lines.
+
+    Returns:
+        tuple: the list of the values of each column and True if all the
+            lines are valid.
+    '''
+    # the numbers are read as floats, the integer columns are converted
+    # afterwards as the files write them as floats
+    fields = [('f8' if numpy_dtype(t) != 'O' else f'S{TEXT_SIZE}')
+              for t in types]
+    fields += [f'S{TEXT_SIZE}'] * (ncols - len(fields))
+    dtype = np.dtype([(f'f{i}', f) for i, f in enumerate(fields)])
+    try:
+        with warnings.catch_warnings():
+            # empty files
+            warnings.simplefilter('ignore', UserWarning)
+            table = np.loadtxt(io.BytesIO(data), dtype=dtype, ndmin=1)
+    except ValueError:
+        return _parse_lines(data, ncols, types)
+    # loadtxt truncates the longer text values silently
+    for i, f in enumerate(fields[:len(types)]):
+        if (f[0] == 'S' and len(table) and
+                np.char.str_len(table[f'f{i}']).max() >= TEXT_SIZE):
+            return _parse_lines(data, ncols, types)
+    return [_typed_column(table[f'f{i}'], t).tolist()
+            for i, t in enumerate(types)], True
 
-def collimation_losses(lines, postlines):
-    '''process the lines of Coll_Scatter.dat'''
+
+def _parse_lines(data, ncols, types):
+    '''Parse the lines of a result file one by one, see parse_rows'''
     status = True
-    for perline in lines:
-        line = perline.split()
-        if len(line) != 7:
-            logger.info(perline)
-            line = 7*['None']
+    rows = []
+    for lin in data.decode(errors='replace').split('\n'):
+        line = lin.split()
+        if not line or line[0][0] == '#':
+            continue
+        if len(line) != ncols:
+            logger.info(lin)
+            line = None
             status = False
-        postlines.append(line)
-    return status
+        rows.append(line)
+    good = np.array([line is not None for line in rows], dtype=bool)
+    tokens = np.array([line for line in rows if line is not None],
+                      dtype=bytes).reshape(-1, ncols)
+    columns = []
+    for i, t in enumerate(types):
+        col = np.full(len(rows), 'None', dtype=object)
+        col[good] = _typed_column(tokens[:, i], t)
+        columns.append(col.tolist())
+    return columns, status
+
+
+def _typed_column(col, sql_type):
+    '''Convert a column of values to the type of its table column. The
+    integral floats of the integer columns become integers, the values which
+    aren't numbers are kept as text'''
+    dtype = numpy_dtype(sql_type)
+    if dtype == 'O':
+        return col.astype(str)
+    if col.dtype.kind == 'f' and dtype == 'f8':
+        return col
+    try:
+        vals = col.astype('f8')
+    except ValueError:
+        return col.astype(str)
+    if dtype == 'i8' and np.isfinite(vals).all():
+        ints = vals.astype('i8')
+        if (ints == vals).all():
+            return ints
+    return vals
@@ -14,7 +14,7 @@ from contextlib import contextmanager
 from pysixdesk.lib.pysixdb import SixDB
 from pysixdesk.lib import utils
 from pysixdesk.lib.dbtable import Table
-from pysixdesk.lib.resultparser import parse_results
+from pysixdesk.lib.resultparser import parse_results, StreamedResult
 
 
 class TrackingJob:
@@ -138,7 +138,7 @@ class TrackingJob:
                 if not temp:
                     raise FileNotFoundError(f'{temp_name} not found in DB.')
                 else:
-                    utils.decompress_buf(temp, temp_name)
+                    utils.decompress_buf(self.db.get_blob(temp), temp_name)
 
     def _decomp_files(self):
         '''This decompresses the buffers in the database into files.
@@ -178,7 +178,7 @@ class TrackingJob:
 
         for infile in inputs:
             i = inputs.index(infile)
-            buf = input_buf[i]
+            buf = self.db.get_blob(input_buf[i])
 
             utils.decompress_buf(buf, infile, des='file')
 
@@ -343,28 +343,35 @@ class TrackingJob:
         for sec in self.cf:
             result_cf[sec] = dict(self.cf[sec])
         filelist = Table.result_table(self.six_out)
+        compression = json.loads(self.six_cfg.get('compression', '{}'))
         parse_results('sixtrack', self.task_id, self._dest_path, filelist,
-                      task_table, result_cf)
-
-        self.db.update('sixtrack_task', task_table,
-                       f'task_id={self.task_id}')
-
-        for sec, val in result_cf.items():
-            val['task_id'] = [self.task_id] * len(val['mtime'])
-            self.db.insertm(sec, val)
-
-        job_table = {}
-        if task_table['status'] == 'Success':
-            job_table['status'] = 'complete'
-            job_table['mtime'] = int(time.time() * 1E7)
-            content = f" sixtrack task {self.task_id} has completed normally!"
-            self._logger.info(content)
-        else:
-            job_table['status'] = 'incomplete'
-            job_table['mtime'] = int(time.time() * 1E7)
-            self._logger.warning("This is a failed job!")
+                      task_table, result_cf, self.db, **compression)
+
+        with self.db.transaction():
+            for sec, val in result_cf.items():
+                if isinstance(val, StreamedResult):
+                    # the big collimation files are inserted chunk by chunk
+                    if not val.insert(self.db, self.task_id):
+                        task_table['status'] = 'Failed'
+                    continue
+                val['task_id'] = [self.task_id] * len(val['mtime'])
+                self.db.insertm(sec, val)
+
+            self.db.update('sixtrack_task', task_table,
+                           f'task_id={self.task_id}')
+
+            job_table = {}
+            if task_table['status'] == 'Success':
+                job_table['status'] = 'complete'
+                job_table['mtime'] = int(time.time() * 1E7)
+                content = f" sixtrack task {self.task_id} has completed normally!"
+                self._logger.info(content)
+            else:
+                job_table['status'] = 'incomplete'
+                job_table['mtime'] = int(time.time() * 1E7)
+                self._logger.warning("This is a failed job!")
 
-        self.db.update(f'sixtrack_wu', job_table, f'task_id={self.task_id}')
+            self.db.update(f'sixtrack_wu', job_table, f'task_id={self.task_id}')
         shutil.rmtree(self._dest_path)
 
     def run(self):
@@ -5,10 +5,13 @@ import shutil
 import logging
 import getpass
 import configparser
+import numpy as np
 from collections import OrderedDict
 from itertools import groupby
+from concurrent.futures import ThreadPoolExecutor
 
 from . import utils
+from . import dbtypedict
 from . import gather
 from . import submission
 from .pysixdb import SixDB
@@ -41,8 +44,10 @@ class Study(object):
         self.sixtrack_output = []
         self.tables = {}
         self.table_keys = {}
+        self.table_indexes = {}
         self.pragma = OrderedDict()
         self.boinc_vars = OrderedDict()
+        self._status_cache = {}
         # initialize default values
         self._defaults()
         self._structure()
@@ -71,8 +76,33 @@ class Study(object):
         self.checkpoint_restart = False
         self.first_turn = 1  # first turn
         self.last_turn = 100  # last turn
+        # the automatic checkpoint/restart splits the tracking in segments
+        # which fit in the wall time of the sixtrack job flavour
+        self.cr_auto = False
+        self.cr_first_segment = 10000  # turns before any speed measurement
+        self.cr_walltime_fraction = 0.8  # margin for the job overheads
+        self.sixtrack_flavour = 'tomorrow'
+        # the wall time of the jobs in seconds, if None the one of the
+        # sixtrack_flavour in the walltimes of the cluster class
+        self.cr_walltime = None
         self.cluster_class = submission.HTCondor
         self.max_jobsubmit = 15000
+        # number of output directories stored per transaction when gathering
+        self.gather_commit_every = 500
+        # number of processes parsing the results when gathering, all the
+        # cores if None
+        self.gather_workers = None
+        # only parse the output directories which changed since the last
+        # gathering (the cluster isn't queried if none did). The results
+        # left in the condor spool need a full gathering
+        self.gather_incremental = False
+        # number of parameter combinations stored at once by update_db
+        self.update_chunk_size = 10000
+        # compression of the templates and of the output files stored in the
+        # database, one of the codecs of utils.compress_buf. The level is the
+        # default of the codec if None
+        self.compress_codec = 'gzip'
+        self.compress_level = None
 
         self.madx_output = {
             'fc.2': 'fort.2',
@@ -87,6 +117,9 @@ class Study(object):
         self.sixtrack_output = ['fort.10']
 
         self.db_info['db_type'] = 'sql'
+        # the large file buffers of the tasks can be kept out of the database
+        # in a content-addressed store, which the jobs must be able to reach:
+        # self.db_info['blob_store'] = '/path/to/a/shared/folder'
         self.db_settings = {
             # 'synchronous': 'off',
             'foreign_keys': 'on',
@@ -109,6 +142,12 @@ class Study(object):
         self.boinc_vars['appName'] = 'sixtrack'
         self.boinc_vars['appVer'] = 50205
 
+    @property
+    def compression(self):
+        '''The codec and level keywords of utils.compress_buf, as given to
+        the jobs and to the gathering'''
+        return {'codec': self.compress_codec, 'level': self.compress_level}
+
     def _structure(self):
         '''Structure the workspace of this study.
         Copy the required template files.
@@ -159,10 +198,12 @@ class Study(object):
 
         db_type = self.db_info['db_type']
         if db_type.lower() == 'sql':
-            table = Table(self.tables, self.table_keys, 'sql')
+            table = Table(self.tables, self.table_keys, 'sql',
+                          self.table_indexes)
             self.db_info['db_name'] = os.path.join(self.study_path, 'data.db')
         elif db_type.lower() == 'mysql':
-            table = Table(self.tables, self.table_keys, 'mysql')
+            table = Table(self.tables, self.table_keys, 'mysql',
+                          self.table_indexes)
             self.db_info['db_name'] = wu_name + '_' + st_name
             my_cnf = os.path.join(os.getenv('HOME'), '.my.cnf')
             if os.path.isfile(my_cnf):
@@ -214,6 +255,8 @@ class Study(object):
         if 'additional_input' in self.sixtrack_input.keys():
             inp = self.sixtrack_input['additional_input']
             table.customize_tables('templates', inp, 'BLOB')
+        # the hashes of the stored templates, json dict key --> sha1
+        table.customize_tables('templates', ['file_hashes'], 'text')
         table.customize_tables('env', self.env)
         table.customize_tables('env', list(self.paths.keys()), 'text')
         table.customize_tables('preprocess_wu', self.params.madx)
@@ -230,8 +273,23 @@ class Study(object):
         # Initialize the database
         self.db = SixDB(self.db_info, settings=self.db_settings, create=True)
         # create the database tables if not exist
-        if not self.db.fetch_tables():
-            self.db.create_tables(self.tables, self.table_keys)
+        exist_tables = self.db.fetch_tables()
+        if not exist_tables:
+            self.db.create_tables(self.tables, self.table_keys,
+                                  tables_indexes=self.table_indexes)
+        else:
+            # add the columns and indexes missing in databases of older
+            # studies
+            exist_tables = [i[0] for i in exist_tables]
+            if 'gather_manifest' not in exist_tables:
+                self.db.create_table('gather_manifest',
+                                     self.tables['gather_manifest'],
+                                     self.table_keys['gather_manifest'])
+            for key in ['templates', 'preprocess_wu', 'sixtrack_wu']:
+                if key in exist_tables:
+                    self.db.add_columns(key, self.tables[key])
+            self.db.create_indexes({k: v for k, v in self.tables.items()
+                                    if k in exist_tables}, self.table_indexes)
 
         # Initialize the submission object
         try:
@@ -244,102 +302,191 @@ class Study(object):
     def _update_db_params(self):
         '''Populates the preprocess_wu and the sixtrack_wu tables based on the
         combination of user input parameters.
+
+        The combinations are streamed in chunks of self.update_chunk_size, the
+        rows already in the tables are found with the indexed param_hash
+        column, so the memory use doesn't grow with the size of the scan.
+        The points already stored keep their wu_id and are skipped, the new
+        work units get the ids following the largest one in their table.
         '''
-        madx_keys = self.params.madx.keys()
-        six_keys = (list(self.params.sixtrack.keys()) +
-                    list(self.params.phasespace.keys()))
-        # preprocess_wu already in the table
-        prep_entries = self.db.select('preprocess_wu', madx_keys)
-        prep_wu_done = set(prep_entries)
-        # these are used to keep track of the preprocess_wu_id
-        # increments prep_wu_id everytime a new parameter config is seen
-        # and add it to the set of seen paramter configs.
-        prep_wu_seen = set()
-        prep_wu_id = 0
-        # sixtrack_wu already in the table
-        six_entries = self.db.select('sixtrack_wu',
-                                     six_keys + ['preprocess_id'])
-        six_wu_done = set(six_entries)
-
-        prep_to_be_inserted = []
-        six_to_be_inserted = []
+        self._fill_param_hash('preprocess_wu')
+        self._fill_param_hash('sixtrack_wu')
+        prep_keys = self._hash_keys('preprocess_wu')
+        six_keys = self._hash_keys('sixtrack_wu')
+        prefix = self.madx_input['mask_file'].split('.')[0]
+        next_prep_id = self._next_wu_id('preprocess_wu')
+        next_six_id = self._next_wu_id('sixtrack_wu')
         mtime = int(time.time()) * 1E7
-        # iterate over the the input combinations
-        for six_wu_id, (prep_wu_entry, six_wu_entry) in enumerate(self.params.combinations(), 1):
-            # this sanitization could be moved to inside the
-            # self.params.combinations method
-            # sanitize any tuples
-            prep_wu_entry = {k: json.dumps(v) if isinstance(v, tuple) else v
-                             for k, v in prep_wu_entry.items()}
-            six_wu_entry = {k: json.dumps(v) if isinstance(v, tuple) else v
-                            for k, v in six_wu_entry.items()}
-
-            # TODO: is there a better way to do this ?
-            # insert rows in preprocess_wu
-            # keep track of current wu_id, i.e. increment every new row.
-            prep_values_tuple = tuple(prep_wu_entry.values())
-            if prep_values_tuple not in prep_wu_seen:
-                # add a copy of the row to the prep_wu_seen
-                prep_wu_seen.add(prep_values_tuple)
-                prep_wu_id += 1
-                # job name
-                prefix = self.madx_input['mask_file'].split('.')[0]
-                prep_job_name = self.name_conven(prefix,
-                                                 prep_wu_entry.keys(),
-                                                 prep_wu_entry.values(),
-                                                 suffix='')
-                # populate prepprocess_wu
-                if prep_values_tuple not in prep_wu_done:
-                    prep_wu_done.add(prep_values_tuple)
-
+        last_turn = self.params.sixtrack['turnss']
+        if self.cr_auto:
+            last_turn = min(last_turn, self.cr_segment_turns())
+        space = self.params.combination_space()
+        self._logger.info(f"{len(space)} parameter combinations.")
+        for start in range(0, len(space), self.update_chunk_size):
+            entries = []
+            for prep_wu_entry, six_wu_entry in space[
+                    start:start + self.update_chunk_size]:
+                # this sanitization could be moved to inside the
+                # self.params.combinations method
+                # sanitize any tuples
+                prep_wu_entry = {k: json.dumps(v) if isinstance(v, tuple)
+                                 else v for k, v in prep_wu_entry.items()}
+                six_wu_entry = {k: json.dumps(v) if isinstance(v, tuple)
+                                else v for k, v in six_wu_entry.items()}
+                prep_hash = utils.param_hash(
+                    prep_keys, [prep_wu_entry[k] for k in prep_keys])
+                entries.append((prep_hash, prep_wu_entry, six_wu_entry))
+            # param hash --> wu_id of the preprocess work units of the chunk
+            prep_wu_seen = self._stored_wu_ids(
+                'preprocess_wu', {e[0] for e in entries})
+            prep_to_be_inserted = []
+            # param hash --> row of the sixtrack work units of the chunk
+            six_wu_seen = {}
+            # iterate over the the input combinations
+            for prep_hash, prep_wu_entry, six_wu_entry in entries:
+                if prep_hash not in prep_wu_seen:
+                    prep_wu_id = next_prep_id
+                    next_prep_id += 1
+                    prep_wu_seen[prep_hash] = prep_wu_id
+                    prep_wu_entry['job_name'] = self.name_conven(
+                        prefix, prep_wu_entry.keys(), prep_wu_entry.values(),
+                        suffix='')
                     prep_wu_entry['status'] = 'incomplete'
-                    prep_wu_entry['job_name'] = prep_job_name
                     prep_wu_entry['mtime'] = mtime
                     prep_wu_entry['wu_id'] = prep_wu_id
+                    prep_wu_entry['param_hash'] = prep_hash
                     prep_to_be_inserted.append(prep_wu_entry)
-                    # self.db.insert('preprocess_wu', prep_wu_entry)
-                    self._logger.info(f"Queued {prep_job_name} for storage in "
-                                      "preprocess_wu table.")
-                else:
-                    msg = (f"Job {prep_job_name} already in preprocess_wu "
-                           "table.")
-                    self._logger.warning(msg)
-
-            six_job_name = f'sixtrack_job_preprocess_id_{prep_wu_id}_wu_id_{six_wu_id}'
-            # populate sixtrack_wu
-            six_values_tuple = tuple(list(six_wu_entry.values()) +
-                                     [prep_wu_id])
-            if six_values_tuple not in six_wu_done:
-                six_wu_done.add(six_values_tuple)
+                prep_wu_id = prep_wu_seen[prep_hash]
 
+                six_wu_entry['preprocess_id'] = prep_wu_id
+                six_hash = utils.param_hash(
+                    six_keys, [six_wu_entry[k] for k in six_keys])
+                six_wu_entry['param_hash'] = six_hash
+                six_wu_seen.setdefault(six_hash, six_wu_entry)
+            six_wu_done = self._stored_wu_ids('sixtrack_wu', six_wu_seen)
+            six_to_be_inserted = []
+            for six_hash, six_wu_entry in six_wu_seen.items():
+                if six_hash in six_wu_done:
+                    continue
+                six_wu_id = next_six_id
+                next_six_id += 1
                 six_wu_entry['status'] = 'incomplete'
-                six_wu_entry['job_name'] = six_job_name
+                six_wu_entry['job_name'] = (
+                    f"sixtrack_job_preprocess_id_"
+                    f"{six_wu_entry['preprocess_id']}_wu_id_{six_wu_id}")
                 six_wu_entry['mtime'] = mtime
-                six_wu_entry['last_turn'] = self.params.sixtrack['turnss']
-                six_wu_entry['preprocess_id'] = prep_wu_id
+                six_wu_entry['last_turn'] = last_turn
                 six_wu_entry['wu_id'] = six_wu_id
                 six_to_be_inserted.append(six_wu_entry)
-                self._logger.info(f"Queued {six_job_name} for storage in "
-                                  "sixtrack_wu table.")
-            else:
-                msg = f"Job {six_job_name} already in sixtrack_wu table."
-                self._logger.warning(msg)
-        # insert everything at once
-        # ugly way of going from list of dicts to dict of lists
-        # it assumes all the dicts have the exact same keys, which should
-        # always be the case.
-        if prep_to_be_inserted:
-            self._logger.info(f"Storing {len(prep_to_be_inserted)} preprocess "
-                              "jobs in preprocess_wu.")
-            self.db.insertm('preprocess_wu',
-                            {k: [dic[k] for dic in prep_to_be_inserted]
-                             for k in prep_to_be_inserted[0]})
-        if six_to_be_inserted:
-            self._logger.info(f"Storing {len(six_to_be_inserted)} tracking "
-                              "jobs in sixtrack_wu.")
-            self.db.insertm('sixtrack_wu',
-                            {k: [dic[k] for dic in six_to_be_inserted]
-                             for k in six_to_be_inserted[0]})
+            if six_wu_done:
+                self._logger.warning(f"{len(six_wu_done)} jobs already in "
+                                     "sixtrack_wu table.")
+            self._insert_new_wu('preprocess_wu', prep_to_be_inserted)
+            self._insert_new_wu('sixtrack_wu', six_to_be_inserted)
+
+    def _next_wu_id(self, table):
+        '''The wu_id following the largest one of a work unit table'''
+        max_id = self.db.select(table, 'max(wu_id)')[0][0]
+        return (max_id or 0) + 1
+
+    def _stored_wu_ids(self, table, hashes):
+        '''Finds the wu_id of the work units already stored in a table with
+        the indexed param_hash column, in batches of 500 hashes.
+
+        Args:
+            table (str): 'preprocess_wu' or 'sixtrack_wu'.
+            hashes (iterable): the param_hash values.
+
+        Returns:
+            dict: param_hash --> wu_id of the stored work units.
+        '''
+        hashes = list(hashes)
+        stored = {}
+        for i in range(0, len(hashes), 500):
+            # the hashes are hex digests, safe to inline
+            vals = ', '.join(f"'{j}'" for j in hashes[i:i + 500])
+            stored.update(self.db.select(table, ['param_hash', 'wu_id'],
+                                         f'param_hash in ({vals})'))
+        return stored
+
+    def _hash_keys(self, table):
+        '''The parameters entering the param_hash column of a work unit
+        table. The outputs of the calculation queue are left out, they are
+        overwritten by _run_calcs after the insertion.'''
+        if table == 'preprocess_wu':
+            keys = list(self.params.madx.keys())
+        else:
+            keys = (list(self.params.sixtrack.keys()) +
+                    list(self.params.phasespace.keys()) + ['preprocess_id'])
+        calc_keys = [k for f in self.params.calc_queue for k in
+                     getattr(f, 'output_keys', [])]
+        return [k for k in keys if k not in calc_keys]
+
+    def _fill_param_hash(self, table):
+        '''Computes the missing param_hash of the rows of a work unit table,
+        e.g. in databases of older studies. The later checkpoint/restart
+        segments of a sixtrack work unit have no param_hash, they are found
+        with (wu_id, last_turn).'''
+        keys = self._hash_keys(table)
+        prim = self.table_keys[table]['primary']
+        where = 'param_hash is null'
+        if table == 'sixtrack_wu':
+            where += ' and first_turn is null'
+        while True:
+            outputs = self.db.select(table, prim + keys, where,
+                                     limit=self.update_chunk_size)
+            if not outputs:
+                break
+            outputs = list(zip(*outputs))
+            keys_where = dict(zip(prim, outputs))
+            hashes = [utils.param_hash(keys, row) for row in
+                      zip(*outputs[len(prim):])]
+            self.db.updatem(table, {'param_hash': hashes}, keys_where)
+
+    def _insert_new_wu(self, table, rows):
+        '''Inserts the work units whose param_hash isn't in the table yet,
+        found by _update_db_params. A conflict on the wu_id or param_hash
+        raises instead of dropping the row.
+
+        Args:
+            table (str): 'preprocess_wu' or 'sixtrack_wu'.
+            rows (list): the rows as dicts with the same keys.
+        '''
+        if not rows:
+            return
+        count = self.db.insertm(table, {k: [row[k] for row in rows]
+                                        for k in rows[0]})
+        if count:
+            self._logger.info(f"Stored {count} jobs in {table}.")
+
+    def lookup_wu(self, params, table='sixtrack_wu', columns=None):
+        '''Finds the work unit of a point of the parameter space with an
+        index probe on the param_hash column, e.g. to know whether a point
+        is already done in this study.
+
+        Args:
+            params (dict): the scan parameters of the point, the sixtrack
+                parameters must include the preprocess_id.
+            table (str, optional): 'preprocess_wu' or 'sixtrack_wu'.
+            columns (list, optional): the returned columns, defaults to
+                wu_id, status and task_id.
+
+        Returns:
+            list: the matching rows, empty if the point isn't in the table.
+
+        Raises:
+            ValueError: If a parameter of the hash is missing.
+        '''
+        keys = self._hash_keys(table)
+        missing = [k for k in keys if k not in params.keys()]
+        if missing:
+            raise ValueError(f"Missing parameters {missing}!")
+        if columns is None:
+            columns = ['wu_id', 'status', 'task_id']
+        values = [json.dumps(params[k]) if isinstance(params[k], tuple)
+                  else params[k] for k in keys]
+        where = f"param_hash='{utils.param_hash(keys, values)}'"
+        return self.db.select(table, columns, where)
 
     def _prep_preprocessing_cfg(self):
         '''Prepares the preprocess job config dict.
@@ -356,6 +503,7 @@ class Study(object):
         self.preprocess_config['madx']['oneturn'] = json.dumps(self.oneturn)
         self.preprocess_config['madx']['collimation'] = json.dumps(self.collimation)
         self.preprocess_config['madx']['output_files'] = json.dumps(self.madx_output)
+        self.preprocess_config['madx']['compression'] = json.dumps(self.compression)
         if self.oneturn:
             self.preprocess_config['oneturn_sixtrack_results'] = self.tables['oneturn_sixtrack_results']
             # to avoid scanning oneturn jobs, just get the first value of any
@@ -393,6 +541,7 @@ class Study(object):
         self.sixtrack_config['templates']['fort_file'] = json.dumps(self.sixtrack_input['fort_file'])
         self.sixtrack_config['sixtrack']['output_files'] = json.dumps(self.sixtrack_output)
         self.sixtrack_config['sixtrack']['test_turn'] = json.dumps(self.env['test_turn'])
+        self.sixtrack_config['sixtrack']['compression'] = json.dumps(self.compression)
         self.sixtrack_config['six_results'] = self.tables['six_results']
         if self.collimation:
             self.sixtrack_config['aperture_losses'] = self.tables['aperture_losses']
@@ -403,59 +552,56 @@ class Study(object):
 
     def _run_calcs(self):
         '''Runs any input parameter based calculations and updates the results
-        in sixtrack_wu.
+        in sixtrack_wu. The calculations run on all the rows at once, see
+        StudyParams.calc_columns.
         '''
         six_keys = (list(self.params.sixtrack.keys()) +
-                    list(self.params.phasespace.keys()) +
-                    ['wu_id', 'preprocess_id'])
-        # create a dict for each row. This is bulky due to the json.loads :(
-        six_wu_entries = []
-        for row in self.db.select('sixtrack_wu', six_keys):
-            d = {}
-            for k, v in zip(six_keys, row):
+                    list(self.params.phasespace.keys()))
+        names = six_keys + ['wu_id', 'preprocess_id']
+        outputs = self.db.select('sixtrack_wu', names)
+        if not outputs or not self.params.calc_queue:
+            return
+        outputs = dict(zip(names, zip(*outputs)))
+
+        def decode(values):
+            # json.loads each distinct string only once
+            cache = {}
+            out = []
+            for v in values:
                 if isinstance(v, str):
-                    try:
-                        v = json.loads(v)
-                    except json.JSONDecodeError:  # json custom exception
-                        # print(f'json.loads({v}) failed.')
-                        pass
-                d[k] = v
-            six_wu_entries.append(d)
+                    if v not in cache:
+                        try:
+                            cache[v] = json.loads(v)
+                        except json.JSONDecodeError:  # json custom exception
+                            cache[v] = v
+                    v = cache[v]
+                out.append(v)
+            return out
+
+        columns = {k: decode(outputs[k]) for k in six_keys}
         # prepare a map of preprocess_id to task_id
         madx_wu_task = self.db.select('preprocess_task',
                                       ['wu_id', 'task_id'])
         pre_to_task_id = dict(madx_wu_task)
-
-        calc_out_to_be_updated = []
-        where_to_be_updated = []
-        # run the calculations
-        for row in six_wu_entries:
-            result = self.params.calc(row,
-                                      task_id=pre_to_task_id[row['preprocess_id']],
-                                      get_val_db=self.db,
-                                      require='all')
-            if result:
-                # only update the columns which need updating
-                update_cols = {}
-                for k, v in result.items():
-                    if k in row.keys():
-                        update_cols[k] = v
-                calc_out_to_be_updated.append(update_cols)
-                where_to_be_updated.append({'wu_id': row['wu_id']})
-                self._logger.info('Queued update of sixtack_wu/wu_id:'
-                                  f'{row["wu_id"]} with {update_cols}.')
-
-        # update everything at once
-        self._logger.info(f'Updating {len(calc_out_to_be_updated)} rows of '
-                          'sixtrack_wu.')
-        # turn list of dicts into dict of lists
-        calc_out_to_be_updated = {k: [dic[k] for dic in calc_out_to_be_updated]
-                                  for k in calc_out_to_be_updated[0]}
-        where_to_be_updated = {k: [dic[k] for dic in where_to_be_updated]
-                               for k in where_to_be_updated[0]}
-        self.db.updatem('sixtrack_wu',
-                        calc_out_to_be_updated,
-                        where=where_to_be_updated)
+        task_ids = [pre_to_task_id[i] for i in outputs['preprocess_id']]
+
+        # run the calculations, the required values may have changed since
+        # the last call
+        self.params.clear_required_cache()
+        result = self.params.calc_columns(columns, task_ids=task_ids,
+                                          get_val_db=self.db, require='all')
+        self._logger.info('Required values cache: '
+                           f'{self.params.required_cache_hits} hits, '
+                           f'{self.params.required_cache_misses} misses.')
+        # only update the columns which need updating
+        update_cols = {k: v.tolist() for k, v in result.items()
+                       if k in six_keys}
+        if not update_cols:
+            return
+        self._logger.info(f'Updating {len(task_ids)} rows of sixtrack_wu '
+                          f'with {list(update_cols.keys())}.')
+        self.db.updatem('sixtrack_wu', update_cols,
+                        where={'wu_id': list(outputs['wu_id'])})
 
     def update_db(self, db_check=False):
         '''Update the database whith the user-defined parameters'''
@@ -468,27 +614,7 @@ class Study(object):
             if r not in cont:
                 content = "The required file %s isn't found in %s!" % (r, temp)
                 raise FileNotFoundError(content)
-        outputs = self.db.select('templates', self.tables['templates'].keys())
-        tab = {}
-        for key, value in self.madx_input.items():
-            value = os.path.join(self.study_path, value)
-            tab[key] = utils.compress_buf(value)
-        value = os.path.join(self.study_path, self.sixtrack_input['fort_file'])
-        tab['fort_file'] = utils.compress_buf(value)
-        if self.collimation:
-            for key in self.collimation_input.keys():
-                val = os.path.join(self.study_path,
-                                   self.collimation_input[key])
-                tab[key] = utils.compress_buf(val)
-        if 'additional_input' in self.sixtrack_input.keys():
-            inp = self.sixtrack_input['additional_input']
-            for key in inp:
-                value = os.path.join(self.study_path, key)
-                tab[key] = utils.compress_buf(value)
-        if not outputs:
-            self.db.insert('templates', tab)
-        else:
-            self.db.update('templates', tab)
+        self._update_templates()
 
         outputs = self.db.select('boinc_vars', self.boinc_vars.keys())
         if not outputs:
@@ -507,7 +633,47 @@ class Study(object):
             self.db.update('env', envs)
 
         # update preprocess_wu and sixtrack_wu with parameter combinations.
-        self._update_db_params()
+        with self.db.transaction():
+            self._update_db_params()
+
+    def _update_templates(self):
+        '''Stores the templates in the database. The files are hashed and
+        compared with the hashes of the stored ones, only the changed
+        templates are compressed, in parallel, and the blob columns are never
+        read back.'''
+        files = {}
+        for key, value in self.madx_input.items():
+            files[key] = os.path.join(self.study_path, value)
+        files['fort_file'] = os.path.join(self.study_path,
+                                          self.sixtrack_input['fort_file'])
+        if self.collimation:
+            for key, value in self.collimation_input.items():
+                files[key] = os.path.join(self.study_path, value)
+        if 'additional_input' in self.sixtrack_input.keys():
+            for key in self.sixtrack_input['additional_input']:
+                files[key] = os.path.join(self.study_path, key)
+
+        hashes = {k: utils.file_hash(v) for k, v in files.items()}
+        outputs = self.db.select('templates', ['file_hashes'])
+        stored = {}
+        if outputs and outputs[0][0]:
+            stored = json.loads(outputs[0][0])
+        changed = [k for k in files if hashes[k] != stored.get(k)]
+        if outputs and not changed:
+            self._logger.info("The templates are up to date.")
+            return
+        # zlib releases the GIL, the big collimation files are compressed
+        # concurrently
+        with ThreadPoolExecutor(min(len(changed), os.cpu_count() or 1)) as ex:
+            bufs = ex.map(lambda f: utils.compress_buf(f, **self.compression),
+                          [files[k] for k in changed])
+            tab = {k: self.db.put_blob(buf) for k, buf in zip(changed, bufs)}
+        tab['file_hashes'] = json.dumps(hashes)
+        if not outputs:
+            self.db.insert('templates', tab)
+        else:
+            self.db.update('templates', tab)
+        self._logger.info(f"Stored the templates {changed}.")
 
     def info(self, job=2, verbose=False, where=None):
         '''Print the status information of this study.
@@ -523,27 +689,15 @@ class Study(object):
         titles = ['madx and one turn sixtrack jobs:', 'Sixtrack jobs:']
 
         def query(index):
-            wus = self.db.select(typ[int(index)], query_list, where)
-            content = '\n'+titles[int(index)] + '\n'
-            comp = []
-            subm = []
-            incm = []
-            if wus:
-                results = dict(zip(query_list, zip(*wus)))
-                for ele in results['status']:
-                    if ele == 'complete':
-                        comp.append(ele)
-                    if ele == 'submitted':
-                        subm.append(ele)
-                    if ele == 'incomplete':
-                        incm.append(ele)
-            content += f'complete: {len(comp)} \n'
-            content += f'submitted: {len(subm)} \n'
-            content += f'incomplete: {len(incm)}\n'
+            counts = self.status_counts(typ[index], where)
+            content = '\n'+titles[index] + '\n'
+            content += f"complete: {counts.get('complete', 0)} \n"
+            content += f"submitted: {counts.get('submitted', 0)} \n"
+            content += f"incomplete: {counts.get('incomplete', 0)}\n"
             self._logger.info(content)
             if verbose:
                 print(query_list)
-                for i in wus:
+                for i in self.db.iter_select(typ[index], query_list, where):
                     print(i)
 
         if job == 0 or job == 2:
@@ -551,6 +705,84 @@ class Study(object):
         if job == 1 or job == 2:
             query(1)
 
+    def status_counts(self, table='sixtrack_wu', where=None, per_batch=False,
+                      max_age=None):
+        '''Count the jobs per status, the counting is done by the database
+        with a GROUP BY on the indexed status column.
+
+        Args:
+            table (str, optional): 'preprocess_wu' or 'sixtrack_wu'.
+            where (str, optional): selection condition of the counted jobs.
+            per_batch (bool, optional): if True count per batch_name too.
+            max_age (float, optional): reuse the result of a previous call
+                with the same arguments made less than max_age seconds ago,
+                useful in polling loops.
+
+        Returns:
+            dict: status --> number of jobs, or batch_name --> (status -->
+                number of jobs) if per_batch.
+
+        Raises:
+            ValueError: If the table isn't a work unit table.
+        '''
+        if table not in ['preprocess_wu', 'sixtrack_wu']:
+            raise ValueError(f"Unknown work unit table {table}!")
+        key = (table, where, per_batch)
+        now = time.time()
+        if max_age is not None and key in self._status_cache:
+            mtime, counts = self._status_cache[key]
+            if now - mtime < max_age:
+                return counts
+
+        groups = ['batch_name', 'status'] if per_batch else ['status']
+        outputs = self.db.select(table, ', '.join(groups + ['count(*)']),
+                                 where, groupby=groups)
+        counts = {}
+        for row in outputs:
+            if per_batch:
+                counts.setdefault(row[0], {})[row[1]] = row[2]
+            else:
+                counts[row[0]] = row[1]
+        self._status_cache[key] = (now, counts)
+        return counts
+
+    def results(self, table, columns=None, where=None, orderby=None,
+                as_dict=False):
+        '''Get the content of a result table as NumPy arrays.
+
+        The column selection and the filter are done by the database, the
+        dtypes are taken from the table definitions, e.g. six_results.
+
+        Args:
+            table (str): table name, e.g. 'six_results', 'aperture_losses'.
+            columns (list, optional): column names, all the columns if None.
+            where (str, optional): selection condition, e.g. 'turn_max>1000'.
+            orderby (list, optional): order condition.
+            as_dict (bool, optional): if True return a dict of column arrays
+                instead of a structured array.
+
+        Returns:
+            numpy.ndarray or dict: structured array with one field per column
+                or dict column name --> numpy.ndarray.
+        '''
+        if table not in self.tables.keys():
+            raise ValueError(f"Unknown table {table}!")
+        schema = self.tables[table]
+        if columns is None:
+            columns = list(schema.keys())
+        unknown = [c for c in columns if c not in schema.keys()]
+        if unknown:
+            raise ValueError(f"Unknown columns {unknown} in table {table}!")
+        dtypes = [dbtypedict.numpy_dtype(schema[c]) for c in columns]
+        out = self.db.select_columns(table, columns, dtypes, where, orderby)
+        if as_dict:
+            return out
+        nrows = len(out[columns[0]]) if columns else 0
+        data = np.empty(nrows, dtype=[(c, out[c].dtype) for c in columns])
+        for c in columns:
+            data[c] = out[c]
+        return data
+
     def submit(self, typ, trials=5, *args, **kwargs):
         '''Sumbit the preporcess or sixtrack jobs to htctondor.
         @type(0,1 or 2) The job type, 0 is preprocess job, 1 is sixtrack job,
@@ -588,18 +820,19 @@ class Study(object):
         if status:
             content = "Submit %s job successfully!" % jobname
             self._logger.info(content)
-            table = {}
-            table['status'] = 'submitted'
             self._logger.info(f"Updating the {table_name} table for job status.....")
-            bar = utils.ProgressBar(len(out))
+            # a grouped job 'id1-id2-...' gives its unique id to every task
+            task_ids = []
+            unique_ids = []
             for ky, vl in out.items():
-                bar.update()
                 keys = ky.split('-')
-                for k in keys:
-                    where = 'task_id=%s' % k
-                    table['unique_id'] = vl
-                    table['batch_name'] = batch_name
-                    self.db.update(table_name, table, where)
+                task_ids.extend(map(int, keys))
+                unique_ids.extend([vl] * len(keys))
+            table = {}
+            table['status'] = ['submitted'] * len(task_ids)
+            table['unique_id'] = unique_ids
+            table['batch_name'] = [batch_name] * len(task_ids)
+            self.db.updatem(table_name, table, {'task_id': task_ids})
         else:
             content = "Failed to submit %s job!" % jobname
             self._logger.error(content)
@@ -610,6 +843,10 @@ class Study(object):
         info_sec = {}
         config['info'] = info_sec
         config['db_setting'] = self.db_settings
+        info_sec['commit_every'] = self.gather_commit_every
+        info_sec['workers'] = self.gather_workers
+        info_sec['incremental'] = self.gather_incremental
+        info_sec['compression'] = self.compression
         config['db_info'] = self.db_info
 
         if typ == 0:
@@ -643,6 +880,11 @@ class Study(object):
         except Exception as e:
             raise e
 
+        if typ == 1 and self.cr_auto and self.prepare_cr_segments():
+            # chain the next segments of the completed jobs right away
+            self.prepare_sixtrack_input(boinc=boinc)
+            self.submit(1)
+
     def prepare_sixtrack_input(self, resubmit=False, boinc=False, groupby=None,
                                *args, **kwargs):
         '''Prepare the input files for sixtrack job'''
@@ -654,24 +896,27 @@ class Study(object):
         self._run_calcs()
 
         self._logger.info("Going to prepare input files for sixtrack jobs....")
-        if self.checkpoint_restart:
+        if self.cr_auto:
+            self.prepare_cr_segments()
+        elif self.checkpoint_restart:
             self.prepare_cr()
 
         where = "status='complete'"
-        preprocess_outs = self.db.select('preprocess_wu', ['wu_id'], where)
+        preprocess_outs = self.db.select('preprocess_wu', ['wu_id'], where,
+                                         limit=1)
         if not preprocess_outs:
             content = "There isn't complete madx job!"
             self._logger.warning(content)
             return
-        preprocess_outs = list(zip(*preprocess_outs))
 
         if resubmit:
             constraints = "status='submitted'"
             action = 'resubmit'
         else:
-            constraints = "status='incomplete' and preprocess_id in %s" % str(
-                preprocess_outs[0])
+            constraints = ("status='incomplete' and preprocess_id in (SELECT "
+                           "wu_id FROM preprocess_wu WHERE status='complete')")
             action = 'submit'
+        self._allocate_tasks('sixtrack', constraints)
         names = self.tables['sixtrack_wu'].keys()
         outputs = self.db.select('sixtrack_wu',
                                  names,
@@ -685,132 +930,30 @@ class Study(object):
         outputs['boinc'] = ['false'] * len(outputs['wu_id'])
         if boinc:
             outputs['boinc'] = ['true'] * len(outputs['wu_id'])
-
-        task_table = {}
-        wu_table = {}
-        task_ids = OrderedDict()
-        mtime = int(time.time() * 1E7)
-        task_table['wu_id'] = []
-        task_table['last_turn'] = []
-        task_table['mtime'] = []
-        self._logger.info("creating new lines in sixtrack_task table.....")
-        bar = utils.ProgressBar(len(outputs['last_turn']))
-        for wu_id, last_turn in zip(outputs['wu_id'], outputs['last_turn']):
-            bar.update()
-            where = f'wu_id={wu_id} and last_turn={last_turn} and status is null'
-            chck = self.db.select('sixtrack_task', ['task_id'], where)
-            if chck:
-                task_id = chck[0][0]
-                task_ids[task_id] = (wu_id, last_turn)
-            else:
-                task_table['wu_id'].append(wu_id)
-                task_table['last_turn'].append(last_turn)
-                task_table['mtime'].append(mtime)
-        if task_table['wu_id']:
-            self.db.insertm('sixtrack_task', task_table)
-            reviews = self.db.select('sixtrack_task',
-                                     ['task_id', 'wu_id', 'last_turn'],
-                                     where=f'mtime={mtime}')
-            for ti, wi, lt in reviews:
-                task_ids[ti] = (wi, lt)
-        wu_table['task_id'] = list(task_ids.keys())
-        wu_table['mtime'] = [int(time.time() * 1E7), ]*len(task_ids)
-        where = {}
-        where['wu_id'] = []
-        where['last_turn'] = []
-        for i in task_ids.values():
-            where['wu_id'].append(i[0])
-            where['last_turn'].append(i[1])  # wu_id is not unique now
-        self.db.updatem('sixtrack_wu', wu_table, where)
-
-        task_ids = list(task_ids.keys())
-        outputs['task_id'] = task_ids
+        task_ids = list(outputs['task_id'])
         db_info = {}
         db_info.update(self.db_info)
 
+        if groupby:
+            task_ids = self._group_records(outputs, groupby)
+
         tran_input = []
+        bundles = None
         if db_info['db_type'].lower() == 'sql':
-            sub_name = os.path.join(self.paths['sixtrack_in'], 'sub.db')
-            if os.path.exists(sub_name):
-                os.remove(sub_name)  # remove the old one
-            db_info['db_name'] = sub_name
-
-            sub_db = SixDB(db_info, settings=self.db_settings, create=True)
-            sub_db.create_table('preprocess_wu', self.tables['preprocess_wu'],
-                                self.table_keys['preprocess_wu'])
-            sub_db.create_table('preprocess_task',
-                                self.tables['preprocess_task'],
-                                self.table_keys['preprocess_task'])
-            sub_db.create_table('sixtrack_wu_tmp', self.tables['sixtrack_wu'],
-                                self.table_keys['sixtrack_wu'])
-            sub_db.create_table('sixtrack_wu', self.tables['sixtrack_wu'],
-                                self.table_keys['sixtrack_wu'])
-            sub_db.create_table('env', self.tables['env'])
-            sub_db.create_table('templates', self.tables['templates'])
-
-            env_outs = self.db.select('env')
-            names = list(self.tables['env'].keys())
-            env_ins = dict(zip(names, zip(*env_outs)))
-            sub_db.insertm('env', env_ins)
-
-            temp_outs = self.db.select('templates')
-            names = list(self.tables['templates'].keys())
-            temp_ins = dict(zip(names, zip(*temp_outs)))
-            sub_db.insertm('templates', temp_ins)
-
-            constr = "wu_id in (%s)" % (','.join(map(str, outputs['preprocess_id'])))
-
-            pre_outs = self.db.select('preprocess_wu', where=constr)
-            names = list(self.tables['preprocess_wu'].keys())
-            pre_ins = dict(zip(names, zip(*pre_outs)))
-            sub_db.insertm('preprocess_wu', pre_ins)
-
-            pre_task_ids = pre_ins['task_id']
-            constr = "task_id in (%s)" % (','.join(map(str, pre_task_ids)))
-            pre_task_outs = self.db.select('preprocess_task', where=constr)
-            names = list(self.tables['preprocess_task'].keys())
-            pre_task_ins = dict(zip(names, zip(*pre_task_outs)))
-            if resubmit:
-                constr = "first_turn is not null and status='submitted'"
-            else:
-                constr = "first_turn is not null and status='incomplete'"
-            cr_ids = self.db.select('sixtrack_wu', ['wu_id', 'first_turn'],
-                                    where=constr)
-            if cr_ids:
-                sub_db.create_table('sixtrack_task',
-                                    self.tables['sixtrack_task'])
-                cr_ids = list(zip(*cr_ids))
-                constr = "wu_id in (%s) and last_turn in (%s)" % (
-                        ','.join(map(str, cr_ids[0])),
-                        ','.join(map(str, map(lambda x: x-1, cr_ids[1]))))
-                cr_wu_outputs = self.db.select('sixtrack_wu', where=constr)
-                if cr_wu_outputs:
-                    names = list(self.tables['sixtrack_wu'].keys())
-                    cr_wu_ins = dict(zip(names, zip(*cr_wu_outputs)))
-                    cr_task_ids = cr_wu_ins['task_id']
-                    constr = "task_id in (%s)" % (','.join(map(str,
-                                                               cr_task_ids)))
-                    task_outputs = self.db.select('sixtrack_task',
-                                                  where=constr)
-                    names = list(self.tables['sixtrack_task'].keys())
-                    task_ins = dict(zip(names, zip(*task_outputs)))
-                    sub_db.insertm('sixtrack_wu', cr_wu_ins)
-                    sub_db.insertm('sixtrack_task', task_ins)
-            sub_db.insertm('preprocess_task', pre_task_ins)
-            sub_db.insertm('sixtrack_wu_tmp', outputs)
-            sub_db.close()
+            bundles = self._prep_sixtrack_bundles(outputs, task_ids, boinc)
             db_info['db_name'] = 'sub.db'
-            content = "The submitted db %s is ready!" % db_info['db_name']
+            content = f"The {len(set(bundles))} submitted dbs are ready!"
             self._logger.info(content)
-            tran_input.append(sub_name)
         else:
             job_table = {}
-            where = "task_id in (%s)" % (','.join(map(str, task_ids)))
             job_table['boinc'] = str(boinc)
-            self.db.update('sixtrack_wu', job_table, where)
+            self.db.update('sixtrack_wu', job_table, constraints)
             self.db.create_table('sixtrack_wu_tmp', self.tables['sixtrack_wu'],
                                  self.table_keys['sixtrack_wu'])
+            self.db.create_index('sixtrack_wu_tmp', 'task_id', ['task_id'])
             if not resubmit:
+                # the jobs track until the end of their segment
+                outputs['turnss'] = outputs['last_turn']
                 self.db.insertm('sixtrack_wu_tmp', outputs)
         if boinc:
             self.init_boinc_dir()
@@ -826,11 +969,91 @@ class Study(object):
         out_path = self.paths['sixtrack_out']
         exe = os.path.join(utils.PYSIXDESK_ABSPATH,
                            'pysixdesk/lib', 'sixtrack.py')
-        if groupby:
-            task_ids = self._group_records(outputs, groupby)
         self.submission.prepare(task_ids, tran_input, exe, 'input.ini',
-                                in_path, out_path, flavour='tomorrow', *args,
-                                **kwargs)
+                                in_path, out_path,
+                                flavour=self.sixtrack_flavour,
+                                bundles=bundles, *args, **kwargs)
+
+    def _prep_sixtrack_bundles(self, outputs, task_ids, boinc):
+        '''Creates the input databases of the sixtrack jobs. The jobs which
+        need the same preprocess outputs share one database, which holds only
+        their rows.
+
+        Args:
+            outputs (dict): the selected sixtrack_wu rows.
+            task_ids (list): the task ids, or lists of task ids, of the jobs.
+            boinc (bool): whether the jobs are submitted to boinc.
+
+        Returns:
+            list: the folder of the input database of each job.
+        '''
+        pre_ids = dict(zip(outputs['task_id'], outputs['preprocess_id']))
+        bundle_path = os.path.join(self.paths['sixtrack_in'], 'bundles')
+        if os.path.exists(bundle_path):
+            shutil.rmtree(bundle_path)  # remove the old ones
+        keys = []
+        members = OrderedDict()
+        for job in task_ids:
+            ids = job if isinstance(job, list) else [job]
+            key = tuple(sorted(set(pre_ids[i] for i in ids)))
+            members.setdefault(key, []).extend(ids)
+            keys.append(key)
+        names = {}
+        for num, (key, ids) in enumerate(members.items()):
+            names[key] = os.path.join(bundle_path, str(num))
+            self._prep_sixtrack_bundle(names[key], key, ids, boinc)
+        return [names[key] for key in keys]
+
+    def _prep_sixtrack_bundle(self, path, pre_ids, task_ids, boinc):
+        '''Creates the input database sub.db of a group of sixtrack jobs.
+
+        Args:
+            path (str): the folder of the database.
+            pre_ids (list): the preprocess wu_ids needed by the jobs.
+            task_ids (list): the task ids of the jobs.
+            boinc (bool): whether the jobs are submitted to boinc.
+        '''
+        os.makedirs(path)
+        sub_name = os.path.join(path, 'sub.db')
+        db_info = {}
+        db_info.update(self.db_info)
+        db_info['db_name'] = sub_name
+        sub_db = SixDB(db_info, settings=self.db_settings, create=True)
+        sub_db.create_table('preprocess_wu', self.tables['preprocess_wu'],
+                            self.table_keys['preprocess_wu'])
+        sub_db.create_table('preprocess_task',
+                            self.tables['preprocess_task'],
+                            self.table_keys['preprocess_task'])
+        sub_db.create_table('sixtrack_wu_tmp', self.tables['sixtrack_wu'],
+                            self.table_keys['sixtrack_wu'])
+        sub_db.create_index('sixtrack_wu_tmp', 'task_id', ['task_id'])
+        sub_db.create_table('sixtrack_wu', self.tables['sixtrack_wu'],
+                            self.table_keys['sixtrack_wu'])
+        sub_db.create_table('sixtrack_task', self.tables['sixtrack_task'])
+        sub_db.create_table('env', self.tables['env'])
+        sub_db.create_table('templates', self.tables['templates'])
+        sub_db.close()
+
+        # the rows are copied by the database, they never enter python
+        with self.db.attach(sub_name, 'sub'), self.db.transaction():
+            self._copy_to_sub('env')
+            self._copy_to_sub('templates')
+            self._copy_to_sub('preprocess_wu', "wu_id in (%s)" %
+                              ','.join(map(str, pre_ids)))
+            self._copy_to_sub('preprocess_task', "task_id in (SELECT task_id "
+                              "FROM sub.preprocess_wu)")
+            self._copy_to_sub('sixtrack_wu', "task_id in (%s)" %
+                              ','.join(map(str, task_ids)),
+                              sub_table='sixtrack_wu_tmp',
+                              exprs={'boinc': f"'{str(boinc).lower()}'",
+                                     'turnss': 'last_turn'})
+            # the checkpoints of the previous turn segments
+            self._copy_to_sub('sixtrack_wu', "EXISTS (SELECT 1 FROM "
+                              "sub.sixtrack_wu_tmp c WHERE c.first_turn is "
+                              "not null and c.wu_id=sixtrack_wu.wu_id and "
+                              "c.first_turn-1=sixtrack_wu.last_turn)")
+            self._copy_to_sub('sixtrack_task', "task_id in (SELECT task_id "
+                              "FROM sub.sixtrack_wu)")
 
     def prepare_preprocess_input(self, resubmit=False, *args, **kwargs):
         '''Prepare the input files for madx and one turn sixtrack job'''
@@ -845,6 +1068,7 @@ class Study(object):
         else:
             constraints = "status='incomplete'"
             info = 'incomplete'
+        self._allocate_tasks('preprocess', constraints)
         results = self.db.select('preprocess_wu', where=constraints)
         if not results:
             content = f"There isn't {info} preprocess job!"
@@ -853,41 +1077,7 @@ class Study(object):
 
         names = list(self.tables['preprocess_wu'].keys())
         outputs = dict(zip(names, zip(*results)))
-        wu_ids = outputs['wu_id']
-        task_table = {}
-        wu_table = {}
-        self._logger.info("creating new lines in preprocess_task table.....")
-        bar = utils.ProgressBar(len(wu_ids))
-        mtime = int(time.time() * 1E7)
-        task_table['wu_id'] = []
-        task_table['mtime'] = []
-        task_ids = OrderedDict()
-        for wu_id in wu_ids:
-            bar.update()
-            where = f'wu_id={wu_id} and status is null'
-            chck = self.db.select('preprocess_task', ['task_id'], where)
-            if chck:
-                task_ids[chck[0][0]] = wu_id
-            else:
-                task_table['wu_id'].append(wu_id)
-                task_table['mtime'].append(mtime)
-                # self.db.insert('preprocess_task', task_table)
-                # where = "mtime=%s and wu_id=%s" % (task_table['mtime'], wu_id)
-                # task_id = self.db.select('preprocess_task', ['task_id'], where)
-                # task_id = task_id[0][0]
-        if task_table['wu_id']:
-            self.db.insertm('preprocess_task', task_table)
-            where = f"mtime={mtime}"
-            task_ids_new = self.db.select('preprocess_task',
-                                          ['wu_id', 'task_id'], where)
-            for i in task_ids_new:
-                task_ids[i[1]] = i[0]
-        wu_table['task_id'] = list(task_ids.keys())
-        wu_table['mtime'] = [int(time.time() * 1E7)] * len(task_ids)
-        where = dict([('wu_id', wu_ids)])
-        self.db.updatem('preprocess_wu', wu_table, where)
-
-        task_ids = list(task_ids.keys())
+        task_ids = list(outputs['task_id'])
         db_info = {}
         db_info.update(self.db_info)
 
@@ -900,13 +1090,10 @@ class Study(object):
             sub_db = SixDB(db_info, settings=self.db_settings, create=True)
             sub_db.create_table('preprocess_wu', self.tables['preprocess_wu'])
             sub_db.create_table('templates', self.tables['templates'])
-            temp_outs = self.db.select('templates')
-            names = list(self.tables['templates'].keys())
-            temp_ins = dict(zip(names, zip(*temp_outs)))
-            sub_db.insertm('templates', temp_ins)
-            outputs['task_id'] = task_ids
             sub_db.insertm('preprocess_wu', outputs)
             sub_db.close()
+            with self.db.attach(sub_name, 'sub'):
+                self._copy_to_sub('templates')
             db_info['db_name'] = 'sub.db'
             content = f"The submitted database {db_info['db_name']} is ready!"
             self._logger.info(content)
@@ -926,6 +1113,62 @@ class Study(object):
         self.submission.prepare(task_ids, trans, exe, 'input.ini', in_path,
                                 out_path, flavour='espresso', *args, **kwargs)
 
+    def _copy_to_sub(self, table, where=None, sub_table=None, exprs={}):
+        '''Copies the rows of a table of the study database to the database
+        attached as "sub", with an INSERT ... SELECT statement.
+
+        Args:
+            table (str): name of the table in the study database.
+            where (str, optional): selection condition of the copied rows.
+            sub_table (str, optional): name of the table in the attached
+                database, defaults to "table".
+            exprs (dict, optional): column name --> sql expression replacing
+                the value of the column.
+        '''
+        if sub_table is None:
+            sub_table = table
+        cols = [k.replace('.', '_') for k in self.tables[table].keys()]
+        sels = [exprs.get(k, f'`{k}`') for k in cols]
+        sql = 'INSERT INTO sub.%s (%s) SELECT %s FROM main.%s' % (
+                sub_table, ','.join([f'`{k}`' for k in cols]), ','.join(sels),
+                table)
+        if where is not None:
+            sql += ' WHERE %s' % where
+        self.db.execute(sql)
+
+    def _allocate_tasks(self, jobtype, constraints):
+        '''Links the selected rows of the work unit table to rows of the task
+        table, in the task_id column.
+
+        A task row which hasn't been used yet (status is null) is reused, a
+        new one is inserted for the other work units. Both steps are done
+        with set-based sql statements, the ids never go through python.
+
+        Args:
+            jobtype (str): 'preprocess' or 'sixtrack'.
+            constraints (str): selection condition on the work unit table.
+        '''
+        wu_name = f'{jobtype}_wu'
+        task_name = f'{jobtype}_task'
+        keys = ['wu_id']
+        if jobtype == 'sixtrack':
+            keys.append('last_turn')  # wu_id is not unique
+        match = ' and '.join([f't.{k}={wu_name}.{k}' for k in keys])
+        match += ' and t.status is null'
+        mtime = int(time.time() * 1E7)
+        self._logger.info(f"creating new lines in {task_name} table.....")
+        with self.db.transaction():
+            sql = (f"INSERT INTO {task_name} ({','.join(keys)}, mtime) "
+                   f"SELECT {','.join(keys)}, {mtime} FROM {wu_name} "
+                   f"WHERE ({constraints}) AND NOT EXISTS "
+                   f"(SELECT 1 FROM {task_name} t WHERE {match})")
+            count = self.db.execute(sql)
+            sql = (f"UPDATE {wu_name} SET task_id=(SELECT min(t.task_id) "
+                   f"FROM {task_name} t WHERE {match}), mtime={mtime} "
+                   f"WHERE {constraints}")
+            self.db.execute(sql)
+        self._logger.info(f"{count} new lines created in {task_name} table.")
+
     def _group_records(self, param_dict, group_key):
         """Groups a 'param_dict' based on the provided 'group_key', and
         returns nested lists of task_ids.
@@ -962,35 +1205,112 @@ class Study(object):
         return task_ids
 
     def prepare_cr(self):
-        '''Prepare the checkpoint data, add new lines in db'''
+        '''Prepare the checkpoint data, add new lines in db for the segment
+        from self.first_turn to self.last_turn.
+
+        Returns:
+            int: the number of new segments, 0 if they all exist already or
+                if there isn't any complete previous segment.
+        '''
         self._logger.info("CR feature is ON, preparing checkpoint data...")
-        checks_1 = self.db.select('sixtrack_wu', ['wu_id'], DISTINCT=True)
-        if checks_1:
-            checks_1 = list(zip(*checks_1))[0]
-        where = f"last_turn={self.last_turn}"
-        checks_2 = self.db.select('sixtrack_wu', ['wu_id'], where)
-        if checks_2:
-            checks_2 = list(zip(*checks_2))[0]
-        checks = [i for i in checks_1 if i not in checks_2]
+        # the new segments are copied from the complete previous segments by
+        # the database, skipping the work units which already have one
+        exprs = {'last_turn': str(self.last_turn),
+                 'first_turn': str(self.first_turn),
+                 'turnss': str(self.last_turn),
+                 'status': "'incomplete'",
+                 'param_hash': 'NULL'}
+        cols = [k.replace('.', '_') for k in self.tables['sixtrack_wu'].keys()]
+        sels = [exprs.get(k, f'w.`{k}`') for k in cols]
+        no_segment = ("NOT EXISTS (SELECT 1 FROM sixtrack_wu n WHERE "
+                      f"n.wu_id=w.wu_id and n.last_turn={self.last_turn})")
+        sql = ("INSERT INTO sixtrack_wu (%s) SELECT %s FROM sixtrack_wu w "
+               "WHERE w.status='complete' and w.last_turn=%s and %s") % (
+                ','.join([f'`{k}`' for k in cols]), ','.join(sels),
+                self.first_turn-1, no_segment)
+        count = self.db.execute(sql)
+        if count:
+            self._logger.info(f"Added {count} tracking jobs with last turn "
+                              f"{self.last_turn}.")
+            return count
+        checks = self.db.select('sixtrack_wu w', ['wu_id'], no_segment,
+                                limit=1)
         if not checks:
             self._logger.info(f"The tracking jobs with last turn "
                               f"{self.last_turn} already exist!")
-            return True
-        constraints = f"status='complete' and last_turn={self.first_turn-1}\
-                and wu_id in ({','.join(map(str, checks))})"
-        results = self.db.select('sixtrack_wu', where=constraints)
-        if not results:
+        else:
             self._logger.warning(f"There isn't complete job with last "
                                  f"turn is {self.first_turn-1}")
-            return False
-        N = len(results)
-        names = self.tables['sixtrack_wu'].keys()
-        new_lines = dict(zip(names, zip(*results)))
-        new_lines['last_turn'] = (self.last_turn,)*N
-        new_lines['first_turn'] = (self.first_turn,)*N
-        new_lines['status'] = ('incomplete',)*N
-        new_lines['turnss'] = (self.last_turn,)*N
-        self.db.insertm('sixtrack_wu', new_lines)
+        return 0
+
+    def cr_segment_turns(self):
+        '''The number of turns of a checkpoint/restart segment which fits in
+        the wall time of the self.sixtrack_flavour jobs.
+
+        The tracking speed is measured on the results of the completed
+        segments, as the turns survived in the segment over the trttime of the
+        job. self.cr_first_segment is used before the first measurement.
+
+        Returns:
+            int: the number of turns of a segment.
+
+        Raises:
+            ValueError: If the wall time is neither given by self.cr_walltime
+                nor known for self.sixtrack_flavour by the cluster class.
+        '''
+        walltime = self.cr_walltime
+        if walltime is None:
+            walltimes = getattr(self.submission, 'walltimes', {})
+            walltime = walltimes.get(self.sixtrack_flavour)
+        if walltime is None:
+            content = (f"Unknown wall time of the {self.sixtrack_flavour} "
+                       f"jobs of {type(self.submission).__name__}, set "
+                       "cr_walltime!")
+            raise ValueError(content)
+        first = 'COALESCE(w.first_turn, 1)'
+        tables = ("six_results r JOIN sixtrack_task t ON t.task_id=r.task_id "
+                  "JOIN sixtrack_wu w ON w.wu_id=t.wu_id and "
+                  "w.last_turn=t.last_turn")
+        where = f"r.trttime>0 and r.sturns1>={first}"
+        outputs = self.db.select(tables, f"sum(r.sturns1-{first}+1), "
+                                 "sum(r.trttime)", where)
+        turns, seconds = outputs[0] if outputs else (None, None)
+        if not turns or not seconds:
+            return self.cr_first_segment
+        speed = turns / seconds
+        segment = int(speed * walltime * self.cr_walltime_fraction)
+        self._logger.info(f"Measured {speed:.1f} turns/s, the segments of "
+                          f"the {self.sixtrack_flavour} jobs have {segment} "
+                          "turns.")
+        return max(segment, 1)
+
+    def prepare_cr_segments(self):
+        '''Adds the next checkpoint/restart segment of the completed sixtrack
+        jobs which haven't reached their turnss yet. The segments are sized by
+        cr_segment_turns, the new rows are copied from the completed ones by
+        the database.
+
+        Returns:
+            int: the number of new segments.
+        '''
+        segment = self.cr_segment_turns()
+        end = (f"CASE WHEN w.last_turn+{segment}<w.turnss THEN "
+               f"w.last_turn+{segment} ELSE w.turnss END")
+        exprs = {'last_turn': end,
+                 'first_turn': 'w.last_turn+1',
+                 'status': "'incomplete'",
+                 'param_hash': 'NULL'}
+        cols = [k.replace('.', '_') for k in self.tables['sixtrack_wu'].keys()]
+        sels = [exprs.get(k, f'w.`{k}`') for k in cols]
+        sql = ("INSERT INTO sixtrack_wu (%s) SELECT %s FROM sixtrack_wu w "
+               "WHERE w.status='complete' and w.last_turn<w.turnss and NOT "
+               "EXISTS (SELECT 1 FROM sixtrack_wu n WHERE n.wu_id=w.wu_id "
+               "and n.first_turn=w.last_turn+1)") % (
+                ','.join([f'`{k}`' for k in cols]), ','.join(sels))
+        count = self.db.execute(sql)
+        if count:
+            self._logger.info(f"Added {count} checkpoint/restart segments.")
+        return count
 
     def init_boinc_dir(self):
         '''Initialise the boinc directory'''
@@ -1,11 +1,15 @@
 import re
+import copy
+import math
+import numbers
 import logging
+import numpy as np
 
 from pathlib import Path
 from collections import OrderedDict
 from itertools import product
 from functools import partial
-from collections.abc import Iterable
+from collections.abc import Iterable, Sequence
 
 from . import machineparams
 from .constants import PROTON_MASS
@@ -51,6 +55,12 @@ class StudyParams:
         self.mask_path = mask_path
         # initialize empty calculation queue
         self.calc_queue = []
+        # cache of the values fetched from the database for the calculations,
+        # (table, columns, task_id) --> first row
+        self.required_cache_size = 4096
+        self._required_cache = OrderedDict()
+        self.required_cache_hits = 0
+        self.required_cache_misses = 0
         # TODO: Figure out how to nicely handle the 'chrom_eps' and 'CHROM'
         # parameters, they are not substituting any placeholders, they are only
         # used in the preprocessing job to do some calculations for the
@@ -102,8 +112,10 @@ class StudyParams:
     def _sixtrack_only(self):
         '''Parameters which are exclusively found in the fort.3
         '''
-        six_only = list(set(self.sixtrack.keys()) - set(self.madx.keys()))
-        return {k: self.sixtrack[k] for k in six_only}
+        # keep the order of self.sixtrack, the order of the combinations
+        # must not change from one session to the other
+        return {k: v for k, v in self.sixtrack.items()
+                if k not in self.madx.keys()}
 
     @property
     def oneturn(self):
@@ -216,6 +228,25 @@ class StudyParams:
         # default to this ?
         return product(*param_dict.values())
 
+    def combination_space(self):
+        '''Gets the combinations of the user provided parameters as a lazy
+        CombinationSpace, which supports len(), indexing and slicing without
+        enumerating the combinations.
+
+        Returns:
+            CombinationSpace: the combinations of the parameters.
+        '''
+        param_dict = self._combinations_prep(**self.madx,
+                                             **self._sixtrack_only,
+                                             **self.phasespace)
+        logic = self.combination_logic
+        if logic is StudyParams.combination_logic:
+            logic = None  # the cartesian product is decoded arithmetically
+        return CombinationSpace(param_dict, self.madx.keys(),
+                                (list(self.sixtrack.keys()) +
+                                 list(self.phasespace.keys())),
+                                logic=logic)
+
     def combinations(self):
         '''Performs the combinations of the user provided parameters.
 
@@ -223,14 +254,7 @@ class StudyParams:
             tuple: a tuple containing 2 dictionaries, the first with the madx
                 parameters, the other with the sixtrack parameters.
         '''
-        param_dict = self._combinations_prep(**self.madx,
-                                             **self._sixtrack_only,
-                                             **self.phasespace)
-        for e in (dict(zip(param_dict.keys(), e))
-                  for e in self.combination_logic(param_dict)):
-            yield ({k: e[k] for k in self.madx.keys()},
-                   {k: e[k] for k in (list(self.sixtrack.keys()) +
-                                      list(self.phasespace.keys()))})
+        yield from self.combination_space()
 
     def calc(self, params, task_id=None, get_val_db=None, require=None):
         """Runs the queued calculations, in order. A dictionary containing the
@@ -254,13 +278,7 @@ class StudyParams:
             dict: Dictionary containing the output of the calculations.
         """
         params = params.copy()
-        if require == 'all':
-            # all the functions
-            queue = self.calc_queue
-        elif require in [None, 'none']:
-            queue = [f for f in self.calc_queue if not hasattr(f, 'require')]
-        else:
-            queue = self._filter_queue(require)
+        queue = self._select_queue(require)
 
         out_dict = {}
         for fun in queue:
@@ -269,14 +287,7 @@ class StudyParams:
             # get additionnal kwargs from db
             required = self._get_required_values(get_val_db, fun, task_id)
             # run functions
-            output = fun(*inputs, **required)
-            if not isinstance(output, tuple):
-                output = tuple([output])
-            if len(output) != len(fun.output_keys):
-                content = (f'The number of outputs of {fun.__name__} does not'
-                           ' match the number of of keys in'
-                           f' {fun.output_keys}.')
-                raise ValueError(content)
+            output = self._check_output(fun, fun(*inputs, **required))
 
             # construct output dict
             o_dict = {}
@@ -290,6 +301,83 @@ class StudyParams:
 
         return out_dict
 
+    def calc_columns(self, columns, task_ids=None, get_val_db=None,
+                     require=None):
+        """Runs the queued calculations, in order, on many rows at once. The
+        functions decorated with set_vectorized(True) are called once with
+        numpy arrays holding all the rows, the others are called row by row.
+        The values required from the database are fetched with one query per
+        table for all the rows.
+
+        Args:
+            columns (dict): parameter name --> values, one value per row. The
+                sequence valued parameters, e.g. amp, become 2D arrays.
+            task_ids (sequence, optional): task_id of the required parameters
+                of each row.
+            get_val_db (SixDB, optional): SixDB object to fecth values from db
+                in for the calculations.
+            require (list, str, optional): selects the calculations like in
+                calc.
+
+        Returns:
+            dict: Dictionary containing the output of the calculations, one
+                numpy array per output.
+        """
+        columns = {k: _calc_column(v) for k, v in columns.items()}
+        nrows = len(next(iter(columns.values())))
+        queue = self._select_queue(require)
+
+        out_dict = {}
+        for fun in queue:
+            inputs = [columns[k] for k in getattr(fun, 'input_keys', [])]
+            required = self._get_required_columns(get_val_db, fun, task_ids)
+            if getattr(fun, 'vectorized', False):
+                output = self._check_output(fun, fun(*inputs, **required))
+                output = [np.broadcast_to(v, (nrows,)) if np.ndim(v) == 0
+                          else _calc_column(v) for v in output]
+            else:
+                # the row by row functions get python values, as in calc
+                inputs = [c.tolist() for c in inputs]
+                required = {k: v.tolist() for k, v in required.items()}
+                rows = []
+                for i in range(nrows):
+                    kwargs = {k: v[i] for k, v in required.items()}
+                    rows.append(self._check_output(
+                        fun, fun(*[c[i] for c in inputs], **kwargs)))
+                output = [_calc_column(list(v)) for v in zip(*rows)]
+                if not rows:
+                    output = [np.array([])] * len(fun.output_keys)
+
+            o_dict = dict(zip(fun.output_keys, output))
+            # make results available for next functions in calc queue
+            columns.update(o_dict)
+            out_dict.update(o_dict)
+
+        return out_dict
+
+    def _select_queue(self, require):
+        '''Selects the functions of the calculation queue to run, see
+        calc.'''
+        if require == 'all':
+            # all the functions
+            return self.calc_queue
+        elif require in [None, 'none']:
+            return [f for f in self.calc_queue if not hasattr(f, 'require')]
+        return self._filter_queue(require)
+
+    @staticmethod
+    def _check_output(fun, output):
+        '''Turns the output of a calculation into a tuple with one element
+        per output key.'''
+        if not isinstance(output, tuple):
+            output = tuple([output])
+        if len(output) != len(fun.output_keys):
+            content = (f'The number of outputs of {fun.__name__} does not'
+                       ' match the number of of keys in'
+                       f' {fun.output_keys}.')
+            raise ValueError(content)
+        return output
+
     def _filter_queue(self, require):
         '''Filters the calculation queue based on the 'require' attribute.
 
@@ -311,6 +399,7 @@ class StudyParams:
 
     def _get_required_values(self, db, fun, task_id):
         '''Gets the values needed in the dict fun.require from the database.
+        The rows are cached, see clear_required_cache.
 
         Args:
             db (SicDB): Database from which to extract the values.
@@ -327,12 +416,87 @@ class StudyParams:
         for r_table, r_list in fun.require.items():
             if not isinstance(r_list, list):
                 r_list = [r_list]
-            r_values = db.select(r_table, r_list, where=f'task_id={task_id}')
-            # convert columns to list of list
-            r_values = zip(*r_values)
-            required.update({k: v[0] for k, v in zip(r_list, r_values)})
+            row = self._required_rows(db, r_table, r_list, [task_id])[0]
+            if row is not None:
+                required.update(dict(zip(r_list, row)))
+        return required
+
+    def _get_required_columns(self, db, fun, task_ids):
+        '''Gets the values needed in the dict fun.require from the database
+        for many rows, with one query per table. The values of each task are
+        broadcast to the rows with this task_id.
+
+        Args:
+            db (SixDB): Database from which to extract the values.
+            fun (callable): calculation queue function.
+            task_ids (sequence): task_id of each row, if None no value is
+                fetched and the function gets its defaults, like calc without
+                task_id.
+
+        Returns:
+            dict: dictionary containing the values of the required parameters,
+                one numpy array per parameter.
+        '''
+        required = {}
+        if not hasattr(fun, 'require') or task_ids is None:
+            return required
+        uniq, inverse = np.unique(np.asarray(task_ids), return_inverse=True)
+        uniq = uniq.tolist()
+        for r_table, r_list in fun.require.items():
+            if not isinstance(r_list, list):
+                r_list = [r_list]
+            rows = self._required_rows(db, r_table, r_list, uniq)
+            for j, k in enumerate(r_list):
+                values = [None if row is None else row[j] for row in rows]
+                required[k] = _calc_column(values)[inverse]
         return required
 
+    def _required_rows(self, db, table, columns, task_ids):
+        '''Gets the first row of the columns of each task, from the cache or
+        with one query for all the tasks missing in the cache.
+
+        Args:
+            db (SixDB): Database from which to extract the values.
+            table (str): table name.
+            columns (list): column names.
+            task_ids (list): task ids.
+
+        Returns:
+            list: one tuple of values per task_id, None if the task has no
+                row.
+        '''
+        cache = self._required_cache
+        keys = [(table, tuple(columns), t) for t in task_ids]
+        missing = [k[2] for k in keys if k not in cache]
+        self.required_cache_misses += len(missing)
+        self.required_cache_hits += len(keys) - len(missing)
+        fetched = {}
+        if missing:
+            where = f"task_id in ({','.join(map(str, missing))})"
+            for row in db.select(table, ['task_id'] + columns, where=where):
+                # keep the first row of each task
+                fetched.setdefault(str(row[0]), tuple(row[1:]))
+        rows = []
+        for key in keys:
+            if key in cache:
+                cache.move_to_end(key)
+                rows.append(cache[key])
+                continue
+            row = fetched.get(str(key[2]))
+            cache[key] = row
+            rows.append(row)
+            if len(cache) > self.required_cache_size:
+                cache.popitem(last=False)
+        return rows
+
+    def clear_required_cache(self):
+        '''Empties the cache of the values fetched from the database for the
+        calculations, e.g. after the required tables are updated, and resets
+        the hit/miss counters.'''
+        self._required_cache.clear()
+        self.required_cache_hits = 0
+        self.required_cache_misses = 0
+
     def __repr__(self):
         '''Unified __repr__ of the three dictionaries.
         '''
@@ -384,6 +548,193 @@ class StudyParams:
         self._remove_none(self.phasespace)
 
 
+class CombinationSpace:
+    '''Lazy view on the combinations of the scan parameters.
+
+    With the default cartesian product, the combination at a given index is
+    decoded arithmetically, so len(), indexing, slicing and index() don't
+    enumerate the combinations and a slice, e.g. space[10**6:2*10**6], can be
+    handed to another process. With a custom combination_logic, the
+    combinations are enumerated once when random access is needed, unless
+    the logic returns a sequence.
+
+    Iterating yields the same (madx dict, sixtrack dict) tuples as
+    StudyParams.combinations.
+    '''
+
+    def __init__(self, param_dict, madx_keys, six_keys, logic=None):
+        """
+        Args:
+            param_dict (dict): parameter name --> list of values.
+            madx_keys (iterable): names of the madx parameters.
+            six_keys (iterable): names of the sixtrack and phasespace
+                parameters.
+            logic (callable, optional): custom combination logic, taking
+                param_dict and returning an iterable of value tuples. The
+                cartesian product if None.
+        """
+        self.param_dict = param_dict
+        self.madx_keys = list(madx_keys)
+        self.six_keys = list(six_keys)
+        self._logic = logic
+        self._keys = list(param_dict.keys())
+        self._sizes = [len(v) for v in param_dict.values()]
+        self._points = None
+        self._range = None
+
+    @property
+    def range(self):
+        '''The indexes of the combinations in this view.'''
+        if self._range is None:
+            if self._logic is None:
+                self._range = range(math.prod(self._sizes))
+            else:
+                self._range = range(len(self._get_points()))
+        return self._range
+
+    def _get_points(self):
+        if self._points is None:
+            points = self._logic(self.param_dict)
+            if not isinstance(points, Sequence):
+                points = list(points)
+            self._points = points
+        return self._points
+
+    def _view(self, rng):
+        view = copy.copy(self)
+        view._range = rng
+        return view
+
+    def _decode(self, index):
+        '''Digits of an index of the cartesian product, the last parameter
+        varies the fastest as in itertools.product.'''
+        digits = []
+        for size in reversed(self._sizes):
+            index, d = divmod(index, size)
+            digits.append(d)
+        return digits[::-1]
+
+    def _values(self, index):
+        if self._logic is None:
+            return [v[d] for v, d in zip(self.param_dict.values(),
+                                         self._decode(index))]
+        return self._get_points()[index]
+
+    def _split(self, values):
+        e = dict(zip(self._keys, values))
+        return ({k: e[k] for k in self.madx_keys},
+                {k: e[k] for k in self.six_keys})
+
+    def __len__(self):
+        return len(self.range)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return self._view(self.range[item])
+        return self._split(self._values(self.range[item]))
+
+    def __iter__(self):
+        if self._logic is not None:
+            if self._range is None and self._points is None:
+                # stream the custom combinations
+                for values in self._logic(self.param_dict):
+                    yield self._split(values)
+                return
+            for i in self.range:
+                yield self._split(self._values(i))
+            return
+        rng = self.range
+        if rng.step != 1 or not rng:
+            for i in rng:
+                yield self._split(self._values(i))
+            return
+        # step through the product like an odometer
+        digits = self._decode(rng.start)
+        values = self.param_dict.values()
+        for _ in rng:
+            yield self._split([v[d] for v, d in zip(values, digits)])
+            for pos in reversed(range(len(digits))):
+                digits[pos] += 1
+                if digits[pos] < self._sizes[pos]:
+                    break
+                digits[pos] = 0
+
+    def index(self, point):
+        '''Finds the position of a combination in this view.
+
+        Args:
+            point (dict): parameter name --> value, must contain all the
+                scanned parameters.
+
+        Returns:
+            int: the position of the combination.
+
+        Raises:
+            ValueError: If the combination isn't in this view.
+        '''
+        values = [point[k] for k in self._keys]
+        if self._logic is None:
+            index = 0
+            for k, v, size in zip(self._keys, values, self._sizes):
+                index = index * size + self.param_dict[k].index(v)
+        else:
+            index = list(self._get_points()).index(tuple(values))
+        return self.range.index(index)
+
+    def chunks(self, size):
+        '''Iterates over the combinations in chunks of columns.
+
+        Args:
+            size (int): number of combinations per chunk.
+
+        Yields:
+            dict: parameter name --> numpy.ndarray of the values of the
+                chunk, object arrays for the non numeric parameters.
+        '''
+        if self._logic is None:
+            columns = [self._column(v) for v in self.param_dict.values()]
+        for start in range(0, len(self), size):
+            rng = self.range[start:start + size]
+            if self._logic is None:
+                index = np.arange(rng.start, rng.stop, rng.step)
+                digits = []
+                for n in reversed(self._sizes):
+                    index, d = np.divmod(index, n)
+                    digits.append(d)
+                digits = digits[::-1]
+                yield {k: c[d] for k, c, d in
+                       zip(self._keys, columns, digits)}
+            else:
+                rows = [self._values(i) for i in rng]
+                yield {k: self._column(list(v)) for k, v in
+                       zip(self._keys, zip(*rows))}
+
+    @staticmethod
+    def _column(values):
+        if all(isinstance(v, numbers.Number) for v in values):
+            return np.array(values)
+        column = np.empty(len(values), dtype=object)
+        for i, v in enumerate(values):
+            column[i] = v
+        return column
+
+
+def _calc_column(values):
+    '''Converts the values of a parameter into a numpy array, numeric when
+    possible, with one row per value.'''
+    if isinstance(values, np.ndarray):
+        return values
+    try:
+        column = np.array(values)
+    except ValueError:  # ragged sequences
+        column = None
+    if column is None or column.dtype == object:
+        column = np.empty(len(values), dtype=object)
+        for i, v in enumerate(values):
+            column[i] = v
+    return column
+
+
 def _set_property(key, value):
     '''Simple decorator to add attributes to functions.
     '''
@@ -397,3 +748,4 @@ def _set_property(key, value):
 set_input_keys = partial(_set_property, 'input_keys')
 set_output_keys = partial(_set_property, 'output_keys')
 set_requirements = partial(_set_property, 'require')
+set_vectorized = partial(_set_property, 'vectorized')
@@ -12,6 +12,10 @@ from .utils import ProgressBar
 
 class Cluster(ABC):
 
+    # the maximum wall time of the job flavours in seconds, used to size the
+    # automatic checkpoint/restart segments
+    walltimes = {}
+
     def __init__(self, temp_path):
         '''Constructor'''
         self._logger = logging.getLogger(__name__)
@@ -41,6 +45,16 @@ class Cluster(ABC):
 class HTCondor(Cluster):
     '''The HTCondor management system'''
 
+    # the maximum wall time of the job flavours in seconds
+    walltimes = {
+        'espresso': 20 * 60,
+        'microcentury': 60 * 60,
+        'longlunch': 2 * 60 * 60,
+        'workday': 8 * 60 * 60,
+        'tomorrow': 24 * 60 * 60,
+        'testmatch': 3 * 24 * 60 * 60,
+        'nextweek': 7 * 24 * 60 * 60}
+
     def __init__(self, temp_path=None):
         '''Constructor'''
         super().__init__(temp_path)
@@ -48,7 +62,7 @@ class HTCondor(Cluster):
         self.sub_name = 'htcondor_run.sub'
 
     def prepare(self, task_ids, trans, exe, exe_args, input_path, output_path,
-                flavour='tomorrow', *args, **kwargs):
+                flavour='tomorrow', bundles=None, *args, **kwargs):
         '''Prepare the submission file.
 
         Args:
@@ -60,6 +74,8 @@ class HTCondor(Cluster):
             input_path (str): The folder with input files
             output_path (str): The output folder
             flavour (str): The queue types of HTCondor
+            bundles (list, optional): The folder of the input files of each
+                job, its content is transferred along with trans.
         '''
         job_list = os.path.join(input_path, 'job_id.list')
         if os.path.exists(job_list):
@@ -68,20 +84,27 @@ class HTCondor(Cluster):
         bar = ProgressBar(len(task_ids))
         with open(job_list, 'w') as f_out:
             val_task_ids = []
-            for i in task_ids:
+            for num, i in enumerate(task_ids):
                 bar.update()
                 if isinstance(i, list):
                     i = '-'.join(map(str, i))
-                val_task_ids.append(i)
                 out_f = os.path.join(output_path, str(i))
                 if os.path.exists(out_f):
                     shutil.rmtree(out_f)
                 os.makedirs(out_f)
+                if bundles is not None:
+                    i = f'{i} {bundles[num]}'
+                val_task_ids.append(i)
             cont = '\n'.join(map(str, val_task_ids))
             f_out.write(cont)
         # os.chmod(job_list, 0o444)  # change the permission to readonly
         trans.append(os.path.join(PYSIXDESK_ABSPATH, 'pysixdesk'))
         rep = {}
+        rep['%items'] = 'wu_id'
+        if bundles is not None:
+            # the trailing slash transfers the content of the folder
+            trans.append('$(bundle)/')
+            rep['%items'] = 'wu_id, bundle'
         rep['%func'] = ', '.join(map(str, trans))
         rep['%exe'] = exe
         rep['%dirname'] = output_path
@@ -121,8 +144,13 @@ class HTCondor(Cluster):
             content = "There isn't %s job for submission!" % job_name
             self._logger.warning(content)
             return False, None
+        jobs = {}  # task id --> line of the job list
         with open(joblist, 'r') as f_in:
-            task_ids = f_in.read().split()
+            for line in f_in:
+                items = line.split()
+                if items:
+                    jobs[items[0]] = line.strip()
+        task_ids = list(jobs.keys())
         scont = 1
         while scont <= trials:
             self._logger.info(f'Submitting jobs to HTCondor....')
@@ -139,7 +167,7 @@ class HTCondor(Cluster):
                     with open(joblist, 'w') as f_out:
                         sub_ids = valid_ids[:limit]
                         valid_ids = list(set(valid_ids)-set(sub_ids))
-                        out_str = '\n'.join(sub_ids)
+                        out_str = '\n'.join([jobs[i] for i in sub_ids])
                         f_out.write(out_str)
                     process = Popen(['condor_submit', '-terse', *args],
                                     stdout=PIPE, stderr=PIPE,
@@ -4,8 +4,13 @@ import re
 import sys
 import math
 import gzip
+import json
+import lzma
+import zlib
 import shutil
+import hashlib
 import logging
+import numbers
 import difflib
 
 # Gobal variables
@@ -122,43 +127,118 @@ def diff(file1, file2, logger=None, **kwargs):
         display(f'▲▲▲▲▲▲▲▲▲▲▲▲▲ {file1} --> {file2} diff ▲▲▲▲▲▲▲▲▲▲▲▲▲')
 
 
-def compress_buf(data, source='file'):
+# the chunk size of the streamed (de)compression
+CHUNK_SIZE = 1 << 20
+# the buffers of the codecs other than gzip start with this header followed by
+# the codec name and a newline, the gzip buffers (all the older ones) are
+# recognized by their magic number
+CODEC_HEADER = b'pysixdesk-codec:'
+GZIP_MAGIC = b'\x1f\x8b'
+CODECS = {}
+
+
+def register_codec(name, compressor, decompressor, level=None):
+    '''Register a compression codec for compress_buf and decompress_buf.
+    @name The codec name, stored in the header of the buffers
+    @compressor A function of the level returning a streaming compressor,
+    with the compress and flush methods
+    @decompressor A function returning a streaming decompressor, with the
+    decompress method and the eof and unused_data attributes
+    @level The default compression level'''
+    CODECS[name] = (compressor, decompressor, level)
+
+
+register_codec('gzip', lambda level: zlib.compressobj(level, zlib.DEFLATED, 31),
+               lambda: zlib.decompressobj(31), 9)
+register_codec('zlib', lambda level: zlib.compressobj(level),
+               zlib.decompressobj, 6)
+register_codec('lzma', lambda level: lzma.LZMACompressor(preset=level),
+               lzma.LZMADecompressor, 6)
+try:
+    import zstandard
+    register_codec('zstd',
+                   lambda level: zstandard.ZstdCompressor(level).compressobj(),
+                   lambda: zstandard.ZstdDecompressor().decompressobj(), 3)
+except ImportError:
+    pass
+
+
+def compress_buf(data, source='file', codec='gzip', level=None):
     '''Data compression for storing in database
-    The data source can be file,gzip,str'''
+    The data source can be file,gzip,str. The files are read in chunks, the
+    gzip files are stored as they are with the default gzip level, else
+    recompressed.
+    @codec One of the registered codecs, gzip, zlib, lzma or zstd (if the
+    zstandard package is installed)
+    @level The compression level, the default of the codec if None'''
+    if codec not in CODECS:
+        raise ValueError(f"Unknown compression codec {codec}!")
+    compressor, _, default = CODECS[codec]
     zbuf = io.BytesIO()
-    if source == 'file' and os.path.isfile(data):
-        with gzip.GzipFile(mode='wb', fileobj=zbuf) as zfile:
+    if source == 'gzip' and os.path.isfile(data):
+        if codec == 'gzip' and level is None:
             with open(data, 'rb') as f_in:
-                buf = f_in.read()
-                zfile.write(buf)
-    elif source == 'gzip' and os.path.isfile(data):
-        with open(data, 'rb') as f_in:
-            shutil.copyfileobj(f_in, zbuf)
+                shutil.copyfileobj(f_in, zbuf, CHUNK_SIZE)
+            return zbuf.getvalue()
+        f_in = gzip.open(data, 'rb')
+    elif source == 'file' and os.path.isfile(data):
+        f_in = open(data, 'rb')
     elif source == 'str' and isinstance(data, str):
-        buf = data.encode()
-        with gzip.GzipFile(mode='wb', fileobj=zbuf) as zfile:
-            zfile.write(buf)
+        f_in = io.BytesIO(data.encode())
     else:
         raise ValueError("Invalid data source!")
+    comp = compressor(default if level is None else level)
+    if codec != 'gzip':
+        zbuf.write(CODEC_HEADER + codec.encode() + b'\n')
+    with f_in:
+        for chunk in iter(lambda: f_in.read(CHUNK_SIZE), b''):
+            zbuf.write(comp.compress(chunk))
+    zbuf.write(comp.flush())
     return zbuf.getvalue()
 
 
+def _decompress_chunks(buf):
+    '''Yield the decompressed chunks of a buffer of compress_buf'''
+    view = memoryview(buf)
+    if buf.startswith(GZIP_MAGIC):
+        codec = 'gzip'
+    elif buf.startswith(CODEC_HEADER):
+        end = buf.index(b'\n')
+        codec = buf[len(CODEC_HEADER):end].decode()
+        view = view[end + 1:]
+    else:
+        raise ValueError("Unknown compression format!")
+    if codec not in CODECS:
+        raise ValueError(f"The compression codec {codec} isn't available!")
+    decompressor = CODECS[codec][1]
+    decomp = decompressor()
+    for start in range(0, len(view), CHUNK_SIZE):
+        data = view[start:start + CHUNK_SIZE]
+        while data:
+            yield decomp.decompress(data)
+            data = getattr(decomp, 'unused_data', b'')
+            if data and getattr(decomp, 'eof', False):
+                # the next member of a multi-member gzip file
+                decomp = decompressor()
+            else:
+                data = b''
+
+
 def decompress_buf(buf, out, des='file'):
-    '''Data decompression to retrieve from database'''
+    '''Data decompression to retrieve from database, the codec is found
+    from the header of the buffer. With des='file' the decompressed data is
+    written to out in chunks.'''
     if not isinstance(buf, bytes):
         raise TypeError('"buf" must be bytes.')
     if des not in ['file', 'buf']:
         raise ValueError('"des" must be "file" or "buf".')
 
-    zbuf = io.BytesIO(buf)
     if des == 'file':
-        with gzip.GzipFile(fileobj=zbuf) as f_in:
-            with open(out, 'wb') as f_out:
-                f_out.write(f_in.read())
+        with open(out, 'wb') as f_out:
+            for chunk in _decompress_chunks(buf):
+                f_out.write(chunk)
     elif des == 'buf':
-        with gzip.GzipFile(fileobj=zbuf) as f_in:
-            out = f_in.read()
-            out = out.decode()
+        out = b''.join(_decompress_chunks(buf)).decode()
     return out
 
 
@@ -249,6 +329,43 @@ def merge_dicts(x, y):
     return z
 
 
+def param_hash(keys, values):
+    """Stable hash of a set of scan parameters, independent of the order of
+    the keys and of the int/float type of the numbers, so the hash of a row
+    read back from the database matches the hash of the input parameters.
+
+    Args:
+        keys (iterable): parameter names.
+        values (iterable): parameter values.
+
+    Returns:
+        str: hex digest of 40 characters.
+    """
+    def canonical(value):
+        if isinstance(value, numbers.Number):
+            return repr(float(value))
+        return str(value)
+
+    items = sorted([k, canonical(v)] for k, v in zip(keys, values))
+    return hashlib.sha1(json.dumps(items).encode()).hexdigest()
+
+
+def file_hash(path):
+    """Hash of the content of a file, read in chunks.
+
+    Args:
+        path (str): the file path.
+
+    Returns:
+        str: hex digest of 40 characters.
+    """
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f_in:
+        for chunk in iter(lambda: f_in.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
 class ProgressBar(object):
     '''
     A very lightweight progress bar to monitor the submit progress
@@ -1,5 +1,7 @@
+import os
 import unittest
 import shutil
+import numpy as np
 from contextlib import closing
 from pathlib import Path
 import sys
@@ -7,6 +9,7 @@ import sys
 pysixdesk_path = str(Path(__file__).parents[2].absolute())
 sys.path.insert(0, pysixdesk_path)
 from pysixdesk.lib import dbadaptor
+from pysixdesk.lib.pysixdb import SixDB
 
 
 class SQLDatabaseAdaptorTest(unittest.TestCase):
@@ -63,6 +66,172 @@ class SQLDatabaseAdaptorTest(unittest.TestCase):
 
         out_select = self.db.select(self.conn, self.name)
         self.assertEqual(out_select, out)
+        out_iter = self.db.iter_select(self.conn, self.name, size=4)
+        self.assertEqual(list(out_iter), out)
+
+        self.db.create_index(self.conn, self.name, 'idx_d', ['d', 'a'])
+        # creating an existing index does nothing
+        self.db.create_index(self.conn, self.name, 'idx_d', ['d', 'a'])
+        with closing(self.conn.cursor()) as c:
+            c.execute(f'PRAGMA index_info(idx_d);')
+            out_index = c.fetchall()
+        self.assertEqual([i[2] for i in out_index], ['d', 'a'])
+
+        self.db.updatem(self.conn, self.name,
+                        {'d': ['x', 'y'], 'c': [b'x', b'y']},
+                        {'a': [2, 4], 'b': [2.23, 4.45]})
+        out = self.db.select(self.conn, self.name, ['a', 'c', 'd'],
+                             where='a in (2, 3, 4)')
+        self.assertEqual(out, [(2, b'x', 'x'), (3, b'blabla', 'blabla'),
+                               (4, b'y', 'y')])
+
+    def test_transaction(self):
+        self.conn.close()
+        db = SixDB({'db_type': 'sql', 'db_name': self.db_name}, create=True)
+        db.create_table(self.name, {'a': 'INT', 'b': 'TEXT'})
+        other = self.db.new_connection(self.db_name)
+
+        def count():
+            return self.db.select(other, self.name, 'count(*)')[0][0]
+
+        with db.transaction():
+            db.insert(self.name, {'a': 1, 'b': 'x'})
+            db.insertm(self.name, {'a': [2, 3], 'b': ['y', 'z']})
+            # nothing is committed before the block exits
+            self.assertEqual(count(), 0)
+        self.assertEqual(count(), 3)
+
+        with self.assertRaises(RuntimeError):
+            with db.transaction():
+                db.update(self.name, {'b': 'w'})
+                db.remove(self.name, 'a=1')
+                raise RuntimeError()
+        self.assertEqual(db.select(self.name, orderby=['a']),
+                         [(1, 'x'), (2, 'y'), (3, 'z')])
+
+        # a nested block only rolls back its own statements
+        with db.transaction():
+            db.update(self.name, {'b': 'w'}, 'a=1')
+            with self.assertRaises(RuntimeError):
+                with db.transaction():
+                    db.remove(self.name, 'a=2')
+                    raise RuntimeError()
+        self.assertEqual(db.select(self.name, orderby=['a']),
+                         [(1, 'w'), (2, 'y'), (3, 'z')])
+        db.update(self.name, {'b': 'x'}, 'a=1')
+        with db.transaction():
+            with db.transaction():
+                db.update(self.name, {'b': 'w'}, 'a=1')
+            self.assertEqual(count(), 3)
+            self.assertEqual(self.db.select(other, self.name, ['b'], 'a=1'),
+                             [('x',)])
+
+        # the schema changes don't commit the open transaction
+        with self.assertRaises(RuntimeError):
+            with db.transaction():
+                db.insert(self.name, {'a': 4, 'b': 'x'})
+                db.create_table('other', {'c': 'INT'})
+                db.add_columns(self.name, {'c': 'INT'})
+                db.create_index(self.name, 'b_index', ['b'])
+                raise RuntimeError()
+        self.assertEqual(count(), 3)
+        self.assertEqual(db.fetch_tables(), [(self.name,)])
+        with self.assertRaises(RuntimeError):
+            with db.transaction(), db.attach(self.db_name, 'sub'):
+                pass
+
+        with db.transaction(commit_every=2):
+            for i in range(4, 9):
+                db.insert(self.name, {'a': i, 'b': 'x'})
+            self.assertEqual(count(), 7)
+        self.assertEqual(count(), 8)
+        other.close()
+        db.close()
+        self.conn = self.db.new_connection(self.db_name)
+
+    def test_select_columns(self):
+        self.conn.close()
+        db = SixDB({'db_type': 'sql', 'db_name': self.db_name}, create=True)
+        db.create_table(self.name, {'a': 'INT', 'b': 'DOUBLE', 'c': 'TEXT'})
+        db.insertm(self.name, {'a': [1, 2, 3], 'b': [1.5, None, 'None'],
+                               'c': ['x', 'y', 'z']})
+        out = db.select_columns(self.name, ['a', 'b', 'c'],
+                                ['i8', 'f8', 'O'], size=2)
+        self.assertEqual(out['a'].dtype, np.dtype('i8'))
+        self.assertEqual(out['a'].tolist(), [1, 2, 3])
+        self.assertEqual(out['b'][0], 1.5)
+        self.assertTrue(np.isnan(out['b'][1:]).all())
+        self.assertEqual(out['c'].tolist(), ['x', 'y', 'z'])
+        out = db.select_columns(self.name, ['a'], ['i8'], where='a>3')
+        self.assertEqual(len(out['a']), 0)
+        db.close()
+        self.conn = self.db.new_connection(self.db_name)
+
+    def test_insert_ignore(self):
+        self.conn.close()
+        db = SixDB({'db_type': 'sql', 'db_name': self.db_name}, create=True)
+        db.create_table(self.name, {'a': 'INT', 'b': 'TEXT'})
+        db.create_indexes({self.name: {'a': 'INT', 'b': 'TEXT'}},
+                          {self.name: {'b': {'columns': ['b'],
+                                             'unique': True}}})
+        self.assertEqual(db.insertm(self.name, {'a': [1, 2],
+                                                'b': ['x', 'y']}), 2)
+        count = db.insertm(self.name, {'a': [3, 4, 5], 'b': ['y', 'z', 'x']},
+                           ignore=True)
+        self.assertEqual(count, 1)
+        self.assertEqual(db.select(self.name, orderby=['a']),
+                         [(1, 'x'), (2, 'y'), (4, 'z')])
+        with self.assertRaises(Exception):
+            db.insertm(self.name, {'a': [6], 'b': ['z']})
+        db.close()
+        self.conn = self.db.new_connection(self.db_name)
+
+    def test_attach(self):
+        self.conn.close()
+        sub_name = str(self.test_folder / 'sub.db')
+        db = SixDB({'db_type': 'sql', 'db_name': self.db_name}, create=True)
+        db.create_table(self.name, {'a': 'INT', 'b': 'TEXT'})
+        db.insertm(self.name, {'a': [1, 2, 3], 'b': ['x', 'y', 'z']})
+        sub_db = SixDB({'db_type': 'sql', 'db_name': sub_name}, create=True)
+        sub_db.create_table(self.name, {'a': 'INT', 'b': 'TEXT'})
+        sub_db.close()
+        with db.attach(sub_name, 'sub'):
+            db.execute(f'INSERT INTO sub.{self.name} SELECT * FROM '
+                       f'main.{self.name} WHERE a>1')
+        with self.assertRaises(RuntimeError):
+            with db.attach(sub_name, 'sub'), db.transaction():
+                db.execute(f'DELETE FROM sub.{self.name}')
+                raise RuntimeError()
+        db.close()
+        sub_db = SixDB({'db_type': 'sql', 'db_name': sub_name})
+        self.assertEqual(sub_db.select(self.name, orderby=['a']),
+                         [(2, 'y'), (3, 'z')])
+        sub_db.close()
+        self.conn = self.db.new_connection(self.db_name)
+
+    def test_blob_store(self):
+        self.conn.close()
+        store = str(self.test_folder / 'blobs')
+        db = SixDB({'db_type': 'sql', 'db_name': self.db_name,
+                    'blob_store': store, 'blob_min_size': '10'}, create=True)
+        db.create_table(self.name, {'a': 'INT', 'b': 'BLOB'})
+        big = b'\x1f\x8b' + bytes(range(100))
+        small = b'\x1f\x8b'
+        refs = [db.put_blob(big), db.put_blob(big), db.put_blob(small)]
+        self.assertEqual(refs[0], refs[1])
+        self.assertEqual(refs[2], small)
+        db.insertm(self.name, {'a': [1, 2, 3], 'b': refs})
+        files = [f for _, _, fs in os.walk(store) for f in fs]
+        self.assertEqual(len(files), 1)
+        out = [db.get_blob(b) for _, b in db.select(self.name, orderby=['a'])]
+        self.assertEqual(out, [big, big, small])
+        db.close()
+        # without the store the references can't be resolved
+        db = SixDB({'db_type': 'sql', 'db_name': self.db_name})
+        with self.assertRaises(ValueError):
+            db.get_blob(db.select(self.name, ['b'], 'a=1')[0][0])
+        db.close()
+        self.conn = self.db.new_connection(self.db_name)
 
     def tearDown(self):
         self.conn.close()
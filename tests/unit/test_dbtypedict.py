@@ -84,6 +84,16 @@ class DBTypeDicTest(unittest.TestCase):
         value = [1, int(1.15e11)]
         self.assertEqual(self.mysql_dict[value], 'BIGINT')
 
+    def test_numpy_dtype(self):
+        self.assertEqual(dbtypedict.numpy_dtype('int'), 'i8')
+        self.assertEqual(dbtypedict.numpy_dtype('INTEGER'), 'i8')
+        self.assertEqual(dbtypedict.numpy_dtype('bigint'), 'i8')
+        self.assertEqual(dbtypedict.numpy_dtype('INT AUTO_INCREMENT'), 'i8')
+        self.assertEqual(dbtypedict.numpy_dtype('float'), 'f8')
+        self.assertEqual(dbtypedict.numpy_dtype('DOUBLE'), 'f8')
+        self.assertEqual(dbtypedict.numpy_dtype('text'), 'O')
+        self.assertEqual(dbtypedict.numpy_dtype('MEDIUMBLOB'), 'O')
+
 
 if __name__ == '__main__':
     unittest.main()
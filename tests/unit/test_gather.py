@@ -0,0 +1,160 @@
+import os
+import gzip
+import time
+import shutil
+import unittest
+from pathlib import Path
+import sys
+# give the test runner the import access
+pysixdesk_path = str(Path(__file__).parents[2].absolute())
+sys.path.insert(0, pysixdesk_path)
+from pysixdesk.lib import gather
+from pysixdesk.lib.dbtable import Table
+from pysixdesk.lib.pysixdb import SixDB
+
+
+class FakeCluster(object):
+    '''Records the calls, the running jobs are given'''
+
+    def __init__(self, running=()):
+        self.calls = []
+        self.running = list(running)
+
+    def check_running(self, *args, **kwargs):
+        self.calls.append('check_running')
+        return self.running
+
+    def download_from_spool(self, *args, **kwargs):
+        self.calls.append('download_from_spool')
+
+    def remove(self, *args, **kwargs):
+        self.calls.append('remove')
+
+
+class GatherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.test_folder = Path('unit_test/gather/')
+        self.type_path = self.test_folder / 'sixtrack_output'
+        self.type_path.mkdir(parents=True, exist_ok=True)
+        self.db_info = {'db_type': 'sql',
+                        'db_name': str(self.test_folder / 'data.db')}
+        self.table = Table({}, {}, 'sql')
+        self.table.customize_tables('sixtrack_task', ['fort.10'],
+                                    'MEDIUMBLOB')
+        tables = {k: self.table.tables[k] for k in
+                  ['sixtrack_wu', 'sixtrack_task', 'six_results',
+                   'gather_manifest']}
+        self.db = SixDB(self.db_info, create=True)
+        self.db.create_tables(tables, self.table.table_keys)
+
+    def test_changed_groups(self):
+        for group in ['1', '2-3']:
+            (self.type_path / group).mkdir()
+        changed = gather.changed_groups(self.db, 'sixtrack', self.type_path)
+        self.assertEqual(set(changed), {'1', '2-3'})
+        gather.update_manifest(self.db, 'sixtrack', changed)
+        self.assertEqual(
+            gather.changed_groups(self.db, 'sixtrack', self.type_path), {})
+
+        # the outputs arrive in 2-3 and 1 is removed
+        time.sleep(0.01)
+        (self.type_path / '2-3' / 'results').mkdir()
+        shutil.rmtree(self.type_path / '1')
+        changed = gather.changed_groups(self.db, 'sixtrack', self.type_path)
+        self.assertEqual(list(changed), ['2-3'])
+        gather.update_manifest(self.db, 'sixtrack', changed)
+        self.assertEqual(self.db.select('gather_manifest', ['path', 'mtime']),
+                         list(changed.items()))
+
+    def test_incremental_gather(self):
+        ids = [1, 2]
+        self.db.insertm('sixtrack_wu', {'wu_id': ids, 'last_turn': [100] * 2,
+                                        'task_id': ids, 'unique_id': ids,
+                                        'status': ['submitted'] * 2})
+        self.db.insertm('sixtrack_task', {'task_id': ids, 'wu_id': ids,
+                                          'last_turn': [100] * 2})
+        (self.type_path / '1').mkdir()
+        (self.type_path / '2').mkdir()
+        cf = {'info': {'path': str(self.type_path), 'incremental': True,
+                       'workers': 1,
+                       'outs': Table.result_table(['fort.10'])},
+              'db_setting': {},
+              'db_info': self.db_info,
+              'six_results': self.table.tables['six_results']}
+        line = ' '.join(['1'] * 60) + '\n'
+
+        def finish():
+            res = self.type_path / '1' / 'results' / '1'
+            res.mkdir(parents=True)
+            with gzip.open(res / 'fort.10.gz', 'wt') as f_out:
+                f_out.write(line * 3)
+
+        def fail():
+            # only the job log comes back
+            (self.type_path / '2' / 'htcondor.7.0.out').touch()
+
+        # the cluster is only queried when a group directory changed, the
+        # pending ones are recorded too
+        steps = [(None, ['1', '2'], True, 0), (None, ['1', '2'], False, 0),
+                 (finish, ['2'], True, 3), (None, ['2'], False, 3),
+                 (fail, [], True, 3), (None, [], False, 3)]
+        for action, running, queried, rows in steps:
+            if action is not None:
+                action()
+            cluster = FakeCluster(running)
+            gather.gather_results('sixtrack', cf, cluster)
+            self.assertEqual(bool(cluster.calls), queried)
+            self.assertEqual(self.db.select('six_results', 'count(*)'),
+                             [(rows,)])
+            self.assertEqual(
+                gather.changed_groups(self.db, 'sixtrack', self.type_path), {})
+        self.assertEqual(os.listdir(self.type_path), ['2'])
+
+    def test_incremental_running(self):
+        self.db.insertm('sixtrack_wu', {'wu_id': [1], 'last_turn': [100],
+                                        'task_id': [1], 'unique_id': [1],
+                                        'status': ['submitted']})
+        self.db.insertm('sixtrack_task', {'task_id': [1], 'wu_id': [1],
+                                          'last_turn': [100]})
+        cf = {'info': {'path': str(self.type_path), 'incremental': True,
+                       'workers': 1,
+                       'outs': Table.result_table(['fort.10'])},
+              'db_setting': {},
+              'db_info': self.db_info,
+              'six_results': self.table.tables['six_results']}
+        # the results are transferred before the job leaves the queue
+        res = self.type_path / '1' / 'results' / '1'
+        res.mkdir(parents=True)
+        with gzip.open(res / 'fort.10.gz', 'wt') as f_out:
+            f_out.write(' '.join(['1'] * 60) + '\n')
+        gather.gather_results('sixtrack', cf, FakeCluster(['1']))
+        self.assertEqual(self.db.select('gather_manifest', 'count(*)'),
+                         [(0,)])
+        cluster = FakeCluster()
+        gather.gather_results('sixtrack', cf, cluster)
+        self.assertTrue(cluster.calls)
+        self.assertEqual(self.db.select('six_results', 'count(*)'), [(1,)])
+        self.assertEqual(self.db.select('sixtrack_wu', ['status']),
+                         [('complete',)])
+
+    def test_manifest_quotes(self):
+        (self.type_path / "it's").mkdir()
+        changed = gather.changed_groups(self.db, 'sixtrack', self.type_path)
+        gather.update_manifest(self.db, 'sixtrack', changed)
+        gather.update_manifest(self.db, 'sixtrack', changed)
+        self.assertEqual(self.db.select('gather_manifest', ['path']),
+                         [("it's",)])
+        shutil.rmtree(self.type_path / "it's")
+        self.assertEqual(
+            gather.changed_groups(self.db, 'sixtrack', self.type_path), {})
+        self.assertEqual(self.db.select('gather_manifest', 'count(*)'),
+                         [(0,)])
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.test_folder.parent, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+import gzip
+import shutil
+import unittest
+from pathlib import Path
+import sys
+# give the test runner the import access
+pysixdesk_path = str(Path(__file__).parents[2].absolute())
+sys.path.insert(0, pysixdesk_path)
+from pysixdesk.lib import resultparser
+from pysixdesk.lib import utils
+from pysixdesk.lib.pysixdb import SixDB
+
+
+class ResultParserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.test_folder = Path('unit_test/resultparser/')
+        self.test_folder.mkdir(parents=True, exist_ok=True)
+
+    def test_parse_rows(self):
+        types = ['int', 'float', 'text']
+        data = b'# header\n1 2.5 a x\n\n2.0E+00 1e-3 b y\n'
+        columns, status = resultparser.parse_rows(data, 4, types)
+        self.assertTrue(status)
+        self.assertEqual(columns, [[1, 2], [2.5, 0.001], ['a', 'b']])
+        self.assertIsInstance(columns[0][0], int)
+        # the malformed lines give rows of 'None'
+        data = b'1 2.5 a x\n1 2\n  # comment\n3 4.5 c z\n'
+        columns, status = resultparser.parse_rows(data, 4, types)
+        self.assertFalse(status)
+        self.assertEqual(columns, [[1, 'None', 3], [2.5, 'None', 4.5],
+                                   ['a', 'None', 'c']])
+        # the values which aren't numbers are kept as text
+        columns, status = resultparser.parse_rows(b'1 1.0D+00\n', 2,
+                                                  ['int', 'float'])
+        self.assertEqual(columns, [[1], ['1.0D+00']])
+        columns, status = resultparser.parse_rows(b'', 2, ['int', 'float'])
+        self.assertTrue(status)
+        self.assertEqual(columns, [[], []])
+        # the long text values aren't truncated
+        long_name = 'tcp.' + 'x' * 100
+        data = f'1 2.5 {long_name} x\n2 3.5 b y\n'.encode()
+        columns, status = resultparser.parse_rows(data, 4, types)
+        self.assertTrue(status)
+        self.assertEqual(columns, [[1, 2], [2.5, 3.5], [long_name, 'b']])
+
+    def test_streamed_result(self):
+        out_f = str(self.test_folder / 'Coll_Scatter.dat.gz')
+        lines = ['# icoll iturn np nabs dp dx dy']
+        lines += [f'{i} 1 2 0 0.5 0.1 0.2' for i in range(25)]
+        lines[12] = '1 2'
+        with gzip.open(out_f, 'wt') as f_out:
+            f_out.write('\n'.join(lines) + '\n')
+        table = {'task_id': 'int', 'row_num': 'int', 'icoll': 'int',
+                 'iturn': 'int', 'np': 'int', 'nabs': 'int', 'dp': 'float',
+                 'dx': 'float', 'dy': 'float', 'mtime': 'bigint'}
+        stream = resultparser.StreamedResult(out_f, table,
+                                             'collimation_losses',
+                                             chunk_lines=10)
+        chunks = list(stream)
+        self.assertEqual([len(c['row_num']) for c in chunks], [9, 10, 6])
+        self.assertEqual(sum([c['row_num'] for c in chunks], []),
+                         list(range(1, 26)))
+        self.assertEqual(chunks[1]['icoll'][:4], [9, 10, 'None', 12])
+        self.assertFalse(stream.status)
+
+        db = SixDB({'db_type': 'sql',
+                    'db_name': str(self.test_folder / 'test.db')},
+                   create=True)
+        db.create_table('collimation_losses', table)
+        self.assertFalse(stream.insert(db, 3))
+        self.assertEqual(db.select('collimation_losses',
+                                   'count(*), max(row_num)', 'task_id=3'),
+                         [(25, 25)])
+
+        # a truncated file only rolls back its own rows
+        lines = [f'{i} 1 2 0 {i / 7:.9f} {i / 3:.9f} 0.2' for i in range(5000)]
+        buf = gzip.compress(('\n'.join(lines) + '\n').encode())
+        with open(out_f, 'wb') as f_out:
+            f_out.write(buf[:len(buf) * 9 // 10])
+        with db.transaction():
+            db.insert('collimation_losses', {'task_id': 4, 'row_num': 1})
+            self.assertFalse(stream.insert(db, 3))
+        self.assertEqual(db.select('collimation_losses', 'count(*)'),
+                         [(26,)])
+        # the database errors aren't hidden
+        stream.tname = 'missing_table'
+        with self.assertRaises(Exception):
+            stream.insert(db, 3)
+        db.close()
+
+    def test_index_outputs(self):
+        job_path = self.test_folder / 'group'
+        self.assertEqual(resultparser.index_outputs(job_path), {})
+        for item in ['1', '2']:
+            (job_path / 'results' / item).mkdir(parents=True)
+        files = ['htcondor.7.0.out', 'results/1/fort.2.gz',
+                 'results/1/fort.20.gz', 'results/1/crpoint_pri.bin.gz',
+                 'results/2/fort.2.gz']
+        for f in files:
+            (job_path / f).touch()
+        index = resultparser.index_outputs(job_path)
+        self.assertEqual(index[None]['job_stdout'],
+                         str(job_path / 'htcondor.7.0.out'))
+        self.assertEqual(index['1']['fort.2'],
+                         str(job_path / 'results/1/fort.2.gz'))
+        self.assertEqual(index['1']['fort.20'],
+                         str(job_path / 'results/1/fort.20.gz'))
+        self.assertEqual(index['1']['crpoint_pri'],
+                         index['1']['crpoint_pri.bin'])
+        self.assertNotIn('fort.20', index['2'])
+
+        # the shared job log goes to all the tasks of the group
+        file_list = {'fort.2': None, 'fort.20': None}
+        for item, outs in [(1, ['fort.2', 'fort.20']), (2, ['fort.2'])]:
+            task_table = {}
+            resultparser.parse_results('sixtrack', item, str(job_path),
+                                       file_list, task_table, {}, index=index)
+            self.assertIn('job_stdout', task_table)
+            self.assertEqual([k for k in file_list if k in task_table], outs)
+            self.assertEqual('crpoint_pri_bin' in task_table, item == 1)
+
+    def test_parse_results_codec(self):
+        job_path = self.test_folder / 'group'
+        (job_path / 'results' / '1').mkdir(parents=True)
+        with gzip.open(job_path / 'results/1/fort.6.gz', 'wt') as f_out:
+            f_out.write('tracking\n')
+        (job_path / 'htcondor.7.0.out').write_text('job log\n')
+        for codec, level in [('gzip', None), ('gzip', 1), ('lzma', None)]:
+            task_table = {}
+            resultparser.parse_results('sixtrack', 1, str(job_path), {},
+                                       task_table, {}, codec=codec,
+                                       level=level)
+            for key, text in [('fort_6', 'tracking\n'),
+                              ('job_stdout', 'job log\n')]:
+                buf = task_table[key]
+                self.assertEqual(buf.startswith(utils.GZIP_MAGIC),
+                                 codec == 'gzip')
+                self.assertEqual(utils.decompress_buf(buf, None, des='buf'),
+                                 text)
+        # the gzip outputs are only recompressed when needed
+        with open(job_path / 'results/1/fort.6.gz', 'rb') as f_in:
+            stored = f_in.read()
+        task_table = {}
+        resultparser.parse_results('sixtrack', 1, str(job_path), {},
+                                   task_table, {})
+        self.assertEqual(task_table['fort_6'], stored)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_folder.parent, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import json
+import unittest
+import shutil
+from unittest import mock
+from pathlib import Path
+import sys
+# give the test runner the import access
+pysixdesk_path = str(Path(__file__).parents[2].absolute())
+sys.path.insert(0, pysixdesk_path)
+from pysixdesk.lib import gather
+from pysixdesk.lib import utils
+from pysixdesk.lib import workspace
+
+
+class StudyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.test_folder = Path('unit_test/study/')
+        self.test_folder.mkdir(parents=True, exist_ok=True)
+        ws = workspace.WorkSpace(str(self.test_folder / 'unit_test_ws'))
+        ws.init_study('unit_test_st')
+        self.st = ws.load_study('unit_test_st')
+        self.st.update_db()
+
+    def test_extend_seeds(self):
+        db = self.st.db
+        prep_rows = db.select('preprocess_wu', ['wu_id', 'i_mo', 'seed_ran'])
+        self.assertEqual(len(prep_rows), 4)
+        self.st.params['seed_ran'] = [1, 2, 3]
+        self.st.update_db()
+        # the stored work units keep their ids, the new ones follow
+        new_rows = db.select('preprocess_wu', ['wu_id', 'i_mo', 'seed_ran'],
+                             orderby=['wu_id'])
+        self.assertEqual(new_rows[:4], sorted(prep_rows))
+        self.assertEqual(sorted(i[2] for i in new_rows[4:]), [3, 3])
+        self.assertEqual([i[0] for i in new_rows[4:]], [5, 6])
+        six_prep_ids = db.select('sixtrack_wu', 'distinct preprocess_id')
+        self.assertTrue({i[0] for i in six_prep_ids} <=
+                        {i[0] for i in new_rows})
+
+    def test_extend_angles(self):
+        db = self.st.db
+        cols = ['wu_id', 'preprocess_id', 'kang', 'param_hash']
+        six_rows = db.select('sixtrack_wu', cols)
+        self.assertEqual(len(six_rows), 16)
+        self.st.params['kang'] = [0, 1, 2]
+        self.st.update_db()
+        # the new points don't take the wu_id of the stored ones
+        new_rows = db.select('sixtrack_wu', cols, orderby=['wu_id'])
+        self.assertEqual(len(new_rows), 24)
+        self.assertEqual(new_rows[:16], sorted(six_rows))
+        self.assertEqual({i[2] for i in new_rows[16:]}, {0})
+        self.assertEqual([i[0] for i in new_rows[16:]], list(range(17, 25)))
+        # nothing is added by a second update
+        self.st.update_db()
+        self.assertEqual(db.select('sixtrack_wu', 'count(*)'), [(24,)])
+
+    def test_fill_param_hash(self):
+        db = self.st.db
+        hashes = db.select('sixtrack_wu', ['wu_id', 'param_hash'])
+        # a database of an older study, backfilled in several chunks
+        db.update('sixtrack_wu', {'param_hash': None})
+        db.update('preprocess_wu', {'param_hash': None})
+        self.st.update_chunk_size = 5
+        self.st.update_db()
+        self.assertEqual(db.select('sixtrack_wu', ['wu_id', 'param_hash']),
+                         hashes)
+        self.assertEqual(db.select('preprocess_wu', 'count(*)',
+                                   'param_hash is null'), [(0,)])
+
+    def test_prepare_cr(self):
+        self.st.first_turn = 101
+        self.st.last_turn = 200
+        # no complete segment ending at turn 100 yet
+        self.assertEqual(self.st.prepare_cr(), 0)
+        self.st.db.update('sixtrack_wu', {'status': 'complete'})
+        self.assertEqual(self.st.prepare_cr(), 16)
+        # the segments already exist
+        self.assertEqual(self.st.prepare_cr(), 0)
+        self.assertEqual(self.st.db.select('sixtrack_wu', 'count(*)',
+                                           'last_turn=200'), [(16,)])
+
+    def test_cr_segment_turns(self):
+        db = self.st.db
+        # no measurement yet
+        self.st.cr_first_segment = 30
+        self.assertEqual(self.st.cr_segment_turns(), 30)
+        # 30 turns in 3 s, the segments fill 80% of the wall time
+        db.insert('sixtrack_task', {'task_id': 1, 'wu_id': 1,
+                                    'last_turn': 100})
+        db.insert('six_results', {'task_id': 1, 'row_num': 1,
+                                  'sturns1': 30, 'trttime': 3.0})
+        self.st.cr_walltime = 5
+        self.assertEqual(self.st.cr_segment_turns(), 40)
+        self.st.cr_walltime = None
+        self.st.sixtrack_flavour = 'espresso'
+        self.assertEqual(self.st.cr_segment_turns(), 9600)
+        self.st.sixtrack_flavour = 'unknown'
+        with self.assertRaises(ValueError):
+            self.st.cr_segment_turns()
+
+    def test_prepare_cr_segments(self):
+        db = self.st.db
+        self.st.cr_auto = True
+        self.st.cr_first_segment = 30
+        # the first segments, as update_db stores them with cr_auto
+        db.update('sixtrack_wu', {'last_turn': 30})
+        self.assertEqual(self.st.prepare_cr_segments(), 0)
+        db.update('sixtrack_wu', {'status': 'complete'})
+        self.assertEqual(self.st.prepare_cr_segments(), 16)
+        self.assertEqual(self.st.prepare_cr_segments(), 0)
+        cols = ['first_turn', 'last_turn', 'status', 'param_hash']
+        self.assertEqual(set(db.select('sixtrack_wu', cols, 'last_turn>30')),
+                         {(31, 60, 'incomplete', None)})
+
+        # the next segments are sized by the measured speed, up to turnss
+        self.st.cr_walltime = 5
+        db.insert('sixtrack_task', {'task_id': 1, 'wu_id': 1,
+                                    'last_turn': 30})
+        db.insert('six_results', {'task_id': 1, 'row_num': 1,
+                                  'sturns1': 30, 'trttime': 3.0})
+        db.update('sixtrack_wu', {'status': 'complete'}, 'last_turn=60')
+        self.assertEqual(self.st.prepare_cr_segments(), 16)
+        self.assertEqual(set(db.select('sixtrack_wu', cols[:2],
+                                       'last_turn>60')), {(61, 100)})
+        db.update('sixtrack_wu', {'status': 'complete'})
+        self.assertEqual(self.st.prepare_cr_segments(), 0)
+
+        # the study is extended, the new points start with a segment
+        self.st.params['kang'] = [0, 1, 2]
+        self.st.update_db()
+        self.assertEqual(db.select('sixtrack_wu', 'count(*)'), [(56,)])
+        self.assertEqual(db.select('sixtrack_wu', ['first_turn', 'last_turn'],
+                                   'kang=0 and wu_id>16'), [(None, 40)] * 8)
+
+    def test_collect_result_chains(self):
+        self.st.cr_auto = True
+        self.st.cr_first_segment = 30
+        self.st.db.update('sixtrack_wu', {'last_turn': 30,
+                                          'status': 'complete'})
+        with mock.patch.object(gather, 'run'), \
+                mock.patch.object(self.st, 'prepare_sixtrack_input') as prep, \
+                mock.patch.object(self.st, 'submit') as submit:
+            self.st.collect_result(1)
+            prep.assert_called_once_with(boinc=False)
+            submit.assert_called_once_with(1)
+            # nothing to chain
+            self.st.collect_result(1)
+            self.assertEqual(submit.call_count, 1)
+
+    def test_compression(self):
+        self.st.compress_codec = 'lzma'
+        self.st.compress_level = 1
+        self.st.db.update('templates', {'file_hashes': None})
+        self.st.update_db()
+        buf = self.st.db.select('templates', ['fort_file'])[0][0]
+        self.assertTrue(buf.startswith(utils.CODEC_HEADER + b'lzma'))
+        self.st._prep_sixtrack_cfg()
+        self.assertEqual(
+            json.loads(self.st.sixtrack_config['sixtrack']['compression']),
+            {'codec': 'lzma', 'level': 1})
+        with mock.patch.object(gather, 'run') as run:
+            self.st.collect_result(1)
+        self.assertEqual(run.call_args[0][1]['info']['compression'],
+                         {'codec': 'lzma', 'level': 1})
+
+    def tearDown(self):
+        self.st.db.close()
+        shutil.rmtree(self.test_folder.parents[0], ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,4 @@
+import json
 import shutil
 import unittest
 import sys
@@ -9,6 +10,7 @@ from pysixdesk.lib.study_params import StudyParams
 from pysixdesk.lib.study_params import set_input_keys
 from pysixdesk.lib.study_params import set_output_keys
 from pysixdesk.lib.study_params import set_requirements
+from pysixdesk.lib.study_params import set_vectorized
 from pysixdesk.lib.pysixdb import SixDB
 
 
@@ -218,12 +220,75 @@ test=%test1; test=%test2; test=%test3
             self.assertTrue('xy' in out_dict.keys())
             self.assertFalse('nss_2' in out_dict.keys())
 
+        # the second pass is answered by the cache
+        self.assertEqual(params.required_cache_misses, 1)
+        for i, e in enumerate(self._manual_combination(params, params.sixtrack)):
+            out_dict = params.calc(e, task_id=i+1, get_val_db=db,
+                                   require=['test_table'])
+            self.assertEqual(out_dict['xy'], x_vals[i] * y_vals[i])
+        self.assertEqual(params.required_cache_misses, 1)
+        self.assertEqual(params.required_cache_hits, 1)
+        params.clear_required_cache()
+        self.assertEqual(params.required_cache_hits, 0)
+
         for e in self._manual_combination(params, params.sixtrack):
             # run calculations which don't need db
             out_dict = params.calc(e, require='none')
             self.assertTrue('nss_2' in out_dict.keys())
             self.assertEqual(out_dict['nss_2'], nss_2_calc(params['nss']))
 
+    def test_calc_columns(self):
+        db_info = {'db_type': 'sql',
+                   'db_name': self.test_folder / 'data.db'}
+        db = SixDB(db_info, create=True)
+        db.create_table('test_table', {'x': 'int', 'task_id': 'int'},
+                        key_info={})
+        db.insertm('test_table', {'x': [10, 20], 'task_id': [1, 2]})
+        params = StudyParams(mask_path=self.mask_file,
+                             fort_path=self.fort_file)
+
+        @set_vectorized(True)
+        @set_input_keys(['amp', 'nss'])
+        @set_output_keys(['amp_0', 'one'])
+        def amp_0(amp, nss):
+            return amp[:, 0] * nss, 1
+        params.calc_queue.append(amp_0)
+
+        @set_requirements({'test_table': ['x']})
+        @set_input_keys(['amp_0'])
+        @set_output_keys(['amp_x'])
+        def amp_x(amp_0, x=None):
+            return amp_0 + x
+        params.calc_queue.append(amp_x)
+
+        @set_input_keys(['amp', 'nss'])
+        @set_output_keys(['amp_json'])
+        def amp_json(amp, nss):
+            # the numpy scalars can't be serialized
+            return json.dumps([amp, nss])
+        params.calc_queue.append(amp_json)
+
+        columns = {'amp': [[8, 10], [10, 12], [12, 14]], 'nss': [1, 2, 3]}
+        out = params.calc_columns(columns, task_ids=[2, 1, 2], get_val_db=db,
+                                  require='all')
+        self.assertEqual(out['amp_0'].tolist(), [8, 20, 36])
+        self.assertEqual(out['one'].tolist(), [1, 1, 1])
+        self.assertEqual(out['amp_x'].tolist(), [28, 30, 56])
+        self.assertEqual(out['amp_json'].tolist()[0], '[[8, 10], 1]')
+        out = params.calc_columns(columns, require='none')
+        self.assertNotIn('amp_x', out)
+
+        # without task_ids the required values are left to the defaults
+        @set_requirements({'test_table': ['x']})
+        @set_input_keys(['nss'])
+        @set_output_keys(['nss_x'])
+        def nss_x(nss, x=5):
+            return nss + x
+        params.calc_queue = [nss_x]
+        out = params.calc_columns(columns, require='all')
+        self.assertEqual(out['nss_x'].tolist(), [6, 7, 8])
+        db.close()
+
     def test_product_dict(self):
         params = StudyParams(mask_path=self.mask_file,
                              fort_path=self.fort_file)
@@ -237,5 +302,42 @@ test=%test1; test=%test2; test=%test3
                                {'a': 2, 'b': 4},
                                ])
 
+    def test_combination_space(self):
+        params = StudyParams(mask_path=self.mask_file,
+                             fort_path=self.fort_file)
+        params['test1'] = [1, 2, 3]
+        params['test2'] = [0.1, 0.2]
+        params['amp'] = [(8, 10), (10, 12)]
+        expected = list(params.combinations())
+        space = params.combination_space()
+        self.assertEqual(len(space), 12)
+        self.assertEqual(list(space), expected)
+        self.assertEqual([space[i] for i in range(-12, 12)], expected * 2)
+        self.assertEqual(list(space[3:10:2]), expected[3:10:2])
+        self.assertEqual(list(space[5:][1:4]), expected[6:9])
+        self.assertEqual(len(space[7:100]), 5)
+        with self.assertRaises(IndexError):
+            space[12]
+
+        point = {**expected[7][0], **expected[7][1]}
+        self.assertEqual(space.index(point), 7)
+        self.assertEqual(space[5:].index(point), 2)
+        with self.assertRaises(ValueError):
+            space[:5].index(point)
+
+        chunks = list(space[1:].chunks(4))
+        self.assertEqual([len(c['test1']) for c in chunks], [4, 4, 3])
+        self.assertEqual(chunks[0]['test1'].tolist(), [1, 1, 1, 2])
+        self.assertEqual(list(chunks[2]['amp']), [(10, 12), (8, 10),
+                                                  (10, 12)])
+
+        # custom combination logic
+        params.combination_logic = lambda d: zip(*d.values())
+        space = params.combination_space()
+        expected = list(params.combinations())
+        self.assertEqual(len(expected), 1)
+        self.assertEqual(len(space), 1)
+        self.assertEqual(space[0], expected[0])
+
     def tearDown(self):
         shutil.rmtree(self.test_folder.parent, ignore_errors=True)
@@ -58,6 +58,30 @@ class SubmissionTest(unittest.TestCase):
         self.jobs = out
         self.assertEqual(list(out.keys()), [str(i) for i in self.wu_ids])
 
+    def test_prepare_bundles(self):
+        input_path = str(self.sub_folder_in.absolute())
+        output_path = str(self.sub_folder_out.absolute())
+        bundles = [f'{input_path}/bundles/{i // 2}' for i in self.wu_ids]
+        self.cluster.prepare(self.wu_ids, self.trans, self.exe, 'dummyarg',
+                             input_path, output_path, bundles=bundles)
+        contents = {}
+        with open(self.sub_folder_in / 'htcondor_run.sub') as f:
+            for line in f:
+                if '=' in line:
+                    line = line.split('=')
+                    contents[line[0].strip()] = line[1].strip()
+                elif line.startswith('queue'):
+                    contents['queue'] = line.strip()
+        self.assertEqual(contents['transfer_input_files'],
+                         ', '.join(self.trans))
+        self.assertEqual(self.trans[-1], '$(bundle)/')
+        self.assertEqual(contents['queue'],
+                         f'queue wu_id, bundle from {input_path}/job_id.list')
+        with open(self.sub_folder_in / 'job_id.list') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines, [f'{i} {b}' for i, b in zip(self.wu_ids,
+                                                             bundles)])
+
     def tearDown(self):
         # remove jobs if they were submitted
         if self.jobs is not None:
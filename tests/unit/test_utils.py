@@ -1,3 +1,4 @@
+import gzip
 import unittest
 import shutil
 from pathlib import Path
@@ -56,6 +57,21 @@ class UtilsTest(unittest.TestCase):
 
         # with gzip ...
 
+    def test_compress_codecs(self):
+        in_str = 'qwertyuiopasdfghjklzxcvbnm_-./' * 1000
+        for codec in utils.CODECS:
+            comp = utils.compress_buf(in_str, source='str', codec=codec,
+                                      level=1)
+            self.assertEqual(utils.decompress_buf(comp, None, des='buf'),
+                             in_str)
+        # the buffers of the older versions are plain gzip
+        comp = gzip.compress(in_str.encode())
+        self.assertEqual(utils.decompress_buf(comp, None, des='buf'), in_str)
+        with self.assertRaises(ValueError):
+            utils.compress_buf(in_str, source='str', codec='unknown')
+        with self.assertRaises(ValueError):
+            utils.decompress_buf(b'not compressed', None, des='buf')
+
     def test_merge_dicts(self):
         a = {'a': 1, 'b': 2, 'c': 3}
         b = {'a': 10}
@@ -70,6 +86,17 @@ class UtilsTest(unittest.TestCase):
         self.assertEqual(a, {'a': 1, 'b': 2, 'c': 3})
         self.assertEqual(b, {'d': 10})
 
+    def test_param_hash(self):
+        h = utils.param_hash(['a', 'b', 'c'], [1, 2.5, '[8, 10]'])
+        self.assertEqual(len(h), 40)
+        # independent of the key order and of the int/float type
+        self.assertEqual(utils.param_hash(['c', 'a', 'b'],
+                                          ['[8, 10]', 1.0, 2.5]), h)
+        self.assertNotEqual(utils.param_hash(['a', 'b', 'c'],
+                                             [1, 2.5, '[8, 12]']), h)
+        self.assertNotEqual(utils.param_hash(['a', 'b', 'c'],
+                                             ['1', 2.5, '[8, 10]']), h)
+
     def test_concatenate_files(self):
         utils.concatenate_files([self.concat_file_in_1, self.concat_file_in_2],
                                 self.concat_file_out)
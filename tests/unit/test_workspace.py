@@ -36,6 +36,7 @@ class WorkSpaceTest(unittest.TestCase):
         load_tables = set([('boinc_vars',),
                            # ('collimation_results',),
                            ('final_state',),
+                           ('gather_manifest',),
                            ('init_state',),
                            ('env',),
                            ('oneturn_sixtrack_results',),